@@ -0,0 +1,18 @@
+"""
+Parts of rhino_coder that gateway.py, rhino_replay.py and the tests use
+without loading the whole CLI:
+
+    rhino_link      connections to the Rhino listener: framing, pool
+    incremental     the runner generated scripts execute in, unwrap_code
+    model_http      HTTP client for the model servers, ModelRouter
+    api_index       rs./Rhino. name index behind the pre-flight check
+    response_cache  on-disk cache of responses whose code ran
+    prompt_budget   token counting and history trimming (fit_history)
+
+Each module keeps its own settings at the top; rhino_coder imports them.
+"""
+
+
+def percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)] if ordered else 0.0
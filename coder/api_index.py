@@ -0,0 +1,245 @@
+"""
+Index of the names reachable from ``rhinoscriptsyntax`` and ``Rhino``.
+
+A script that calls rs.AddRing or rg.Brep.CreatePipeSurface fails in Rhino
+with an AttributeError; the same answer is available locally from the API
+docs parse_docs.py reads, so rhino_coder's pre-flight check sends such
+scripts straight back to the model, and rhino_replay's fake listener answers
+like Rhino would.
+"""
+
+import ast
+import difflib
+import json
+import re
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+API_DOCS_DIR = ROOT / "data" / "raw" / "docs"
+API_INFO_PATH = API_DOCS_DIR / "api_info.json"
+RS_SRC_DIR = API_DOCS_DIR / "rhinoscriptsyntax_src" / "Scripts" / "rhinoscript"
+# Used for rs. names when the rhinoscriptsyntax source isn't checked out
+API_FALLBACK_PATHS = [API_DOCS_DIR / "rs_mapping_pairs.jsonl",
+                      ROOT / "data" / "processed" / "cleaned_pairs.jsonl"]
+API_INDEX_CACHE = Path.home() / ".cache" / "rhino_coder" / "api_index.json"
+
+
+class ApiIndex:
+    """Names reachable from ``rhinoscriptsyntax`` and the ``Rhino`` namespace.
+
+    ``rs`` maps each rhinoscriptsyntax name to the attribute names of the
+    classes among them (``filter``) or None for functions. ``rhino`` maps each
+    RhinoCommon namespace and type name (``Rhino.Geometry``,
+    ``Rhino.Geometry.Brep``) to its children, and ``types`` says which are
+    types. A type's own members don't include inherited ones, so any name that
+    is a member of some type is accepted there. Without api_info.json
+    ``rhino`` is empty and Rhino names aren't checked.
+
+    ``rs_complete`` is False when ``rs`` comes from the pairs files instead of
+    the rhinoscriptsyntax source; they only list the functions the dataset
+    happens to use, so an unknown ``rs.`` name is then a warning, not a
+    problem.
+    """
+
+    def __init__(self, rs: dict[str, list[str] | None], rhino: dict[str, list[str]],
+                 types: list[str], rs_complete: bool = True):
+        self.rs = rs
+        self.rs_complete = rs_complete
+        self.rhino = {k: set(v) for k, v in rhino.items()}
+        self.types = set(types)
+        self.members = set().union(*(self.rhino[t] for t in self.types if t in self.rhino))
+
+    @staticmethod
+    def sources() -> list[Path]:
+        rs_files = sorted(RS_SRC_DIR.glob("*.py")) if RS_SRC_DIR.exists() else API_FALLBACK_PATHS
+        return [p for p in [API_INFO_PATH, *rs_files] if p.exists()]
+
+    @classmethod
+    def load(cls, cache_path: Path = API_INDEX_CACHE) -> "ApiIndex":
+        """Build the index, or reuse the cached one if no source file changed."""
+        fingerprint = [[str(p), p.stat().st_mtime, p.stat().st_size] for p in cls.sources()]
+        try:
+            with open(cache_path, encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached["sources"] == fingerprint:
+                return cls(cached["rs"], cached["rhino"], cached["types"], cached["rs_complete"])
+        except (OSError, ValueError, KeyError):
+            pass
+
+        rs = cls._rs_names()
+        rs_complete = RS_SRC_DIR.exists()
+        rhino, types = cls._rhino_names()
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(cache_path, "w", encoding="utf-8") as f:
+                json.dump({"sources": fingerprint, "rs": rs, "rhino": rhino, "types": types,
+                           "rs_complete": rs_complete}, f)
+        except OSError:
+            pass
+        return cls(rs, rhino, types, rs_complete)
+
+    @staticmethod
+    def _rs_names() -> dict[str, list[str] | None]:
+        names: dict[str, list[str] | None] = {}
+        if not RS_SRC_DIR.exists():
+            # The pairs files only list functions; filter is the one class
+            # scripts commonly use (rs.filter.curve).
+            names["filter"] = None
+            for path in API_FALLBACK_PATHS:
+                if not path.exists():
+                    continue
+                with open(path, encoding="utf-8") as f:
+                    for line in f:
+                        function = json.loads(line).get("function") or ""
+                        if function.startswith("rs."):
+                            names[function[3:]] = None
+            return names
+
+        for path in sorted(RS_SRC_DIR.glob("*.py")):
+            try:
+                tree = ast.parse(path.read_text(encoding="utf-8", errors="replace"))
+            except SyntaxError:
+                continue
+            for node in tree.body:
+                if isinstance(node, ast.FunctionDef):
+                    names[node.name] = None
+                elif isinstance(node, ast.ClassDef):
+                    names[node.name] = sorted(
+                        t.id for n in node.body if isinstance(n, ast.Assign)
+                        for t in n.targets if isinstance(t, ast.Name))
+                elif isinstance(node, ast.Assign):
+                    for target in node.targets:
+                        if isinstance(target, ast.Name):
+                            names[target.id] = None
+        return {k: v for k, v in names.items() if not k.startswith("_")}
+
+    @staticmethod
+    def _rhino_names() -> tuple[dict[str, list[str]], list[str]]:
+        if not API_INFO_PATH.exists():
+            return {}, []
+        with open(API_INFO_PATH, encoding="utf-8") as f:
+            data = json.load(f)
+
+        children: dict[str, set[str]] = {}
+        types = []
+        for item in data:
+            ns, name = item.get("namespace", ""), item.get("name", "")
+            if not name:
+                continue
+            parts = ns.split(".") if ns else []
+            for i in range(1, len(parts)):
+                children.setdefault(".".join(parts[:i]), set()).add(parts[i])
+            if ns:
+                children.setdefault(ns, set()).add(name)
+            fqn = f"{ns}.{name}" if ns else name
+            types.append(fqn)
+            own = children.setdefault(fqn, set())
+            for method in item.get("methods", []):
+                match = re.search(r"(\w+)\s*(?:<[^>]*>)?\s*\(", method.get("signature", ""))
+                if match:
+                    own.add(match.group(1))
+            for key in ("properties", "fields", "events", "values"):
+                for member in item.get(key, []):
+                    sig = (member.get("signature") or member.get("name") or "").strip()
+                    if sig:
+                        own.add(sig.split()[-1].split("=")[0].strip())
+        return {k: sorted(v) for k, v in children.items()}, sorted(types)
+
+    def check(self, code: str) -> list[str]:
+        """Return problems with ``code``; an empty list means it may run."""
+        return self.lint(code)[0]
+
+    def lint(self, code: str) -> tuple[list[str], list[str]]:
+        """Return ``(problems, warnings)`` for ``code``; warnings don't stop it running."""
+        try:
+            tree = ast.parse(code)
+        except SyntaxError as e:
+            return [f"SyntaxError: {e.msg} (line {e.lineno})"], []
+
+        aliases: dict[str, str] = {}
+        problems: dict[str, int] = {}  # message -> line
+        warnings: dict[str, int] = {}
+
+        def report(path: list[str], problem: str | None, lineno: int):
+            if problem:
+                partial = path[0] == "rhinoscriptsyntax" and not self.rs_complete
+                (warnings if partial else problems)[problem] = lineno
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                for a in node.names:
+                    if a.asname:
+                        aliases[a.asname] = a.name
+                    else:
+                        aliases[a.name.split(".")[0]] = a.name.split(".")[0]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                for a in node.names:
+                    if a.name == "*":
+                        continue
+                    path = f"{node.module}.{a.name}"
+                    problem = self._resolve(path.split("."), node.lineno)
+                    report(path.split("."), problem, node.lineno)
+                    if not problem:
+                        aliases[a.asname or a.name] = path
+
+        # Only the outermost node of each attribute chain
+        inner = {id(n.value) for n in ast.walk(tree) if isinstance(n, ast.Attribute)}
+        for node in ast.walk(tree):
+            if not isinstance(node, ast.Attribute) or id(node) in inner:
+                continue
+            chain = []
+            while isinstance(node, ast.Attribute):
+                chain.append(node.attr)
+                node = node.value
+            if not isinstance(node, ast.Name) or node.id not in aliases:
+                continue
+            path = aliases[node.id].split(".") + chain[::-1]
+            problem = self._resolve(path, node.lineno, shown=[node.id] + chain[::-1])
+            report(path, problem, node.lineno)
+        return sorted(problems, key=problems.get), sorted(warnings, key=warnings.get)
+
+    def _resolve(self, path: list[str], lineno: int, shown: list[str] | None = None) -> str | None:
+        """Check a dotted name; ``shown`` is how it was written in the code."""
+        shown = shown or path
+        skipped = len(path) - len(shown)  # module parts behind an alias
+        if path[0] == "rhinoscriptsyntax" and len(path) > 1:
+            name = path[1]
+            if name not in self.rs:
+                return self._unknown(shown[:2 - skipped], name, self.rs, lineno)
+            attrs = self.rs[name]
+            if attrs is not None and len(path) > 2 and path[2] not in attrs:
+                return self._unknown(shown[:3 - skipped], path[2], attrs, lineno)
+            return None
+        if path[0] != "Rhino" or not self.rhino:
+            return None
+        scope = "Rhino"
+        for i, part in enumerate(path[1:], 2):
+            known = self.rhino.get(scope)
+            if not known:
+                return None  # past what the docs describe
+            if part not in known:
+                if scope in self.types and part in self.members:
+                    return None  # probably inherited from a base type
+                return self._unknown(shown[:max(i - skipped, 1)], part, known, lineno)
+            if scope in self.types:
+                return None  # a member; its own attributes depend on its type
+            scope = f"{scope}.{part}"
+        return None
+
+    @staticmethod
+    def _unknown(shown: list[str], name: str, known, lineno: int) -> str:
+        owner = ".".join(shown[:-1])
+        message = f"{'.'.join(shown)} does not exist (line {lineno})"
+        close = difflib.get_close_matches(name, list(known), n=3, cutoff=0.6)
+        if close:
+            message += "; did you mean " + ", ".join(f"{owner}.{c}" for c in close) + "?"
+        return message
+
+
+_api_index: ApiIndex | None = None
+
+
+def get_api_index() -> ApiIndex:
+    global _api_index
+    if _api_index is None:
+        _api_index = ApiIndex.load()
+    return _api_index
@@ -0,0 +1,174 @@
+"""
+Incremental re-execution: the runner generated scripts execute in.
+
+The runner executes a script's top-level statements one by one and records
+which objects each one adds to the document (RhinoDoc.AddRhinoObject). When
+a statement raises, the runner leaves that record and the namespace from
+just before the statement in scriptcontext.sticky under a per-turn key. The
+next attempt of the turn picks it up and deletes the failed attempt's
+objects before running.
+
+If the fix keeps every statement before the failure point unchanged (same
+AST) and the failing statement was resumable, those statements' objects stay
+and execution resumes at the failure point with a deep copy of the namespace
+from just before it. Only an assignment to plain names of a literal or of one
+rs.* call on literal and name arguments is resumable: anything else (a loop,
+a method call, a call that moves or edits existing objects) may have
+half-run and changed something the runner can't undo, so the next attempt
+starts over. So does one whose namespace can't be deep-copied.
+"""
+
+import ast
+import hashlib
+
+INCREMENTAL_MARKER = "#rhino_coder-incremental"
+# Expression nodes a resumable statement's literal or rs.* arguments may use
+PLAIN_EXPRESSIONS = (ast.Constant, ast.Name, ast.Load, ast.Tuple, ast.List, ast.Dict,
+                     ast.UnaryOp, ast.BinOp, ast.unaryop, ast.operator, ast.keyword)
+
+# Runs inside Rhino's Python, so it avoids anything newer than the listener's.
+INCREMENTAL_RUNNER = """
+import copy as _rc_copy
+import types as _rc_types
+import scriptcontext as _rc_sc
+import Rhino as _rc_Rhino
+
+def _rc_snapshot_ns(ns):
+    # Dunders, modules, functions, classes and ids are shared; None if anything else can't be copied.
+    shared = (_rc_types.ModuleType, _rc_types.FunctionType, _rc_types.BuiltinFunctionType, type)
+    copied = {}
+    for name, value in ns.items():
+        if name.startswith("__") or isinstance(value, shared) or type(value).__name__ == "Guid":
+            copied[name] = value
+            continue
+        try:
+            copied[name] = _rc_copy.deepcopy(value)
+        except Exception:
+            return None
+    return copied
+
+def _rc_run(key, stmts):
+    doc = _rc_Rhino.RhinoDoc.ActiveDoc
+    prev = _rc_sc.sticky.pop(key, None)
+    start = 0
+    if prev and prev["resumable"] and prev["hashes"] == [s[0] for s in stmts[:prev["done"]]]:
+        start = prev["done"]
+    removed = 0
+    for ids in (prev["created"][start:] if prev else []):
+        for oid in ids:
+            if doc.Objects.Delete(oid, True):
+                removed += 1
+    created = prev["created"][:start] if start else []
+    ns = prev["ns"] if start else {"__name__": "__main__"}
+
+    def on_add(sender, e):
+        created[-1].append(e.ObjectId)
+
+    _rc_Rhino.RhinoDoc.AddRhinoObject += on_add
+    try:
+        for index in range(start, len(stmts)):
+            digest, resumable, line, source = stmts[index]
+            before = _rc_snapshot_ns(ns) if resumable else None
+            created.append([])
+            try:
+                # Padding keeps traceback line numbers those of the whole script.
+                exec(compile("\\n" * (line - 1) + source, "<string>", "exec"), ns)
+            except Exception:
+                _rc_sc.sticky[key] = {"done": index, "resumable": before is not None, "ns": before,
+                                      "hashes": [s[0] for s in stmts[:index]],
+                                      "created": created}
+                raise
+    finally:
+        _rc_Rhino.RhinoDoc.AddRhinoObject -= on_add
+    print("%s %d %d" % (MARKER, start, removed))
+"""
+
+INCREMENTAL_ROLLBACK = """
+import scriptcontext as _rc_sc
+import Rhino as _rc_Rhino
+_rc_prev = _rc_sc.sticky.pop(KEY, None)
+_rc_removed = 0
+for _rc_ids in (_rc_prev["created"] if _rc_prev else []):
+    for _rc_id in _rc_ids:
+        if _rc_Rhino.RhinoDoc.ActiveDoc.Objects.Delete(_rc_id, True):
+            _rc_removed += 1
+_rc_Rhino.RhinoDoc.ActiveDoc.Views.Redraw()
+print("%s 0 %d" % (MARKER, _rc_removed))
+"""
+
+
+def resumable_statement(node: ast.stmt) -> bool:
+    """Whether a failed ``node`` can be rerun in place: ``name = <literal or rs.X(...)>``."""
+    if not isinstance(node, ast.Assign):
+        return False
+    for target in node.targets:
+        names = target.elts if isinstance(target, (ast.Tuple, ast.List)) else [target]
+        if not all(isinstance(n, ast.Name) for n in names):
+            return False
+    value = node.value
+    if isinstance(value, ast.Call):
+        func = value.func
+        if not (isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name)
+                and func.value.id == "rs"):
+            return False
+        parts = [*value.args, *value.keywords]
+    else:
+        parts = [value]
+    return all(isinstance(n, PLAIN_EXPRESSIONS) for part in parts for n in ast.walk(part))
+
+
+def split_statements(code: str) -> list[tuple[str, bool, int, str]] | None:
+    """Top-level statements as ``(ast hash, resumable, first line, source)``."""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    lines = code.splitlines(keepends=True)
+    stmts = []
+    for node in tree.body:
+        decorators = getattr(node, "decorator_list", [])
+        if decorators:
+            first = decorators[0].lineno
+            source = "".join(lines[first - 1:node.end_lineno])
+        else:
+            first = node.lineno
+            source = ast.get_source_segment(code, node)
+        digest = hashlib.sha1(ast.dump(node).encode("utf-8")).hexdigest()[:16]
+        stmts.append((digest, resumable_statement(node), first, source))
+    return stmts
+
+
+def unwrap_code(script: str) -> str:
+    """Recover the model-written code from a script built by execute_generated.
+
+    Rebuilds the statements passed to the incremental runner at their
+    original line numbers (comments between them are lost). The rollback
+    script gives "", anything else is returned as sent.
+    """
+    runner = INCREMENTAL_RUNNER.replace("MARKER", repr(INCREMENTAL_MARKER))
+    if script.startswith(runner):
+        call = ast.parse(script[len(runner):]).body[0].value  # _rc_run(key, stmts)
+        lines: list[str] = []
+        for _, _, line, source in ast.literal_eval(call.args[1]):
+            lines.extend([""] * (line - 1 - len(lines)))
+            lines.extend(source.splitlines())
+        return "\n".join(lines)
+    if script.startswith(INCREMENTAL_ROLLBACK.split("KEY")[0]):
+        return ""
+    return script.removesuffix("\n")
+
+
+def take_marker(result: dict, marker: str) -> str | None:
+    """Remove ``marker`` lines from the script output; returns what followed the last one."""
+    body = result.get("result")
+    output = body.get("output") if isinstance(body, dict) else None
+    if not isinstance(output, str) or marker not in output:
+        return None
+    kept, info = [], None
+    for line in output.splitlines():
+        if line.startswith(marker + " "):
+            info = line[len(marker) + 1:]
+        else:
+            kept.append(line)
+    body["output"] = "\n".join(kept).strip()
+    return info
@@ -0,0 +1,297 @@
+"""
+Client for OpenAI-compatible model servers (mlx_lm.server, gateway.py).
+
+A minimal HTTP/1.1 client on asyncio streams, so a streamed completion can be
+abandoned by closing its connection, and ModelRouter, which spreads requests
+over several servers with failover and a circuit breaker per server.
+"""
+
+import asyncio
+import json
+import time
+import urllib.parse
+
+MODEL_TIMEOUT = 120          # seconds to wait for a server to connect or send more data
+PROBE_TIMEOUT = 5            # seconds for /v1/models checks
+BREAKER_FAILURES = 3         # consecutive failures before a server is skipped
+BREAKER_COOLDOWN = 30        # seconds a tripped server is skipped before it is retried
+HEALTH_CHECK_INTERVAL = 10   # seconds between /v1/models checks of every server
+
+
+class HTTPResponse:
+    """Minimal HTTP/1.1 response reader on top of asyncio streams."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 status: int, headers: dict[str, str], timeout: float, url: str = ""):
+        self.reader = reader
+        self.writer = writer
+        self.status = status
+        self.headers = headers
+        self.timeout = timeout
+        self.url = url
+        self.on_close = None  # called once, when the response is closed
+
+    async def _read(self, coro):
+        return await asyncio.wait_for(coro, self.timeout)
+
+    async def iter_chunks(self):
+        """Yield the body as it arrives (chunked, sized or read-until-close)."""
+        if self.headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size_line = await self._read(self.reader.readline())
+                size = int(size_line.split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    await self._read(self.reader.readline())
+                    return
+                yield await self._read(self.reader.readexactly(size))
+                await self._read(self.reader.readexactly(2))  # trailing CRLF
+        elif "content-length" in self.headers:
+            remaining = int(self.headers["content-length"])
+            while remaining > 0:
+                chunk = await self._read(self.reader.read(min(remaining, 65536)))
+                if not chunk:
+                    raise ConnectionError("Model server closed the connection early")
+                remaining -= len(chunk)
+                yield chunk
+        else:
+            while chunk := await self._read(self.reader.read(65536)):
+                yield chunk
+
+    async def iter_lines(self):
+        """Yield decoded body lines, for server-sent events."""
+        pending = b""
+        async for chunk in self.iter_chunks():
+            pending += chunk
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                yield line.decode("utf-8")
+        if pending:
+            yield pending.decode("utf-8")
+
+    async def read(self) -> bytes:
+        return b"".join([chunk async for chunk in self.iter_chunks()])
+
+    def close(self):
+        self.writer.close()
+        if self.on_close is not None:
+            callback, self.on_close = self.on_close, None
+            callback()
+
+
+async def http_request(method: str, url: str, body: dict | None = None,
+                       timeout: float = MODEL_TIMEOUT) -> HTTPResponse:
+    """Open a connection, send one request and return once the headers are in.
+
+    The caller owns the returned response and must ``close()`` it; closing
+    early is how an in-flight generation gets abandoned.
+    """
+    parts = urllib.parse.urlsplit(url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(parts.hostname, port, ssl=parts.scheme == "https"),
+        timeout,
+    )
+    try:
+        payload = json.dumps(body).encode("utf-8") if body is not None else b""
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        head = (
+            f"{method} {path} HTTP/1.1\r\n"
+            f"Host: {parts.netloc}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: close\r\n\r\n"
+        )
+        writer.write(head.encode("ascii") + payload)
+        await writer.drain()
+
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        if not status_line:
+            raise ConnectionError(f"Empty reply from {url}")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _, value = line.decode("latin-1").partition(":")
+            headers[key.strip().lower()] = value.strip()
+    except BaseException:
+        writer.close()
+        raise
+    return HTTPResponse(reader, writer, status, headers, timeout, url)
+
+
+def models_url(url: str) -> str:
+    """The /v1/models endpoint next to a chat completions URL."""
+    parts = urllib.parse.urlsplit(url)
+    path = parts.path.rsplit("/chat/completions", 1)[0] + "/models"
+    return urllib.parse.urlunsplit((parts.scheme, parts.netloc, path, "", ""))
+
+
+async def list_models(url: str, timeout: float) -> list[str]:
+    """Model IDs reported by the server behind chat completions ``url``."""
+    resp = await http_request("GET", models_url(url), timeout=timeout)
+    try:
+        if resp.status != 200:
+            raise ConnectionError(f"HTTP {resp.status} from {models_url(url)}")
+        return [m.get("id") for m in json.loads(await resp.read()).get("data", [])]
+    finally:
+        resp.close()
+
+
+class ModelBackend:
+    """One model server: requests in flight, latency and circuit-breaker state."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.host = urllib.parse.urlsplit(url).netloc
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.tripped_at: float | None = None  # monotonic time the breaker opened
+        self.last_used = 0.0
+        self.last_error = ""
+        self.total_latency = 0.0  # time until response headers
+
+    @property
+    def tripped(self) -> bool:
+        """Open breaker: skipped while other servers are available."""
+        return (self.tripped_at is not None
+                and time.monotonic() - self.tripped_at < BREAKER_COOLDOWN)
+
+    def succeeded(self, latency: float | None = None):
+        self.consecutive_failures = 0
+        self.tripped_at = None
+        if latency is not None:
+            self.requests += 1
+            self.total_latency += latency
+
+    def failed(self, error: str):
+        # After the cooldown one more failure re-opens the breaker straight away.
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_error = error
+        if self.consecutive_failures >= BREAKER_FAILURES:
+            self.tripped_at = time.monotonic()
+
+    def release(self):
+        self.outstanding -= 1
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "state": "tripped" if self.tripped else "ok",
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "avg_ms": 1000 * self.total_latency / self.requests if self.requests else 0.0,
+            "last_error": self.last_error,
+        }
+
+
+class ModelRouter:
+    """Spread completions over several servers with failover.
+
+    Each request goes to the server with the fewest requests in flight, so a
+    slow box naturally gets less work. A server that can't be reached or
+    answers 5xx counts a failure and the request moves on to the next one;
+    after ``BREAKER_FAILURES`` in a row its breaker trips and it is only tried
+    once every other server has failed, until the cooldown ends or a health
+    check sees it answer again. Failover happens only before the response
+    starts; a stream that breaks midway still fails the request.
+    """
+
+    def __init__(self, urls: list[str]):
+        self.backends = [ModelBackend(url) for url in urls]
+        self.failovers = 0
+        self._health_task: asyncio.Task | None = None
+
+    def candidates(self) -> list[ModelBackend]:
+        """Servers in the order to try them: least busy first, tripped ones last."""
+        closed = sorted((b for b in self.backends if not b.tripped),
+                        key=lambda b: (b.outstanding, b.last_used))
+        tripped = sorted((b for b in self.backends if b.tripped), key=lambda b: b.tripped_at)
+        return closed + tripped
+
+    async def post(self, payload: dict) -> HTTPResponse:
+        """POST to the best server; the response's close() frees its slot."""
+        self.start_health_checks()
+        errors = []
+        for backend in self.candidates():
+            backend.outstanding += 1
+            backend.last_used = time.monotonic()
+            start = time.perf_counter()
+            try:
+                resp = await http_request("POST", backend.url, payload)
+            except (OSError, asyncio.TimeoutError) as e:
+                backend.release()
+                backend.failed(str(e) or type(e).__name__)
+                errors.append((backend, e))
+                continue
+            except BaseException:
+                backend.release()
+                raise
+            if resp.status >= 500:
+                try:
+                    detail = (await resp.read()).decode("utf-8", "replace")[:300]
+                except (OSError, asyncio.TimeoutError):
+                    detail = ""
+                finally:
+                    resp.close()
+                    backend.release()
+                backend.failed(f"HTTP {resp.status}: {detail}")
+                errors.append((backend, ConnectionError(f"HTTP {resp.status}: {detail}")))
+                continue
+            backend.succeeded(time.perf_counter() - start)
+            resp.on_close = backend.release
+            if errors:
+                self.failovers += 1
+            return resp
+
+        if len(errors) == 1:
+            backend, e = errors[0]
+            raise ConnectionError(
+                f"Cannot reach model server at {backend.url}. Is ./serve.sh running?\n{e}")
+        raise ConnectionError("No model server reachable:\n" + "\n".join(
+            f"  {backend.url}: {str(e).splitlines()[0] if str(e) else type(e).__name__}"
+            for backend, e in errors))
+
+    async def check(self, backend: ModelBackend) -> list[str] | None:
+        """Health-check one server; returns its model IDs, or None if it's down."""
+        try:
+            ids = await list_models(backend.url, PROBE_TIMEOUT)
+        except (ConnectionError, OSError, asyncio.TimeoutError, ValueError) as e:
+            backend.failed(str(e).splitlines()[0] if str(e) else type(e).__name__)
+            return None
+        backend.succeeded()
+        return ids
+
+    def start_health_checks(self):
+        """Check every server periodically in the background (several servers only)."""
+        if len(self.backends) < 2:
+            return
+        loop = asyncio.get_running_loop()
+        task = self._health_task
+        if task is None or task.done() or task.get_loop() is not loop:
+            self._health_task = loop.create_task(self._health_loop())
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+            await asyncio.gather(*(self.check(b) for b in self.backends))
+
+    def stats(self) -> dict:
+        return {"failovers": self.failovers, "servers": [b.stats() for b in self.backends]}
+
+
+def completion_url(url: str) -> str:
+    """Accept host:port or a server root and return its chat completions URL."""
+    if "://" not in url:
+        url = "http://" + url
+    parts = urllib.parse.urlsplit(url)
+    if parts.path.strip("/") in ("", "v1"):
+        url = urllib.parse.urlunsplit((parts.scheme, parts.netloc, "/v1/chat/completions", "", ""))
+    return url
@@ -0,0 +1,152 @@
+"""
+Prompt budget: token counting and trimming of the conversation history.
+
+``history`` keeps every message, tagged with internal keys (retry turns carry
+"kind": "retry" and the raw "error"). What is actually sent is a view of it
+that fits PROMPT_TOKEN_BUDGET: old failed attempts are collapsed into a
+one-line summary on their prompt, then the oldest turns are dropped.
+
+Servers with a prompt cache (./serve.sh --prompt-cache) only skip prefill
+for the part of a prompt that matches an earlier one byte for byte, so the
+view only ever changes by appending, except at the moments it is trimmed.
+"""
+
+from pathlib import Path
+
+PROMPT_TOKEN_BUDGET = 4096       # max prompt tokens per request, system prompt included
+KEEP_RECENT_TURNS = 2            # turns kept verbatim while older ones are trimmed
+PROMPT_TRIM_TARGET = 0.75        # trim to this fraction of the budget, leaving room to append
+
+MESSAGE_OVERHEAD = 4   # <|im_start|>role\n ... <|im_end|>\n
+REPLY_PRIMING = 3      # <|im_start|>assistant\n
+
+
+class TokenCounter:
+    """Count tokens with the served model's tokenizer, loaded on first use.
+
+    Falls back to the ~4 chars per token estimate used by format_dataset.py
+    if the ``tokenizers`` package or the tokenizer file is missing.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._tokenizer = None
+        self._loaded = False
+        self._counts: dict[str, int] = {}
+
+    @property
+    def exact(self) -> bool:
+        self._load()
+        return self._tokenizer is not None
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            from tokenizers import Tokenizer
+            self._tokenizer = Tokenizer.from_file(str(self.path))
+        except Exception:
+            self._tokenizer = None
+
+    def count(self, text: str) -> int:
+        n = self._counts.get(text)
+        if n is None:
+            self._load()
+            if self._tokenizer is not None:
+                n = len(self._tokenizer.encode(text, add_special_tokens=False).ids)
+            else:
+                n = len(text) // 4
+            if len(self._counts) >= 4096:
+                self._counts.clear()
+            self._counts[text] = n
+        return n
+
+    def count_messages(self, messages: list[dict]) -> int:
+        """Prompt tokens for ``messages`` under the ChatML template."""
+        return REPLY_PRIMING + sum(
+            self.count(m["content"]) + MESSAGE_OVERHEAD for m in messages)
+
+
+def split_turns(history: list[dict]) -> list[list[dict]]:
+    """Group the non-system messages into turns, each starting at a user prompt."""
+    turns: list[list[dict]] = []
+    for msg in history[1:]:
+        if msg["role"] == "user" and msg.get("kind") != "retry" or not turns:
+            turns.append([])
+        turns[-1].append(msg)
+    return turns
+
+
+def collapse_turn(turn: list[dict]) -> list[dict]:
+    """Replace a turn's failed attempts with a summary appended to its prompt.
+
+    The last exchange is kept: the final reply of a finished turn, or the
+    latest attempt and its error report for the turn still being fixed.
+    """
+    tail = 2 if turn[-1].get("kind") == "retry" else 1
+    failed = [m for m in turn[1:-tail] if m.get("kind") == "retry"]
+    if not failed:
+        return turn
+    errors = "; ".join(m["error"].strip().split("\n")[0][:100] for m in failed)
+    note = f"(Earlier attempt{'s' if len(failed) > 1 else ''} failed: {errors})"
+    prompt = dict(turn[0], content=f"{turn[0]['content']}\n\n{note}")
+    return [prompt] + turn[-tail:]
+
+
+def fit_history(history: list[dict], counter: TokenCounter,
+                budget: int = PROMPT_TOKEN_BUDGET) -> tuple[list[dict], dict]:
+    """Return the messages to send for ``history`` and a size report.
+
+    Tokens are counted with ``counter``. Once the prompt exceeds ``budget`` it
+    is trimmed down to PROMPT_TRIM_TARGET of it, in this order: collapse failed
+    attempts in turns older than KEEP_RECENT_TURNS, drop those older turns,
+    collapse the recent turns, drop recent turns other than the current one.
+    The system prompt and the current turn are always sent, even if still over
+    budget.
+
+    A message's "context" (the document summary) is appended to its content.
+    Trimming decisions are recorded on each turn's prompt ("trim": "collapsed"
+    or "dropped") and replayed on later calls, so the trimmed prefix stays
+    byte-identical, and reusable by the server's prompt cache, until the
+    budget is hit again. The report has ``tokens``, ``budget``,
+    ``collapsed``, ``dropped`` and ``exact`` (False when tokens are estimated).
+    """
+    system, turns = history[0], split_turns(history)
+    trim = [t[0].get("trim") for t in turns]
+
+    def view() -> list[dict]:
+        messages = [system]
+        for turn, mark in zip(turns, trim):
+            if mark == "collapsed":
+                messages += collapse_turn(turn)
+            elif mark != "dropped":
+                messages += turn
+        # Document context stays attached to the message it was sent with.
+        return [{"role": m["role"],
+                 "content": f"{m['content']}\n\n{m['context']}" if m.get("context") else m["content"]}
+                for m in messages]
+
+    tokens = counter.count_messages(view())
+    if tokens > budget:
+        goal = int(budget * PROMPT_TRIM_TARGET)
+        older = range(max(len(turns) - KEEP_RECENT_TURNS, 0))
+        recent = range(older.stop, len(turns))
+        steps = ([(i, "collapsed") for i in older] + [(i, "dropped") for i in older] +
+                 [(i, "collapsed") for i in recent] + [(i, "dropped") for i in recent[:-1]])
+        for i, mark in steps:
+            if tokens <= goal:
+                break
+            if trim[i] in (mark, "dropped"):
+                continue
+            if mark == "collapsed" and collapse_turn(turns[i]) is turns[i]:
+                continue  # nothing to collapse
+            trim[i] = mark
+            tokens = counter.count_messages(view())
+        for turn, mark in zip(turns, trim):
+            if mark:
+                turn[0]["trim"] = mark
+
+    info = {"tokens": tokens, "budget": budget, "exact": counter.exact,
+            "collapsed": trim.count("collapsed"), "dropped": trim.count("dropped")}
+    return view(), info
@@ -0,0 +1,184 @@
+"""
+On-disk cache of model responses whose code ran successfully in Rhino.
+"""
+
+import hashlib
+import json
+import os
+import re
+import time
+from pathlib import Path
+
+CACHE_MAX_ENTRIES = 500
+CACHE_TTL = 30 * 24 * 3600       # seconds
+CACHE_SIMILARITY = 0.85          # near-duplicate Jaccard threshold (None = exact only)
+
+# Prompts that point back into the conversation can't be answered from a
+# cache keyed on the last user turn alone.
+CONTEXT_DEPENDENT = re.compile(
+    r"\b(it|its|this|that|these|those|them|previous|above|same|again|instead)\b")
+
+
+def normalize_prompt(text: str) -> str:
+    """Lowercase, drop punctuation (keeping decimal points and signs) and collapse whitespace."""
+    text = re.sub(r"[^\w\s.\-]|(?<!\d)\.|\.(?!\d)", " ", text.lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def prompt_signature(text: str) -> set[str]:
+    """Character 3-gram shingles of a normalized prompt."""
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# Words a near-duplicate prompt may add or drop; every other word has to match
+FILLER_WORDS = frozenset(
+    "a an the please can could would will you me i just now some".split())
+NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def prompt_numbers(norm: str) -> list[str]:
+    """Numbers of a normalized prompt in the order they appear."""
+    return NUMBER.findall(norm)
+
+
+def content_words(norm: str) -> list[str]:
+    """Sorted distinct words of a normalized prompt, fillers and numbers left out.
+
+    One-letter words stay in: "x axis" and "z axis" differ.
+    """
+    return sorted({w for w in norm.split() if w not in FILLER_WORDS and not NUMBER.fullmatch(w)})
+
+
+def jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ResponseCache:
+    """On-disk cache of responses whose code ran successfully in Rhino.
+
+    Entries are keyed on the system prompt plus the normalized last user
+    turn, expire after ``ttl`` seconds and are evicted least-recently-used
+    beyond ``max_entries``. If ``similarity`` is set, a miss falls back to the
+    closest stored prompt by 3-gram Jaccard similarity, but only when both
+    prompts have the same numbers in the same order and the same content
+    words. So "radius 5" never answers "radius 10", "to 10,0,0" never answers
+    "to 0,10,0" and "around the x axis" never answers "around the z axis";
+    what may differ is filler words, word order and spacing.
+    """
+
+    def __init__(self, path: Path, max_entries: int = CACHE_MAX_ENTRIES,
+                 ttl: float = CACHE_TTL, similarity: float | None = CACHE_SIMILARITY):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._entries: dict[str, dict] | None = None
+
+    @property
+    def entries(self) -> dict[str, dict]:
+        if self._entries is None:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    self._entries = json.load(f).get("entries", {})
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "entries": self.entries}, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+    @staticmethod
+    def key(system: str, prompt: str) -> str:
+        return hashlib.sha256(f"{system}\n{normalize_prompt(prompt)}".encode()).hexdigest()
+
+    def _expire(self):
+        now = time.time()
+        for k in [k for k, e in self.entries.items() if now - e["created"] > self.ttl]:
+            del self.entries[k]
+
+    def lookup(self, system: str, prompt: str) -> dict | None:
+        """Return the cached entry for this prompt, or None.
+
+        Near-duplicate hits come back as a copy with ``similar_to`` set to the
+        stored prompt they matched.
+        """
+        if CONTEXT_DEPENDENT.search(prompt.lower()):
+            return None
+        self._expire()
+        key = self.key(system, prompt)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+        elif self.similarity:
+            key = self._nearest(system, prompt)
+            if key is not None:
+                self.near_hits += 1
+                entry = dict(self.entries[key], similar_to=self.entries[key]["prompt"])
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries[key]["last_used"] = time.time()
+        self._save()
+        return entry
+
+    def _nearest(self, system: str, prompt: str) -> str | None:
+        norm = normalize_prompt(prompt)
+        numbers = prompt_numbers(norm)
+        words = content_words(norm)
+        sig = prompt_signature(norm)
+        system_hash = hashlib.sha256(system.encode()).hexdigest()
+        best, best_score = None, self.similarity
+        for k, entry in self.entries.items():
+            if (entry["system"] != system_hash or entry["numbers"] != numbers
+                    or entry["words"] != words):
+                continue
+            score = jaccard(sig, prompt_signature(entry["prompt"]))
+            if score >= best_score:
+                best, best_score = k, score
+        return best
+
+    def store(self, system: str, prompt: str, response: str, code: str):
+        if CONTEXT_DEPENDENT.search(prompt.lower()):
+            return
+        self._expire()
+        norm = normalize_prompt(prompt)
+        now = time.time()
+        self.entries[self.key(system, prompt)] = {
+            "system": hashlib.sha256(system.encode()).hexdigest(),
+            "prompt": norm,
+            "numbers": prompt_numbers(norm),
+            "words": content_words(norm),
+            "response": response,
+            "code": code,
+            "created": now,
+            "last_used": now,
+        }
+        if len(self.entries) > self.max_entries:
+            by_age = sorted(self.entries, key=lambda k: self.entries[k]["last_used"])
+            for k in by_age[:len(self.entries) - self.max_entries]:
+                del self.entries[k]
+        self._save()
+
+    def invalidate(self, code: str):
+        """Drop entries serving ``code``; it just failed in Rhino."""
+        for k in [k for k, e in self.entries.items() if e["code"] == code]:
+            del self.entries[k]
+        self._save()
+
+    def clear(self):
+        self._entries = {}
+        self._save()
+
+    def stats(self) -> dict:
+        return {"entries": len(self.entries), "hits": self.hits,
+                "near_hits": self.near_hits, "misses": self.misses}
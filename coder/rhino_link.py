@@ -0,0 +1,265 @@
+"""
+Connections to the Rhino listener (same protocol as rhino-mcp/tools/utils.py).
+
+Legacy mode sends one bare JSON object per command and reads until the
+response parses. If the listener answers a "negotiate_protocol" command with
+{"framing": "length-prefix-v1"}, both directions switch to frames of a
+4-byte big-endian length followed by that many bytes of UTF-8 JSON.
+"""
+
+import asyncio
+import json
+import socket
+import struct
+import time
+from collections import deque
+
+RHINO_HOST = "localhost"
+RHINO_PORT = 54321
+SOCKET_TIMEOUT = 30
+RECV_CHUNK_SIZE = 8192
+RHINO_POOL_SIZE = 2        # idle connections kept open to the listener
+RHINO_IDLE_TIMEOUT = 60    # seconds before an idle connection is dropped
+RHINO_FRAMING = True       # negotiate length-prefixed frames with the listener
+FRAMING_VERSION = "length-prefix-v1"
+FRAME_HEADER = struct.Struct(">I")   # 4-byte big-endian payload length
+MAX_FRAME_SIZE = 512 * 1024 * 1024
+
+
+class RhinoConnection:
+    """A long-lived asyncio stream to the Rhino listener with latency counters."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 timeout: float):
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.requests = 0
+        self.failures = 0
+        self.total_latency = 0.0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.framed = False
+        self.sent = False  # whether the last request was fully written
+
+    @classmethod
+    async def open(cls, host: str, port: int, timeout: float) -> "RhinoConnection":
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port, limit=RECV_CHUNK_SIZE * 16), timeout)
+        except asyncio.TimeoutError:
+            raise
+        except OSError as e:
+            # "localhost" resolves to several addresses, in which case asyncio
+            # reports a combined OSError rather than ConnectionRefusedError.
+            raise ConnectionRefusedError(e.errno, str(e)) from e
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return cls(reader, writer, timeout)
+
+    def is_alive(self) -> bool:
+        """Cheap health check: the transport has already seen EOF if the peer hung up."""
+        return not (self.writer.is_closing() or self.reader.at_eof())
+
+    async def negotiate(self) -> bool:
+        """Ask the listener to switch this connection to length-prefixed frames.
+
+        Sent in the legacy format, so a listener that doesn't know the command
+        just answers with an error and the connection stays in legacy mode.
+        """
+        response = await self.request({
+            "type": "negotiate_protocol",
+            "params": {"framing": [FRAMING_VERSION]},
+        })
+        result = response.get("result") or {}
+        self.framed = (response.get("status") != "error"
+                       and result.get("framing") == FRAMING_VERSION)
+        return self.framed
+
+    async def request(self, command: dict) -> dict:
+        """Send one command and wait until its JSON response has arrived."""
+        start = time.perf_counter()
+        self.sent = False
+        try:
+            payload = json.dumps(command).encode("utf-8")
+            if self.framed:
+                self.writer.write(FRAME_HEADER.pack(len(payload)) + payload)
+                await self.writer.drain()
+                self.sent = True
+                response = await asyncio.wait_for(self._recv_framed(), self.timeout)
+            else:
+                self.writer.write(payload)
+                await self.writer.drain()
+                self.sent = True
+                response = await asyncio.wait_for(self._recv_legacy(), self.timeout)
+        except BaseException:
+            self.failures += 1
+            raise
+        finally:
+            self.last_used = time.monotonic()
+
+        latency = time.perf_counter() - start
+        self.requests += 1
+        self.total_latency += latency
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        return response
+
+    async def _recv_framed(self) -> dict:
+        """Read one length-prefixed frame and decode it in a single pass."""
+        try:
+            header = await self.reader.readexactly(FRAME_HEADER.size)
+            (length,) = FRAME_HEADER.unpack(header)
+            if length > MAX_FRAME_SIZE:
+                raise ConnectionError(f"Rhino response frame too large ({length} bytes)")
+            return json.loads(await self.reader.readexactly(length))
+        except asyncio.IncompleteReadError:
+            raise ConnectionError("Rhino closed the connection mid-response")
+
+    async def _recv_legacy(self) -> dict:
+        """Read an unframed JSON response, parsing only when it could be complete."""
+        buf = bytearray()
+        while True:
+            chunk = await self.reader.read(RECV_CHUNK_SIZE)
+            if not chunk:
+                break
+            buf += chunk
+            # A JSON object can only be complete once the data ends in "}".
+            if not chunk.rstrip().endswith(b"}"):
+                continue
+            try:
+                return json.loads(buf)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                continue
+
+        if not buf:
+            raise ConnectionError("Empty response from Rhino")
+        return json.loads(buf)
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "avg_ms": 1000 * self.total_latency / self.requests if self.requests else 0.0,
+            "last_ms": 1000 * self.last_latency,
+            "max_ms": 1000 * self.max_latency,
+            "age_s": time.monotonic() - self.created_at,
+            "framed": self.framed,
+        }
+
+    def close(self):
+        self.writer.close()
+
+
+class RhinoConnectionPool:
+    """Small pool of persistent connections to the Rhino listener.
+
+    Idle connections are health-checked before reuse and dropped once they
+    have been idle for longer than ``idle_timeout``. A request that fails on a
+    reused connection is retried once on a fresh one, so a listener restart
+    costs one reconnect instead of an error, but only if it can't have run:
+    the command wasn't fully written, or it is one of IDEMPOTENT_COMMANDS.
+    Once a script has been sent, Rhino may have run it even if no reply came
+    back, and sending it again would run it twice. A connection whose
+    request was cancelled mid-flight is never returned to the pool.
+    """
+
+    IDEMPOTENT_COMMANDS = frozenset({"ping", "negotiate_protocol"})
+
+    def __init__(self, host: str, port: int, size: int = RHINO_POOL_SIZE,
+                 timeout: float = SOCKET_TIMEOUT, idle_timeout: float = RHINO_IDLE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._idle: list[RhinoConnection] = []
+        self._retired = deque(maxlen=20)  # counters of recently closed connections
+        self.connects = 0
+        self.reconnects = 0
+        # None = not negotiated yet, then True/False once the listener answered
+        self.framing: bool | None = None if RHINO_FRAMING else False
+
+    async def _connect(self) -> RhinoConnection:
+        conn = await RhinoConnection.open(self.host, self.port, self.timeout)
+        self.connects += 1
+        # Remember a refusal so legacy listeners don't pay an extra round-trip
+        # on every new connection.
+        if self.framing is not False:
+            try:
+                self.framing = await conn.negotiate()
+            except (ConnectionError, OSError, ValueError):
+                # Listener hung up on the unknown command; start over unframed.
+                conn.close()
+                self.framing = False
+                conn = await RhinoConnection.open(self.host, self.port, self.timeout)
+                self.connects += 1
+        return conn
+
+    def _retire(self, conn: RhinoConnection):
+        conn.close()
+        if conn.requests or conn.failures:
+            self._retired.append(conn.stats())
+
+    async def acquire(self) -> tuple[RhinoConnection, bool]:
+        """Return ``(connection, reused)``, preferring a healthy idle one."""
+        while self._idle:
+            conn = self._idle.pop()
+            idle_for = time.monotonic() - conn.last_used
+            if idle_for <= self.idle_timeout and conn.is_alive():
+                return conn, True
+            self._retire(conn)
+        conn = await self._connect()
+        # A connection that already carried the negotiation round-trip can go
+        # stale just like an idle one (legacy listeners hang up after each reply).
+        return conn, conn.requests > 0
+
+    def release(self, conn: RhinoConnection):
+        if len(self._idle) < self.size:
+            self._idle.append(conn)
+        else:
+            self._retire(conn)
+
+    async def request(self, command: dict) -> dict:
+        conn, reused = await self.acquire()
+        try:
+            response = await conn.request(command)
+        except (ConnectionError, OSError) as e:
+            self._retire(conn)
+            # Only a stale pooled connection is worth a second try; a fresh
+            # connection failing means the listener itself is the problem.
+            if not reused or isinstance(e, asyncio.TimeoutError):
+                raise
+            if conn.sent and command.get("type") not in self.IDEMPOTENT_COMMANDS:
+                raise
+            self.reconnects += 1
+            conn = await self._connect()
+            try:
+                response = await conn.request(command)
+            except BaseException:
+                self._retire(conn)
+                raise
+        except BaseException:
+            # Includes cancellation: the reply may still be in flight, so the
+            # stream is out of sync and must not be reused.
+            self._retire(conn)
+            raise
+        self.release(conn)
+        return response
+
+    def stats(self) -> dict:
+        return {
+            "framing": self.framing,
+            "connects": self.connects,
+            "reconnects": self.reconnects,
+            "idle": [c.stats() for c in self._idle],
+            "retired": list(self._retired),
+        }
+
+    def close(self):
+        for conn in self._idle:
+            self._retire(conn)
+        self._idle.clear()
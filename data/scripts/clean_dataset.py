@@ -2,24 +2,35 @@
 """
 Dataset cleaning script for Rhino3D fine-tuning dataset.
 
-Reads all raw data sources, applies quality filters, rewrites weak instructions,
-deduplicates, and outputs:
+Reads all raw data sources, applies quality filters (per entry, across cores),
+rewrites weak instructions, deduplicates (exact, then on AST structure via code_fingerprint.py, then
+near-duplicates via near_dedup.py), and outputs:
   - data/processed/cleaned_pairs.jsonl  (kept entries)
   - data/excluded/                       (removed entries, by reason)
   - data/processed/cleaning_stats.json   (statistics)
 """
 
+import argparse
 import json
 import os
 import re
 import hashlib
 from pathlib import Path
 from collections import defaultdict
+from itertools import islice
+from multiprocessing import Pool
+
+import code_fingerprint
+import jsonl_io
+import near_dedup
 
 BASE = Path(__file__).resolve().parent.parent  # data/
 RAW = BASE / "raw"
 PROCESSED = BASE / "processed"
 EXCLUDED = BASE / "excluded"
+PARALLEL_MIN = 500      # smaller batches are classified in-process
+CHUNK_SIZE = 256
+BATCH_SIZE = 4096       # entries read ahead per classification batch
 
 PROCESSED.mkdir(exist_ok=True)
 EXCLUDED.mkdir(exist_ok=True)
@@ -29,25 +40,50 @@ EXCLUDED.mkdir(exist_ok=True)
 # Helpers
 # ---------------------------------------------------------------------------
 
-def load_jsonl(path):
-    """Load a JSONL file, returning list of dicts."""
-    entries = []
-    with open(path) as f:
-        for line_num, line in enumerate(f, 1):
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                entries.append(json.loads(line))
-            except json.JSONDecodeError:
-                print(f"  WARNING: bad JSON at {path.name}:{line_num}")
-    return entries
+def load_jsonl(path, stats, total_key):
+    """Stream a JSONL file, counting its entries into ``stats[total_key]``."""
+    stats[total_key] = 0
+    for entry in jsonl_io.iter_jsonl(path, on_error="warn"):
+        stats[total_key] += 1
+        yield entry
+
+
+class ExcludedEntries:
+    """Excluded entries, streamed to EXCLUDED/<reason>.jsonl as they are found.
+
+    As a context manager it closes on success and discards on an error, so a
+    run that fails leaves the previous files in place.
+    """
+
+    def __init__(self):
+        self.writers = {}
+
+    def add(self, reason, entry):
+        writer = self.writers.get(reason)
+        if writer is None:
+            writer = self.writers[reason] = jsonl_io.JsonlWriter(EXCLUDED / f"{reason}.jsonl")
+        writer.write(entry)
+
+    def counts(self):
+        return {reason: writer.count for reason, writer in self.writers.items()}
 
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
 
-def write_jsonl(path, entries):
-    with open(path, "w") as f:
-        for e in entries:
-            f.write(json.dumps(e, ensure_ascii=False) + "\n")
+    def discard(self):
+        """Drop what was written; the previous files stay in place."""
+        for writer in self.writers.values():
+            writer.discard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
 
 
 def code_hash(code):
@@ -472,210 +508,290 @@ def rewrite_backlabeled_instruction(entry):
 
 
 # ---------------------------------------------------------------------------
-# Main cleaning pipeline
+# Per-entry classification
 # ---------------------------------------------------------------------------
 
-def main():
-    stats = defaultdict(int)
-    kept = []
-    excluded_by_reason = defaultdict(list)
-    seen_code_hashes = set()
-    seen_instr_hashes = set()
+# (filter, excluded reason, stats key), checked in order; the first match wins
+API_FILTERS = [
+    (is_trivial_getter, "api_trivial_getter", "api_excluded_trivial_getter"),
+    (has_assume_boilerplate, "api_assume_boilerplate", "api_excluded_assume_boilerplate"),
+    (has_csharp_system_types, "api_csharp_types", "api_excluded_csharp_types"),
+    (has_placeholder_none_args, "api_placeholder_none", "api_excluded_placeholder_none"),
+    (has_truncated_instruction, "api_truncated_instruction", "api_excluded_truncated"),
+    (lambda entry: not is_interesting_api_pair(entry),
+     "api_not_interesting", "api_excluded_not_interesting"),
+]
+
+
+def classify_api_pair(entry):
+    """Index into API_FILTERS of the filter that excludes ``entry``, or None to keep it."""
+    for i, (is_excluded, _, _) in enumerate(API_FILTERS):
+        if is_excluded(entry):
+            return i
+    return None
+
+
+def classify_backlabeled(entry):
+    """(rewritten instruction, None) to keep ``entry``, else (None, exclusion reason)."""
+    if is_genuine_rhino_backlabeled(entry):
+        return rewrite_backlabeled_instruction(entry), None
+    reason = "backlabeled_"
+    code = entry.get("code", "")
+    instr = entry.get("instruction", "")
+    if len(code) > 2000:
+        reason += "too_long"
+    elif instr.startswith("Implement the function"):
+        reason += "generic_instruction"
+    elif any(m in code.lower() for m in ["flask", "django", "redis", "fastapi"]):
+        reason += "non_rhino_code"
+    else:
+        reason += "no_rhino_markers"
+    return None, reason
 
-    # -----------------------------------------------------------------------
-    # 1. API Pairs — heavy filtering
-    # -----------------------------------------------------------------------
-    print("Processing API Pairs...")
-    api_pairs = load_jsonl(RAW / "docs" / "api_pairs.jsonl")
-    stats["api_pairs_total"] = len(api_pairs)
-
-    for entry in api_pairs:
-        if is_trivial_getter(entry):
-            excluded_by_reason["api_trivial_getter"].append(entry)
-            stats["api_excluded_trivial_getter"] += 1
-        elif has_assume_boilerplate(entry):
-            excluded_by_reason["api_assume_boilerplate"].append(entry)
-            stats["api_excluded_assume_boilerplate"] += 1
-        elif has_csharp_system_types(entry):
-            excluded_by_reason["api_csharp_types"].append(entry)
-            stats["api_excluded_csharp_types"] += 1
-        elif has_placeholder_none_args(entry):
-            excluded_by_reason["api_placeholder_none"].append(entry)
-            stats["api_excluded_placeholder_none"] += 1
-        elif has_truncated_instruction(entry):
-            excluded_by_reason["api_truncated_instruction"].append(entry)
-            stats["api_excluded_truncated"] += 1
-        elif not is_interesting_api_pair(entry):
-            excluded_by_reason["api_not_interesting"].append(entry)
-            stats["api_excluded_not_interesting"] += 1
-        else:
-            entry["_source_file"] = "api_pairs"
-            kept.append(entry)
-            stats["api_kept"] += 1
 
-    print(f"  API Pairs: {stats['api_kept']} kept / {stats['api_pairs_total']} total")
+class Classifier:
+    """Maps a classify_* function over streamed entries, in order, on a lazily started pool.
 
-    # -----------------------------------------------------------------------
-    # 2. RS Mapping Pairs — keep as-is (good quality)
-    # -----------------------------------------------------------------------
-    print("Processing RS Mapping Pairs...")
-    rs_pairs = load_jsonl(RAW / "docs" / "rs_mapping_pairs.jsonl")
-    stats["rs_mapping_total"] = len(rs_pairs)
+    The functions only read their entry, so the results are the same as a
+    serial run; main() applies them (and all counting) in input order.
+    """
 
-    for entry in rs_pairs:
-        entry["_source_file"] = "rs_mapping_pairs"
-        kept.append(entry)
-        stats["rs_mapping_kept"] += 1
+    def __init__(self, workers=None):
+        self.workers = workers
+        self.pool = None
 
-    print(f"  RS Mapping: {stats['rs_mapping_kept']} kept / {stats['rs_mapping_total']} total")
+    def map(self, classify, entries):
+        """Yield ``(entry, classify(entry))``, reading BATCH_SIZE entries at a time."""
+        entries = iter(entries)
+        while batch := list(islice(entries, BATCH_SIZE)):
+            if self.workers == 1 or len(batch) < PARALLEL_MIN:
+                results = [classify(entry) for entry in batch]
+            else:
+                if self.pool is None:
+                    self.pool = Pool(self.workers)
+                results = self.pool.map(classify, batch, chunksize=CHUNK_SIZE)
+            yield from zip(batch, results)
 
-    # -----------------------------------------------------------------------
-    # 3. Reference Pairs — EXCLUDE ALL (wrong format for code-gen)
-    # -----------------------------------------------------------------------
-    print("Processing Reference Pairs...")
-    ref_pairs = load_jsonl(RAW / "docs" / "reference_pairs.jsonl")
-    stats["reference_total"] = len(ref_pairs)
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
 
-    for entry in ref_pairs:
-        excluded_by_reason["reference_wrong_format"].append(entry)
-        stats["reference_excluded"] += 1
 
-    print(f"  Reference: 0 kept / {stats['reference_total']} total (all excluded: wrong format)")
+# ---------------------------------------------------------------------------
+# Main cleaning pipeline
+# ---------------------------------------------------------------------------
 
-    # -----------------------------------------------------------------------
-    # 4. Sample Pairs — keep all, rewrite instructions
-    # -----------------------------------------------------------------------
-    print("Processing Sample Pairs...")
-    sample_pairs = load_jsonl(RAW / "docs" / "sample_pairs.jsonl")
-    stats["sample_total"] = len(sample_pairs)
-
-    for entry in sample_pairs:
-        filename = entry.get("file", "")
-        if filename in SAMPLE_INSTRUCTION_REWRITES:
-            entry["instruction_original"] = entry["instruction"]
-            entry["instruction"] = SAMPLE_INSTRUCTION_REWRITES[filename]
-            stats["sample_instruction_rewritten"] += 1
-        entry["_source_file"] = "sample_pairs"
-        kept.append(entry)
-        stats["sample_kept"] += 1
-
-    print(f"  Sample Pairs: {stats['sample_kept']} kept / {stats['sample_total']} total"
-          f" ({stats.get('sample_instruction_rewritten', 0)} instructions rewritten)")
+def parse_args():
+    parser = argparse.ArgumentParser(description="Clean and deduplicate the raw dataset.")
+    code_fingerprint.add_arguments(parser)
+    near_dedup.add_arguments(parser)
+    return parser.parse_args()
 
-    # -----------------------------------------------------------------------
-    # 5. Backlabeled — keep only genuine Rhino code <2000 chars, rewrite
-    # -----------------------------------------------------------------------
-    print("Processing Backlabeled...")
-    backlabeled = load_jsonl(RAW / "synthetic" / "backlabeled.jsonl")
-    stats["backlabeled_total"] = len(backlabeled)
-
-    for entry in backlabeled:
-        if is_genuine_rhino_backlabeled(entry):
-            entry["instruction_original"] = entry["instruction"]
-            entry["instruction"] = rewrite_backlabeled_instruction(entry)
-            entry["_source_file"] = "backlabeled"
-            kept.append(entry)
-            stats["backlabeled_kept"] += 1
-        else:
-            reason = "backlabeled_"
-            code = entry.get("code", "")
-            instr = entry.get("instruction", "")
-            if len(code) > 2000:
-                reason += "too_long"
-            elif instr.startswith("Implement the function"):
-                reason += "generic_instruction"
-            elif any(m in code.lower() for m in ["flask", "django", "redis", "fastapi"]):
-                reason += "non_rhino_code"
+
+def main():
+    args = parse_args()
+    near_index = near_dedup.index_from_args(args)
+    classifier = Classifier(args.workers)
+    stats = defaultdict(int)
+    kept = []
+    seen_code_hashes = set()
+    seen_instr_hashes = set()
+    seen_structures = set()
+
+    # Excluded entries are streamed out by reason; the files are replaced only
+    # if cleaning finishes
+    with ExcludedEntries() as excluded:
+        # -------------------------------------------------------------------
+        # 1. API Pairs — heavy filtering
+        # -------------------------------------------------------------------
+        print("Processing API Pairs...")
+        api_pairs = load_jsonl(RAW / "docs" / "api_pairs.jsonl", stats, "api_pairs_total")
+
+        for entry, excluded_by in classifier.map(classify_api_pair, api_pairs):
+            if excluded_by is not None:
+                _, reason, stat = API_FILTERS[excluded_by]
+                excluded.add(reason, entry)
+                stats[stat] += 1
             else:
-                reason += "no_rhino_markers"
-            excluded_by_reason[reason].append(entry)
-            stats[f"backlabeled_excluded_{reason.split('_', 1)[1]}"] += 1
+                entry["_source_file"] = "api_pairs"
+                kept.append(entry)
+                stats["api_kept"] += 1
 
-    print(f"  Backlabeled: {stats['backlabeled_kept']} kept / {stats['backlabeled_total']} total")
+        print(f"  API Pairs: {stats['api_kept']} kept / {stats['api_pairs_total']} total")
 
-    # -----------------------------------------------------------------------
-    # 6. Small Synthetic files — keep all (best quality)
-    # -----------------------------------------------------------------------
-    print("Processing Small Synthetic files...")
-    synth_files = [
-        "geometry_creation.jsonl", "geometry_manipulation.jsonl",
-        "geometry_analysis.jsonl", "advanced_sculptural.jsonl",
-        "scene_management.jsonl", "code_explanation.jsonl",
-        "code_fixing.jsonl", "api_conversion.jsonl",
-    ]
-    for fname in synth_files:
-        path = RAW / "synthetic" / fname
-        if not path.exists():
-            continue
-        entries = load_jsonl(path)
-        stats[f"synthetic_{fname}_total"] = len(entries)
-        for entry in entries:
-            entry["_source_file"] = f"synthetic_{fname}"
+        # -------------------------------------------------------------------
+        # 2. RS Mapping Pairs — keep as-is (good quality)
+        # -------------------------------------------------------------------
+        print("Processing RS Mapping Pairs...")
+        rs_pairs = load_jsonl(RAW / "docs" / "rs_mapping_pairs.jsonl", stats, "rs_mapping_total")
+
+        for entry in rs_pairs:
+            entry["_source_file"] = "rs_mapping_pairs"
+            kept.append(entry)
+            stats["rs_mapping_kept"] += 1
+
+        print(f"  RS Mapping: {stats['rs_mapping_kept']} kept / {stats['rs_mapping_total']} total")
+
+        # -------------------------------------------------------------------
+        # 3. Reference Pairs — EXCLUDE ALL (wrong format for code-gen)
+        # -------------------------------------------------------------------
+        print("Processing Reference Pairs...")
+        ref_pairs = load_jsonl(RAW / "docs" / "reference_pairs.jsonl", stats, "reference_total")
+
+        for entry in ref_pairs:
+            excluded.add("reference_wrong_format", entry)
+            stats["reference_excluded"] += 1
+
+        print(f"  Reference: 0 kept / {stats['reference_total']} total "
+              f"(all excluded: wrong format)")
+
+        # -------------------------------------------------------------------
+        # 4. Sample Pairs — keep all, rewrite instructions
+        # -------------------------------------------------------------------
+        print("Processing Sample Pairs...")
+        sample_pairs = load_jsonl(RAW / "docs" / "sample_pairs.jsonl", stats, "sample_total")
+
+        for entry in sample_pairs:
+            filename = entry.get("file", "")
+            if filename in SAMPLE_INSTRUCTION_REWRITES:
+                entry["instruction_original"] = entry["instruction"]
+                entry["instruction"] = SAMPLE_INSTRUCTION_REWRITES[filename]
+                stats["sample_instruction_rewritten"] += 1
+            entry["_source_file"] = "sample_pairs"
             kept.append(entry)
-            stats[f"synthetic_{fname}_kept"] = stats.get(f"synthetic_{fname}_kept", 0) + 1
+            stats["sample_kept"] += 1
+
+        print(f"  Sample Pairs: {stats['sample_kept']} kept / {stats['sample_total']} total"
+              f" ({stats.get('sample_instruction_rewritten', 0)} instructions rewritten)")
+
+        # -------------------------------------------------------------------
+        # 5. Backlabeled — keep only genuine Rhino code <2000 chars, rewrite
+        # -------------------------------------------------------------------
+        print("Processing Backlabeled...")
+        backlabeled = load_jsonl(RAW / "synthetic" / "backlabeled.jsonl",
+                                 stats, "backlabeled_total")
+
+        for entry, (instruction, reason) in classifier.map(classify_backlabeled, backlabeled):
+            if reason is None:
+                entry["instruction_original"] = entry["instruction"]
+                entry["instruction"] = instruction
+                entry["_source_file"] = "backlabeled"
+                kept.append(entry)
+                stats["backlabeled_kept"] += 1
+            else:
+                excluded.add(reason, entry)
+                stats[f"backlabeled_excluded_{reason.split('_', 1)[1]}"] += 1
+
+        print(f"  Backlabeled: {stats['backlabeled_kept']} kept / "
+              f"{stats['backlabeled_total']} total")
+        classifier.close()
+
+        # -------------------------------------------------------------------
+        # 6. Small Synthetic files — keep all (best quality)
+        # -------------------------------------------------------------------
+        print("Processing Small Synthetic files...")
+        synth_files = [
+            "geometry_creation.jsonl", "geometry_manipulation.jsonl",
+            "geometry_analysis.jsonl", "advanced_sculptural.jsonl",
+            "scene_management.jsonl", "code_explanation.jsonl",
+            "code_fixing.jsonl", "api_conversion.jsonl",
+        ]
+        for fname in synth_files:
+            path = RAW / "synthetic" / fname
+            if not path.exists():
+                continue
+            entries = load_jsonl(path, stats, f"synthetic_{fname}_total")
+            for entry in entries:
+                entry["_source_file"] = f"synthetic_{fname}"
+                kept.append(entry)
+                stats[f"synthetic_{fname}_kept"] = stats.get(f"synthetic_{fname}_kept", 0) + 1
+
+        synth_total = sum(v for k, v in stats.items() if k.startswith("synthetic_") and k.endswith("_total"))
+        synth_kept = sum(v for k, v in stats.items() if k.startswith("synthetic_") and k.endswith("_kept"))
+        print(f"  Small Synthetic: {synth_kept} kept / {synth_total} total")
+
+        # -------------------------------------------------------------------
+        # 7. Deduplication
+        # -------------------------------------------------------------------
+        print("\nDeduplicating...")
+        pre_dedup = len(kept)
+        deduped = []
+        if args.no_structural_dedup:
+            fingerprints = [None] * len(kept)
+        else:
+            fingerprints = code_fingerprint.fingerprints(
+                [entry.get("code", "") for entry in kept], workers=args.workers)
 
-    synth_total = sum(v for k, v in stats.items() if k.startswith("synthetic_") and k.endswith("_total"))
-    synth_kept = sum(v for k, v in stats.items() if k.startswith("synthetic_") and k.endswith("_kept"))
-    print(f"  Small Synthetic: {synth_kept} kept / {synth_total} total")
+        for entry, fp in zip(kept, fingerprints):
+            code = entry.get("code", "")
+            instr = entry.get("instruction", "")
 
-    # -----------------------------------------------------------------------
-    # 7. Deduplication
-    # -----------------------------------------------------------------------
-    print("\nDeduplicating...")
-    pre_dedup = len(kept)
-    deduped = []
+            c_hash = code_hash(code)
+            i_hash = instruction_hash(instr)
+
+            # Check for exact duplicate code
+            if c_hash in seen_code_hashes:
+                excluded.add("duplicate_code", entry)
+                stats["dedup_code"] += 1
+                continue
 
-    for entry in kept:
-        code = entry.get("code", "")
-        instr = entry.get("instruction", "")
+            # Check for exact duplicate instruction
+            if i_hash in seen_instr_hashes:
+                excluded.add("duplicate_instruction", entry)
+                stats["dedup_instruction"] += 1
+                continue
 
-        c_hash = code_hash(code)
-        i_hash = instruction_hash(instr)
+            # Check for the same code up to names, numbers and comments, same request
+            s_key = code_fingerprint.structure_key(fp, instr)
+            if s_key is not None and s_key in seen_structures:
+                excluded.add("duplicate_structure", entry)
+                stats["dedup_structure"] += 1
+                continue
 
-        # Check for exact duplicate code
-        if c_hash in seen_code_hashes:
-            excluded_by_reason["duplicate_code"].append(entry)
-            stats["dedup_code"] += 1
-            continue
+            seen_code_hashes.add(c_hash)
+            seen_instr_hashes.add(i_hash)
+            seen_structures.add(s_key)
 
-        # Check for exact duplicate instruction
-        if i_hash in seen_instr_hashes:
-            excluded_by_reason["duplicate_instruction"].append(entry)
-            stats["dedup_instruction"] += 1
-            continue
+            # Check for near duplicates (template sweeps, renamed copies)
+            if near_index is not None:
+                entry["cluster_id"], match = near_index.add(code, instr)
+                if match is not None:
+                    entry["near_duplicate_match"] = match
+                    excluded.add("near_duplicate", entry)
+                    stats["dedup_near"] += 1
+                    continue
 
-        seen_code_hashes.add(c_hash)
-        seen_instr_hashes.add(i_hash)
-        deduped.append(entry)
+            deduped.append(entry)
 
-    stats["dedup_removed"] = pre_dedup - len(deduped)
-    print(f"  Removed {stats['dedup_removed']} duplicates ({pre_dedup} -> {len(deduped)})")
+        stats["dedup_removed"] = pre_dedup - len(deduped)
+        print(f"  Removed {stats['dedup_removed']} duplicates ({pre_dedup} -> {len(deduped)}, "
+              f"{stats['dedup_structure']} structural, {stats['dedup_near']} near)")
 
-    # -----------------------------------------------------------------------
-    # 8. Clean up internal fields and write output
-    # -----------------------------------------------------------------------
-    print("\nWriting output...")
+        # -------------------------------------------------------------------
+        # 8. Clean up internal fields and write output
+        # -------------------------------------------------------------------
+        print("\nWriting output...")
 
-    # Remove internal tracking field
-    for entry in deduped:
-        entry.pop("_source_file", None)
+        # Remove internal tracking field
+        for entry in deduped:
+            entry.pop("_source_file", None)
 
-    # Write cleaned pairs
-    output_path = PROCESSED / "cleaned_pairs.jsonl"
-    write_jsonl(output_path, deduped)
-    print(f"  Wrote {len(deduped)} entries to {output_path}")
+        # Write cleaned pairs
+        output_path = PROCESSED / "cleaned_pairs.jsonl"
+        jsonl_io.write_jsonl(output_path, deduped)
+        print(f"  Wrote {len(deduped)} entries to {output_path}")
 
-    # Write excluded entries by reason
-    for reason, entries in excluded_by_reason.items():
-        exc_path = EXCLUDED / f"{reason}.jsonl"
-        write_jsonl(exc_path, entries)
-        print(f"  Wrote {len(entries)} excluded entries to {exc_path.name}")
+    excluded_counts = excluded.counts()
+    for reason, count in excluded_counts.items():
+        print(f"  Wrote {count} excluded entries to {reason}.jsonl")
 
     # -----------------------------------------------------------------------
     # 9. Summary stats
     # -----------------------------------------------------------------------
     stats["final_kept"] = len(deduped)
-    stats["total_excluded"] = sum(len(v) for v in excluded_by_reason.values())
+    stats["total_excluded"] = sum(excluded_counts.values())
     stats["total_input"] = (stats["api_pairs_total"] + stats["rs_mapping_total"] +
                             stats["reference_total"] + stats["sample_total"] +
                             stats["backlabeled_total"] + synth_total)
@@ -713,8 +829,8 @@ def main():
         print(f"    {source}: {count}")
     print()
     print("  Excluded breakdown:")
-    for reason, entries in sorted(excluded_by_reason.items(), key=lambda x: -len(x[1])):
-        print(f"    {reason}: {len(entries):,}")
+    for reason, count in sorted(excluded_counts.items(), key=lambda x: -x[1]):
+        print(f"    {reason}: {count:,}")
     print("=" * 60)
 
 
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+AST-normalized code fingerprints for structural deduplication.
+
+Two snippets that differ only in variable names, numeric literals, comments
+or docstrings get the same fingerprint:
+  - comments and formatting are gone once the code is parsed
+  - docstrings of the module, classes and functions are dropped
+  - names bound in the snippet (assignments, loop targets, arguments,
+    functions, classes) are renamed v0, v1, ... in order of appearance;
+    imported modules, builtins and attribute names (the API calls) are kept
+  - int, float and complex literals are bucketed by type
+The normalized tree is dumped and hashed. Code that doesn't parse has no
+fingerprint (None), so it falls back to the exact checks. structure_key()
+pairs the fingerprint with the instruction, numbers masked, so the same
+script under a different request is kept; clean_dataset.py and
+merge_and_validate.py both dedup on it.
+
+Fingerprints are cached per code hash in data/.cache/fingerprints.json and
+computed across cores for the entries that aren't cached yet.
+
+    python data/scripts/code_fingerprint.py data/processed/pairs.jsonl
+"""
+
+import argparse
+import ast
+import hashlib
+import json
+import os
+import sys
+from collections import Counter
+from multiprocessing import Pool
+from pathlib import Path
+
+import near_dedup
+
+BASE = Path(__file__).resolve().parent.parent  # data/
+CACHE_PATH = BASE / ".cache" / "fingerprints.json"
+FINGERPRINT_VERSION = 1     # bump when normalization changes; drops the cache
+PARALLEL_MIN = 200          # fewer uncached entries than this are done in-process
+CHUNK_SIZE = 64
+
+
+# ---------------------------------------------------------------------------
+# Normalization
+# ---------------------------------------------------------------------------
+
+class _Normalizer(ast.NodeTransformer):
+    """Rename bound names, bucket numbers and drop docstrings, in place."""
+
+    def __init__(self, bound):
+        self.bound = bound
+        self.names = {}
+
+    def _rename(self, name):
+        if name not in self.bound:
+            return name
+        return self.names.setdefault(name, f"v{len(self.names)}")
+
+    def _strip_docstring(self, node):
+        body = node.body
+        if (body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant)
+                and isinstance(body[0].value.value, str)):
+            node.body = body[1:] or [ast.Pass()]
+
+    def visit_Module(self, node):
+        self._strip_docstring(node)
+        return self.generic_visit(node)
+
+    def _visit_def(self, node):
+        self._strip_docstring(node)
+        node.name = self._rename(node.name)
+        return self.generic_visit(node)
+
+    visit_FunctionDef = visit_AsyncFunctionDef = visit_ClassDef = _visit_def
+
+    def visit_Name(self, node):
+        node.id = self._rename(node.id)
+        return node
+
+    def visit_arg(self, node):
+        node.arg = self._rename(node.arg)
+        return self.generic_visit(node)
+
+    def visit_ExceptHandler(self, node):
+        if node.name:
+            node.name = self._rename(node.name)
+        return self.generic_visit(node)
+
+    def visit_Constant(self, node):
+        if isinstance(node.value, (int, float, complex)) and not isinstance(node.value, bool):
+            node.value = f"<{type(node.value).__name__}>"
+        return node
+
+
+def _bound_names(tree):
+    """Names the snippet itself binds; imports are left out on purpose."""
+    bound = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+            bound.add(node.id)
+        elif isinstance(node, ast.arg):
+            bound.add(node.arg)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            bound.add(node.name)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            bound.add(node.name)
+    return bound
+
+
+def normalize(code):
+    """The normalized AST dump of ``code``, or None if it doesn't parse."""
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return None
+    tree = _Normalizer(_bound_names(tree)).visit(tree)
+    return ast.dump(tree, annotate_fields=False)
+
+
+def fingerprint(code):
+    """16-hex-digit structural hash of ``code``, or None if it doesn't parse."""
+    dump = normalize(code)
+    if dump is None:
+        return None
+    return hashlib.sha1(dump.encode()).hexdigest()[:16]
+
+
+def structure_key(fingerprint, instruction):
+    """Dedup key: the code's fingerprint + the instruction with numbers masked.
+
+    None when the code has no fingerprint, i.e. the pair can't be a structural duplicate.
+    """
+    if fingerprint is None:
+        return None
+    inst = " ".join(near_dedup.tokens(instruction, lower=True))
+    return hashlib.sha256(f"{inst}||{fingerprint}".encode()).hexdigest()
+
+
+# ---------------------------------------------------------------------------
+# Cached, parallel batch
+# ---------------------------------------------------------------------------
+
+def _code_key(code):
+    return hashlib.sha1(code.encode()).hexdigest()
+
+
+def load_cache(path=CACHE_PATH):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != FINGERPRINT_VERSION:
+        return {}
+    return data.get("fingerprints", {})
+
+
+def save_cache(cache, path=CACHE_PATH):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump({"version": FINGERPRINT_VERSION, "fingerprints": cache}, f)
+    os.replace(tmp, path)
+
+
+def fingerprints(codes, workers=None, cache_path=CACHE_PATH):
+    """Fingerprint every code string, in order; None where it doesn't parse.
+
+    Cached results are reused; the rest are computed on ``workers`` processes
+    (default: all cores) and added to the cache.
+    """
+    cache = load_cache(cache_path) if cache_path is not None else {}
+    keys = [_code_key(c) for c in codes]
+    missing = {}
+    for key, code in zip(keys, codes):
+        if key not in cache and key not in missing:
+            missing[key] = code
+    if missing:
+        todo = list(missing.values())
+        if len(todo) < PARALLEL_MIN or workers == 1:
+            results = [fingerprint(c) for c in todo]
+        else:
+            with Pool(workers) as pool:
+                results = pool.map(fingerprint, todo, chunksize=CHUNK_SIZE)
+        cache.update(zip(missing, results))
+        if cache_path is not None:
+            save_cache(cache, cache_path)
+    return [cache[key] for key in keys]
+
+
+def add_arguments(parser):
+    """The options shared by the scripts that dedup on fingerprints."""
+    parser.add_argument("--no-structural-dedup", action="store_true",
+                        help="don't drop code that matches an earlier entry after AST normalization")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes (default: all cores)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report structural duplicates in JSONL files.")
+    parser.add_argument("paths", nargs="+", type=Path)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    codes = []
+    for path in args.paths:
+        with open(path, encoding="utf-8") as f:
+            codes += [json.loads(line).get("code", "") for line in f if line.strip()]
+    fps = fingerprints(codes, workers=args.workers)
+    counts = Counter(fp for fp in fps if fp is not None)
+    dupes = sum(n - 1 for n in counts.values())
+    print(f"Entries:               {len(codes):,}")
+    print(f"Unparseable:           {fps.count(None):,}")
+    print(f"Distinct structures:   {len(counts):,}")
+    print(f"Structural duplicates: {dupes:,}")
+    print(f"Cache:                 {CACHE_PATH}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
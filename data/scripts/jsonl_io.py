@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Streaming JSONL reading and writing shared by the pipeline scripts.
+
+Readers are generators, so a stage holds one record at a time unless it
+needs more. Writers buffer encoded lines and write them in large blocks, and
+replace the target only once they close cleanly, so a stage that fails
+leaves its previous output in place.
+
+Files ending in .gz are gzip-compressed and files ending in .zst are
+zstd-compressed (needs the zstandard package); anything else is plain text.
+
+Decoding uses orjson or msgspec when one is installed, else the json module.
+A line the fast decoder rejects is retried with the json module, which
+accepts a little more (NaN, lone surrogates), and lines with integers too
+long for 64 bits go straight to it, as orjson would read them as floats.
+So records and errors are the same either way. Encoding always uses the
+json module: orjson's compact separators would change every output byte.
+"""
+
+import gzip
+import io
+import json
+import os
+import re
+from pathlib import Path
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+JSONL_SUFFIXES = (".jsonl", ".jsonl.gz", ".jsonl.zst")
+WRITE_BUFFER = 1 << 20      # bytes of encoded lines held before a write
+_LONG_DIGITS = re.compile(rb"\d{19,}")   # may not fit in 64 bits
+
+_fast_loads = None
+_FAST_ERRORS = (ValueError, TypeError)
+if orjson is not None:
+    _fast_loads = orjson.loads
+elif msgspec is not None:
+    _fast_loads = msgspec.json.Decoder().decode
+    _FAST_ERRORS += (msgspec.DecodeError,)
+
+
+# ---------------------------------------------------------------------------
+# Files
+# ---------------------------------------------------------------------------
+
+def _zstandard():
+    if zstandard is None:
+        raise RuntimeError("reading or writing .zst files needs the zstandard package")
+    return zstandard
+
+
+def open_binary(path):
+    """Open ``path`` for binary reading, decompressing by suffix."""
+    path = Path(path)
+    if path.suffix == ".gz":
+        return gzip.open(path, "rb")
+    if path.suffix == ".zst":
+        raw = open(path, "rb")
+        return io.BufferedReader(_zstandard().ZstdDecompressor().stream_reader(raw, closefd=True))
+    return open(path, "rb")
+
+
+def _compressor(raw, suffix):
+    """A writer over the binary file ``raw`` that compresses for ``suffix``; None if plain.
+
+    gzip headers get no name or timestamp, so equal records give equal bytes.
+    """
+    if suffix == ".gz":
+        return gzip.GzipFile(filename="", mode="wb", fileobj=raw, mtime=0)
+    if suffix == ".zst":
+        return _zstandard().ZstdCompressor().stream_writer(raw, closefd=False)
+    return None
+
+
+def jsonl_files(directory):
+    """Sorted JSONL files in ``directory``, compressed or not."""
+    return sorted(p for p in Path(directory).iterdir()
+                  if p.is_file() and p.name.endswith(JSONL_SUFFIXES))
+
+
+# ---------------------------------------------------------------------------
+# Reading
+# ---------------------------------------------------------------------------
+
+def decode(line):
+    """One JSON value from ``line`` (bytes or str); raises json.JSONDecodeError."""
+    raw = line.encode("utf-8", "surrogatepass") if isinstance(line, str) else line
+    if _fast_loads is not None and not _LONG_DIGITS.search(raw):
+        try:
+            return _fast_loads(line)
+        except _FAST_ERRORS:
+            pass
+    return json.loads(line)
+
+
+def iter_lines(path):
+    """Yield ``(line_num, line)`` for each non-blank line of ``path``, stripped, as bytes."""
+    with open_binary(path) as f:
+        for line_num, line in enumerate(f, 1):
+            line = line.strip()
+            if line:
+                yield line_num, line
+
+
+def enumerate_jsonl(path, on_error="raise"):
+    """Yield ``(line_num, record)`` for each non-blank line of ``path``.
+
+    ``on_error`` says what to do with a line that isn't valid JSON: "raise",
+    "skip", "warn" (print a warning and skip) or a callable taking
+    ``(path, line_num, error)``.
+    """
+    path = Path(path)
+    for line_num, line in iter_lines(path):
+        try:
+            record = decode(line)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            if on_error == "raise":
+                raise ValueError(f"{path.name}:{line_num}: bad JSON: {e}") from e
+            if on_error == "warn":
+                print(f"  WARNING: bad JSON at {path.name}:{line_num}")
+            elif callable(on_error):
+                on_error(path, line_num, e)
+            continue
+        yield line_num, record
+
+
+def iter_jsonl(path, on_error="raise"):
+    """Yield each record of ``path``; see enumerate_jsonl for ``on_error``."""
+    for _, record in enumerate_jsonl(path, on_error):
+        yield record
+
+
+def read_jsonl(path, on_error="raise"):
+    """All records of ``path`` in a list, for stages that need them at once."""
+    return list(iter_jsonl(path, on_error))
+
+
+# ---------------------------------------------------------------------------
+# Writing
+# ---------------------------------------------------------------------------
+
+class JsonlWriter:
+    """Buffered JSONL writer; the file appears under ``path`` when it closes.
+
+        with JsonlWriter(path) as out:
+            for record in records:
+                out.write(record)
+
+    Lines are ``json.dumps(record, ensure_ascii=...)`` with the default
+    separators, the format the pipeline has always written.
+    """
+
+    def __init__(self, path, ensure_ascii=False):
+        self.path = Path(path)
+        self.tmp = self.path.with_name(self.path.name + ".tmp")
+        self.encode = json.JSONEncoder(ensure_ascii=ensure_ascii).encode
+        self.raw = open(self.tmp, "wb")
+        self.compressor = _compressor(self.raw, self.path.suffix)
+        self.file = self.compressor or self.raw
+        self.buffer = []
+        self.buffered = 0
+        self.count = 0
+
+    def write(self, record):
+        line = (self.encode(record) + "\n").encode("utf-8")
+        self.buffer.append(line)
+        self.buffered += len(line)
+        self.count += 1
+        if self.buffered >= WRITE_BUFFER:
+            self.flush()
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+        return self
+
+    def flush(self):
+        if self.buffer:
+            self.file.write(b"".join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+    def close(self):
+        """Write what's buffered and move the file into place."""
+        if self.file is None:
+            return
+        self.flush()
+        self._close_files()
+        os.replace(self.tmp, self.path)
+
+    def discard(self):
+        """Drop everything written; the previous file at ``path`` stays."""
+        if self.file is None:
+            return
+        self._close_files()
+        self.tmp.unlink(missing_ok=True)
+
+    def _close_files(self):
+        if self.compressor is not None:
+            self.compressor.close()
+        self.raw.close()
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def write_jsonl(path, records, ensure_ascii=False):
+    """Write ``records`` (any iterable) to ``path``; returns how many were written."""
+    with JsonlWriter(path, ensure_ascii) as out:
+        out.write_all(records)
+    return out.count
@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
 """Merge cleaned_pairs.jsonl + synthetic_v2/*.jsonl → pairs.jsonl
-Deduplicates on (instruction, code), validates JSON syntax, prints stats.
+Deduplicates on (instruction, code), then on structure (code_fingerprint.py
+with numbers masked in the instruction), then drops near duplicates
+(near_dedup.py) and records each pair's cluster_id; validates JSON syntax,
+prints stats.
 """
 
+import argparse
 import json
 import ast
 import os
@@ -10,6 +14,10 @@ import hashlib
 from pathlib import Path
 from collections import Counter
 
+import code_fingerprint
+import jsonl_io
+import near_dedup
+
 ROOT = Path(__file__).resolve().parents[1]  # data/
 CLEANED = ROOT / "processed" / "cleaned_pairs.jsonl"
 SYNTH_DIR = ROOT / "raw" / "synthetic_v2"
@@ -23,11 +31,11 @@ def dedup_key(entry: dict) -> str:
     return hashlib.sha256(f"{inst}||{code}".encode()).hexdigest()
 
 
-def validate_json_line(line: str, filepath: str, lineno: int):
+def validate_json_line(line: bytes, filepath: str, lineno: int):
     """Parse a single JSONL line. Returns (entry, error_msg | None)."""
     try:
-        entry = json.loads(line)
-    except json.JSONDecodeError as e:
+        entry = jsonl_io.decode(line)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
         return None, f"{filepath}:{lineno} — bad JSON: {e}"
     if not isinstance(entry, dict):
         return None, f"{filepath}:{lineno} — not a JSON object"
@@ -58,16 +66,17 @@ def has_rhino_import(code: str) -> bool:
 
 def load_jsonl(filepath: Path):
     """Yield (entry, error) tuples from a JSONL file."""
-    with open(filepath, "r", encoding="utf-8") as f:
-        for lineno, line in enumerate(f, 1):
-            line = line.strip()
-            if not line:
-                continue
-            entry, err = validate_json_line(line, filepath.name, lineno)
-            yield entry, err
+    for lineno, line in jsonl_io.iter_lines(filepath):
+        yield validate_json_line(line, filepath.name, lineno)
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Merge, deduplicate and validate the dataset.")
+    code_fingerprint.add_arguments(parser)
+    near_dedup.add_arguments(parser)
+    args = parser.parse_args()
+    near_index = near_dedup.index_from_args(args)
+
     all_entries = []
     errors = []
     source_counts = Counter()
@@ -83,7 +92,7 @@ def main():
             source_counts[CLEANED.name] += 1
 
     # --- Load synthetic_v2 ---
-    synth_files = sorted(SYNTH_DIR.glob("*.jsonl"))
+    synth_files = jsonl_io.jsonl_files(SYNTH_DIR)
     for sf in synth_files:
         print(f"Loading {sf.name} ...")
         for entry, err in load_jsonl(sf):
@@ -110,6 +119,34 @@ def main():
             dupe_count += 1
     all_entries = unique
 
+    # --- Structural duplicates: same code up to names, numbers and comments ---
+    structure_dupe_count = 0
+    if not args.no_structural_dedup:
+        fingerprints = code_fingerprint.fingerprints(
+            [e["code"] for e in all_entries], workers=args.workers)
+        seen = set()
+        unique = []
+        for entry, fp in zip(all_entries, fingerprints):
+            key = code_fingerprint.structure_key(fp, entry.get("instruction", ""))
+            if key is None or key not in seen:
+                seen.add(key)
+                unique.append(entry)
+            else:
+                structure_dupe_count += 1
+        all_entries = unique
+
+    # --- Near duplicates: keep the first pair of each cluster ---
+    near_dupe_count = 0
+    if near_index is not None:
+        unique = []
+        for entry in all_entries:
+            entry["cluster_id"], match = near_index.add(entry["code"], entry["instruction"])
+            if match is None:
+                unique.append(entry)
+            else:
+                near_dupe_count += 1
+        all_entries = unique
+
     # --- Python syntax check ---
     syntax_ok = 0
     syntax_fail = 0
@@ -129,9 +166,7 @@ def main():
 
     # --- Write output ---
     OUTPUT.parent.mkdir(parents=True, exist_ok=True)
-    with open(OUTPUT, "w", encoding="utf-8") as f:
-        for entry in all_entries:
-            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    jsonl_io.write_jsonl(OUTPUT, all_entries)
 
     # --- Stats ---
     avg_inst = sum(len(e["instruction"]) for e in all_entries) / len(all_entries)
@@ -152,6 +187,8 @@ def main():
         print(f"  {sf.name}: {source_counts[sf.name]}")
     print(f"\nTotal before dedup:     {total_before}")
     print(f"Duplicates removed:     {dupe_count}")
+    print(f"Structural duplicates:  {structure_dupe_count}")
+    print(f"Near duplicates:        {near_dupe_count}")
     print(f"Final unique pairs:     {len(all_entries)}")
     print(f"\nJSON parse errors:      {len(errors)}")
     print(f"Python syntax valid:    {syntax_ok} ({100*syntax_ok/len(all_entries):.1f}%)")
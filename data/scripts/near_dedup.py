@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate detection for (instruction, code) pairs with MinHash + LSH.
+
+Exact hashing misses template-expanded pairs that differ by one coordinate.
+Here every entry gets a MinHash signature of its code token shingles and
+one of its instruction word n-grams, with numbers masked out. Signatures
+use one-permutation hashing: each shingle is hashed once into one of
+NUM_PERM bins, instead of once per permutation, which keeps multi-thousand
+line GitHub files cheap. LSH banding turns signatures into bucket keys, so
+only entries that share a bucket are compared, and candidates are confirmed
+by exact Jaccard similarity of the shingle sets. Cost grows with the number
+of entries, not its square.
+
+Entries are streamed in order. Each one joins the cluster of its most
+similar earlier entry, if any reaches the code or instruction threshold,
+and otherwise starts a cluster of its own; the first entry of a cluster is
+its representative. clean_dataset.py and merge_and_validate.py keep the
+representatives and record every entry's cluster_id.
+
+Run on its own to report clusters in JSONL files or directories of scraped
+JSON records (GitHub files, Discourse topics):
+    python data/scripts/near_dedup.py data/raw/github data/raw/discourse
+    python data/scripts/near_dedup.py data/processed/pairs.jsonl --out clusters.jsonl
+"""
+
+import argparse
+import bisect
+import hashlib
+import json
+import random
+import re
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+CODE_THRESHOLD = 0.85         # Jaccard of code token shingles
+INSTRUCTION_THRESHOLD = 0.9   # Jaccard of instruction word n-grams
+CODE_SHINGLE = 5              # tokens per code shingle
+INSTRUCTION_NGRAM = 3         # words per instruction n-gram
+NUM_PERM = 128                # signature length (one-permutation hashing bins)
+LSH_RECALL = 0.95             # chance a pair right at the threshold shares a bucket
+SEED = 42
+
+TOKEN = re.compile(r"\d+(?:\.\d*)?|\.\d+|\w+|[^\w\s]")
+NUMBER = re.compile(r"[\d.]+$")
+
+
+# ---------------------------------------------------------------------------
+# Shingles and signatures
+# ---------------------------------------------------------------------------
+
+def tokens(text, lower=False):
+    """Split into identifier, number and punctuation tokens; numbers become '0'."""
+    if lower:
+        text = text.lower()
+    return ["0" if NUMBER.match(t) and t != "." else t for t in TOKEN.findall(text)]
+
+
+def shingles(toks, k):
+    """Set of k-token shingles; a text shorter than k is one shingle."""
+    if len(toks) <= k:
+        return {" ".join(toks)} if toks else set()
+    return {" ".join(toks[i:i + k]) for i in range(len(toks) - k + 1)}
+
+
+def code_shingles(code):
+    return shingles(tokens(code), CODE_SHINGLE)
+
+
+def instruction_shingles(instruction):
+    return shingles(tokens(instruction, lower=True), INSTRUCTION_NGRAM)
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+class MinHasher:
+    """One-permutation MinHash: one seeded 64-bit hash per shingle, split into bins."""
+
+    def __init__(self, num_perm=NUM_PERM, seed=SEED):
+        self.num_perm = num_perm
+        self.key = random.Random(seed).randbytes(16)
+
+    def _hash(self, shingle):
+        return int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8,
+                                              key=self.key).digest(), "little")
+
+    def signature(self, shingle_set):
+        k = self.num_perm
+        bins = [None] * k
+        for s in shingle_set:
+            j, v = divmod(self._hash(s), k)[::-1]
+            if bins[j] is None or v < bins[j]:
+                bins[j] = v
+        filled = [j for j in range(k) if bins[j] is not None]
+        if len(filled) < k:
+            # Densify: an empty bin borrows the value of the next filled one,
+            # offset by the distance so it can't equal a value of its own.
+            for j in range(k):
+                if bins[j] is None:
+                    i = bisect.bisect(filled, j)
+                    src = filled[i % len(filled)]
+                    bins[j] = bins[src] + ((src - j) % k << 64)
+        return tuple(bins)
+
+
+# ---------------------------------------------------------------------------
+# LSH index
+# ---------------------------------------------------------------------------
+
+def lsh_params(threshold, num_perm=NUM_PERM):
+    """(bands, rows) with the most rows that still finds LSH_RECALL of pairs at ``threshold``.
+
+    More rows per band means fewer unrelated entries share a bucket.
+    """
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        if 1 - (1 - threshold ** rows) ** bands >= LSH_RECALL:
+            best = (bands, rows)
+    return best
+
+
+class LSHIndex:
+    """Banded MinHash buckets over shingle sets, with exact Jaccard on candidates."""
+
+    def __init__(self, threshold, hasher):
+        self.threshold = threshold
+        self.hasher = hasher
+        self.bands, self.rows = lsh_params(threshold, hasher.num_perm)
+        self.buckets = [defaultdict(list) for _ in range(self.bands)]
+        self.sets = {}
+        self.candidates = 0
+
+    def _keys(self, signature):
+        r = self.rows
+        return [hash(signature[i * r:(i + 1) * r]) for i in range(self.bands)]
+
+    def query_add(self, key, shingle_set):
+        """Add ``shingle_set`` under ``key``; return [(earlier key, jaccard)] above the threshold."""
+        if not shingle_set:
+            return []
+        band_keys = self._keys(self.hasher.signature(shingle_set))
+        seen = set()
+        for bucket, band_key in zip(self.buckets, band_keys):
+            seen.update(bucket.get(band_key, ()))
+        self.candidates += len(seen)
+        matches = []
+        for other in seen:
+            sim = jaccard(shingle_set, self.sets[other])
+            if sim >= self.threshold:
+                matches.append((other, sim))
+        for bucket, band_key in zip(self.buckets, band_keys):
+            bucket[band_key].append(key)
+        self.sets[key] = shingle_set
+        return matches
+
+
+class NearDuplicateIndex:
+    """Assigns streamed (code, instruction) pairs to near-duplicate clusters.
+
+    A threshold of None turns that field's check off.
+    """
+
+    def __init__(self, code_threshold=CODE_THRESHOLD,
+                 instruction_threshold=INSTRUCTION_THRESHOLD,
+                 num_perm=NUM_PERM, seed=SEED):
+        hasher = MinHasher(num_perm, seed)
+        self.indexes = []
+        if code_threshold is not None:
+            self.indexes.append((LSHIndex(code_threshold, hasher), code_shingles, "code"))
+        if instruction_threshold is not None:
+            self.indexes.append((LSHIndex(instruction_threshold, hasher),
+                                 instruction_shingles, "instruction"))
+        self.clusters = []   # cluster id per added entry
+        self.sizes = []      # entries per cluster
+
+    def add(self, code, instruction):
+        """Return ``(cluster_id, match)``; match is None for a new cluster's representative,
+        else ``(field, jaccard)`` of the closest earlier entry."""
+        key = len(self.clusters)
+        texts = {"code": code or "", "instruction": instruction or ""}
+        best = None
+        for index, to_shingles, field in self.indexes:
+            for other, sim in index.query_add(key, to_shingles(texts[field])):
+                if best is None or (sim, -other) > (best[2], -best[0]):
+                    best = (other, field, sim)
+        if best is None:
+            cluster = len(self.sizes)
+            self.sizes.append(0)
+        else:
+            cluster = self.clusters[best[0]]
+        self.clusters.append(cluster)
+        self.sizes[cluster] += 1
+        return cluster, (best[1], round(best[2], 3)) if best else None
+
+
+def add_arguments(parser, optional=True):
+    """The threshold options shared by the scripts that dedup with this module."""
+    parser.add_argument("--code-threshold", type=float, default=CODE_THRESHOLD,
+                        help=f"code shingle Jaccard for a near duplicate (default {CODE_THRESHOLD})")
+    parser.add_argument("--instruction-threshold", type=float, default=INSTRUCTION_THRESHOLD,
+                        help="instruction n-gram Jaccard for a near duplicate "
+                             f"(default {INSTRUCTION_THRESHOLD})")
+    if optional:
+        parser.add_argument("--no-near-dedup", action="store_true",
+                            help="only remove exact duplicates")
+
+
+def index_from_args(args):
+    """A NearDuplicateIndex for add_arguments' options; None with --no-near-dedup.
+
+    A threshold above 1 turns that field's check off.
+    """
+    if getattr(args, "no_near_dedup", False):
+        return None
+    return NearDuplicateIndex(
+        code_threshold=args.code_threshold if args.code_threshold <= 1 else None,
+        instruction_threshold=args.instruction_threshold if args.instruction_threshold <= 1 else None)
+
+
+# ---------------------------------------------------------------------------
+# Standalone report
+# ---------------------------------------------------------------------------
+
+def record_pair(record):
+    """(instruction, code) of a pair, scraped GitHub file or Discourse topic."""
+    if "code_blocks" in record:
+        code = "\n\n".join(b.get("code", "") if isinstance(b, dict) else str(b)
+                           for b in record["code_blocks"] or [])
+        return record.get("title", ""), code
+    return record.get("instruction", ""), record.get("code", "")
+
+
+def iter_records(paths):
+    """Yield (source, record) from JSONL files and directories of .json/.jsonl files."""
+    for path in paths:
+        files = sorted(path.glob("*.json*")) if path.is_dir() else [path]
+        for f in files:
+            if f.suffix == ".json":
+                with open(f, encoding="utf-8") as fh:
+                    yield f.name, json.load(fh)
+                continue
+            with open(f, encoding="utf-8") as fh:
+                for line_num, line in enumerate(fh, 1):
+                    if line.strip():
+                        yield f"{f.name}:{line_num}", json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report near-duplicate clusters.")
+    parser.add_argument("paths", nargs="+", type=Path,
+                        help="JSONL files, or directories of .json/.jsonl records")
+    parser.add_argument("--out", type=Path, help="write {source, cluster_id, match} per record")
+    add_arguments(parser, optional=False)
+    args = parser.parse_args()
+
+    index = index_from_args(args)
+    rows = []
+    for source, record in iter_records(args.paths):
+        instruction, code = record_pair(record)
+        cluster, match = index.add(code, instruction)
+        rows.append({"source": source, "cluster_id": cluster, "match": match})
+
+    sizes = index.sizes
+    dupes = len(rows) - len(sizes)
+    print(f"Records:         {len(rows):,}")
+    print(f"Clusters:        {len(sizes):,}")
+    print(f"Near duplicates: {dupes:,} ({100 * dupes / max(len(rows), 1):.1f}%)")
+    for lsh, _, field in index.indexes:
+        print(f"  {field}: {lsh.bands} bands x {lsh.rows} rows, "
+              f"{lsh.candidates:,} candidate pairs checked")
+    largest = sorted(range(len(sizes)), key=lambda c: -sizes[c])[:10]
+    first = {}
+    for row in rows:
+        first.setdefault(row["cluster_id"], row["source"])
+    print("Largest clusters:")
+    for c in largest:
+        if sizes[c] > 1:
+            print(f"  {sizes[c]:5}  {first[c]}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+        print(f"Wrote {args.out}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
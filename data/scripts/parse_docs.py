@@ -17,6 +17,8 @@ import textwrap
 from pathlib import Path
 from collections import defaultdict
 
+import jsonl_io
+
 # ---------------------------------------------------------------------------
 # Paths
 # ---------------------------------------------------------------------------
@@ -38,10 +40,8 @@ OUT_SUMMARY = RAW_DOCS / "summary.json"
 # Helpers
 # ---------------------------------------------------------------------------
 def write_jsonl(path: Path, records: list[dict]):
-    with open(path, "w", encoding="utf-8") as f:
-        for rec in records:
-            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
-    print(f"  Wrote {len(records)} pairs → {path.name}")
+    count = jsonl_io.write_jsonl(path, records)
+    print(f"  Wrote {count} pairs → {path.name}")
 
 
 def clean_summary(text: str | None) -> str:
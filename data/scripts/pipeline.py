@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Incremental runner for the data pipeline:
+
+    parse_docs → generate_synthetic → clean_dataset → merge_and_validate → format_dataset
+
+Each stage declares the files it reads (its scripts included) and the files
+it writes. Before a stage runs, its inputs are hashed; the hashes and the
+command make up the stage's key. Every run records a manifest under that key
+with the hashes of the outputs it wrote, and the outputs themselves are kept
+in a content-addressed store (data/.cache/pipeline/objects). So a stage:
+  - is skipped when the outputs on disk already match the manifest for the key
+  - has its outputs restored from the store when the key was seen before
+    (e.g. after reverting a cleaning heuristic); files matching its output
+    patterns that that run didn't write are removed first
+  - runs otherwise
+A stage that runs but writes the same bytes as before leaves the next stage's
+key unchanged, so that stage is skipped too. Editing clean_dataset.py reruns
+clean_dataset and whatever its changed outputs feed, never parse_docs or the
+GitHub backlabeling. Within a stage, per-entry work that is expensive is
+cached in the same data/.cache directory (see code_fingerprint.py).
+
+File hashes are remembered by size and mtime, so an unchanged 50 MB scrape
+isn't re-read to find out that it's unchanged.
+
+    python data/scripts/pipeline.py                       # run what's out of date
+    python data/scripts/pipeline.py --since clean_dataset # rerun from a stage on, leaving
+                                                          # the stages before it alone
+    python data/scripts/pipeline.py --dry-run             # show what would run
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+BASE = Path(__file__).resolve().parent.parent  # data/
+ROOT = BASE.parent
+CACHE = BASE / ".cache" / "pipeline"
+OBJECTS = CACHE / "objects"
+MANIFESTS = CACHE / "manifests"
+HASHES = CACHE / "hashes.json"
+KEEP_RUNS = 5       # manifests kept per stage; older outputs are dropped from the store
+
+
+# ---------------------------------------------------------------------------
+# Stages
+# ---------------------------------------------------------------------------
+
+@dataclass
+class Stage:
+    name: str
+    commands: list[list[str]]   # run from the repo root with this Python
+    inputs: list[str]           # globs relative to the repo root
+    outputs: list[str]
+
+
+STAGES = [
+    Stage("parse_docs",
+          [["data/scripts/parse_docs.py"]],
+          ["data/scripts/parse_docs.py",
+           "data/scripts/jsonl_io.py",
+           "data/raw/docs/api_info.json",
+           "data/raw/docs/samples/**/*.py",
+           "data/raw/docs/rhinoscriptsyntax_src/**/*.py"],
+          ["data/raw/docs/api_pairs.jsonl",
+           "data/raw/docs/sample_pairs.jsonl",
+           "data/raw/docs/rs_mapping_pairs.jsonl",
+           "data/raw/docs/reference_pairs.jsonl",
+           "data/raw/docs/summary.json"]),
+    Stage("generate_synthetic",
+          [["scripts/generate_synthetic.py"], ["scripts/generate_synthetic_v2.py"]],
+          ["scripts/generate_synthetic.py",
+           "scripts/generate_synthetic_v2.py",
+           "scripts/synth_v2/*.py",
+           "data/raw/github/*.json",
+           "data/raw/synthetic/*.jsonl"],
+          ["data/raw/synthetic/backlabeled.jsonl",
+           "data/raw/synthetic/summary.json",
+           "data/raw/synthetic_v2/*.jsonl",
+           "data/raw/synthetic_v2/*.json"]),
+    Stage("clean_dataset",
+          [["data/scripts/clean_dataset.py"]],
+          ["data/scripts/clean_dataset.py",
+           "data/scripts/code_fingerprint.py",
+           "data/scripts/jsonl_io.py",
+           "data/scripts/near_dedup.py",
+           "data/raw/docs/*_pairs.jsonl",
+           "data/raw/synthetic/*.jsonl"],
+          ["data/processed/cleaned_pairs.jsonl",
+           "data/processed/cleaning_stats.json",
+           "data/excluded/*.jsonl"]),
+    Stage("merge_and_validate",
+          [["data/scripts/merge_and_validate.py"]],
+          ["data/scripts/merge_and_validate.py",
+           "data/scripts/code_fingerprint.py",
+           "data/scripts/jsonl_io.py",
+           "data/scripts/near_dedup.py",
+           "data/processed/cleaned_pairs.jsonl",
+           "data/raw/synthetic_v2/*.jsonl",
+           "data/raw/synthetic_v2/*.jsonl.gz",
+           "data/raw/synthetic_v2/*.jsonl.zst"],
+          ["data/processed/pairs.jsonl"]),
+    Stage("format_dataset",
+          [["training/format_dataset.py"]],
+          ["training/format_dataset.py",
+           "data/scripts/jsonl_io.py",
+           "data/processed/pairs.jsonl"],
+          ["training/data/chat_formatted.jsonl",
+           "training/data/train.jsonl",
+           "training/data/valid.jsonl"]),
+]
+STAGE_NAMES = [s.name for s in STAGES]
+
+
+def expand(patterns):
+    """Sorted repo-relative paths of the files matching ``patterns``."""
+    paths = set()
+    for pattern in patterns:
+        paths.update(p.relative_to(ROOT).as_posix() for p in ROOT.glob(pattern) if p.is_file())
+    return sorted(paths)
+
+
+# ---------------------------------------------------------------------------
+# Content hashes
+# ---------------------------------------------------------------------------
+
+class HashCache:
+    """sha256 of files, reused while a file's size and mtime are unchanged."""
+
+    def __init__(self, path=HASHES):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+        self.dirty = False
+
+    def digest(self, rel):
+        st = (ROOT / rel).stat()
+        cached = self.entries.get(rel)
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+        h = hashlib.sha256()
+        with open(ROOT / rel, "rb") as f:
+            while chunk := f.read(1 << 20):
+                h.update(chunk)
+        self.entries[rel] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+        self.dirty = True
+        return h.hexdigest()
+
+    def digests(self, rels):
+        return {rel: self.digest(rel) for rel in rels}
+
+    def save(self):
+        if not self.dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.path)
+
+
+def stage_key(stage, input_hashes):
+    blob = json.dumps({"commands": stage.commands, "inputs": input_hashes}, sort_keys=True)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+# ---------------------------------------------------------------------------
+# Manifests and the object store
+# ---------------------------------------------------------------------------
+
+def load_manifest(name):
+    try:
+        with open(MANIFESTS / f"{name}.json") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"runs": []}
+
+
+def save_manifest(name, manifest):
+    MANIFESTS.mkdir(parents=True, exist_ok=True)
+    path = MANIFESTS / f"{name}.json"
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, path)
+
+
+def object_path(digest):
+    return OBJECTS / digest[:2] / digest
+
+
+def store(rel, digest):
+    dest = object_path(digest)
+    if not dest.exists():
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dest.with_suffix(".tmp")
+        shutil.copyfile(ROOT / rel, tmp)   # a copy: stages rewrite their outputs in place
+        os.replace(tmp, dest)
+
+
+def restore(rel, digest):
+    dest = ROOT / rel
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dest.with_name(dest.name + ".restore")
+    shutil.copyfile(object_path(digest), tmp)
+    os.replace(tmp, dest)
+
+
+def collect_garbage():
+    """Drop stored outputs that no kept manifest refers to."""
+    live = set()
+    for name in STAGE_NAMES:
+        for run in load_manifest(name)["runs"]:
+            live.update(run["outputs"].values())
+    if not OBJECTS.exists():
+        return
+    for obj in OBJECTS.glob("*/*"):
+        if obj.name not in live:
+            obj.unlink()
+
+
+# ---------------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------------
+
+def plan(stage, hashes, forced):
+    """("run" | "skip" | "restore", key, inputs, run): what to do for ``stage``."""
+    declared_outputs = set(expand(stage.outputs))
+    inputs = hashes.digests([p for p in expand(stage.inputs) if p not in declared_outputs])
+    key = stage_key(stage, inputs)
+    if forced:
+        return "run", key, inputs, None
+    run = next((r for r in reversed(load_manifest(stage.name)["runs"]) if r["key"] == key), None)
+    if run is None:
+        return "run", key, inputs, None
+    current = {rel: hashes.digest(rel) for rel in run["outputs"] if (ROOT / rel).exists()}
+    if current == run["outputs"] and declared_outputs == set(run["outputs"]):
+        return "skip", key, inputs, run
+    if all(object_path(d).exists() for d in run["outputs"].values()):
+        return "restore", key, inputs, run
+    return "run", key, inputs, None
+
+
+def undeclared_outputs(stage, run):
+    """Files matching ``stage``'s output patterns that ``run`` didn't write."""
+    return [rel for rel in expand(stage.outputs) if rel not in run["outputs"]]
+
+
+def run_stage(stage, key, inputs, hashes):
+    started = time.time()
+    for command in stage.commands:
+        print(f"  $ python {' '.join(command)}", flush=True)
+        result = subprocess.run([sys.executable, *command], cwd=ROOT)
+        if result.returncode != 0:
+            sys.exit(f"  {stage.name} failed (exit {result.returncode}); nothing recorded")
+    outputs = hashes.digests(expand(stage.outputs))
+    for rel, digest in outputs.items():
+        store(rel, digest)
+    manifest = load_manifest(stage.name)
+    runs = [r for r in manifest["runs"] if r["key"] != key]
+    runs.append({"key": key, "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                 "seconds": round(time.time() - started, 1),
+                 "inputs": inputs, "outputs": outputs})
+    manifest["runs"] = runs[-KEEP_RUNS:]
+    save_manifest(stage.name, manifest)
+    return outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the out-of-date data pipeline stages.")
+    parser.add_argument("--since", choices=STAGE_NAMES,
+                        help="rerun this stage and every later one, cached or not; "
+                             "earlier stages are left as they are")
+    parser.add_argument("--until", choices=STAGE_NAMES, help="stop after this stage")
+    parser.add_argument("-n", "--dry-run", action="store_true",
+                        help="show what would run without running it")
+    args = parser.parse_args()
+
+    first = STAGE_NAMES.index(args.since) if args.since else 0
+    last = STAGE_NAMES.index(args.until) if args.until else len(STAGES) - 1
+    hashes = HashCache()
+    pending = {}   # output path or pattern -> stage a dry run would have run
+    ran = False
+
+    try:
+        for stage in STAGES[:first]:
+            print(f"[{stage.name}] left alone (--since {args.since})")
+        for stage in STAGES[first:last + 1]:
+            outputs = set(stage.outputs) | set(expand(stage.outputs))
+            upstream = {pending[p] for p in set(stage.inputs) | set(expand(stage.inputs))
+                        if p in pending}
+            if args.dry_run and upstream:
+                print(f"[{stage.name}] depends on {', '.join(sorted(upstream))}: "
+                      f"runs if its outputs change")
+                pending.update(dict.fromkeys(outputs, stage.name))
+                continue
+            action, key, inputs, run = plan(stage, hashes, forced=args.since is not None)
+            if action == "skip":
+                print(f"[{stage.name}] up to date ({len(inputs)} inputs)")
+            elif action == "restore":
+                changed = [rel for rel, d in run["outputs"].items()
+                           if not (ROOT / rel).exists() or hashes.digest(rel) != d]
+                extra = undeclared_outputs(stage, run)
+                removed = f", removing {len(extra)} it didn't write" if extra else ""
+                if args.dry_run:
+                    print(f"[{stage.name}] would restore {len(changed)} output(s) "
+                          f"from {run['time']}{removed}")
+                    continue
+                for rel in extra:
+                    (ROOT / rel).unlink()
+                for rel in changed:
+                    restore(rel, run["outputs"][rel])
+                print(f"[{stage.name}] restored {len(changed)} output(s) "
+                      f"from the run at {run['time']}{removed}")
+            elif args.dry_run:
+                print(f"[{stage.name}] would run")
+                pending.update(dict.fromkeys(outputs, stage.name))
+            else:
+                print(f"[{stage.name}] running")
+                run_stage(stage, key, inputs, hashes)
+                ran = True
+    finally:
+        hashes.save()
+    if ran:
+        collect_garbage()
+
+
+if __name__ == "__main__":
+    main()
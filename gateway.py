@@ -0,0 +1,569 @@
+#!/usr/bin/env python3
+"""
+gateway — Shared request queue in front of the model server(s).
+
+Several designers running rhino_coder.py against one mlx_lm.server collide:
+the server works on one request at a time and whoever connects last waits
+behind everyone else's retries. The gateway speaks the same OpenAI-compatible
+API and sits in between:
+
+  - requests wait in one queue per user and are dispatched round-robin
+    across users, so one user's batch run can't starve the others
+  - identical requests in flight at the same moment (same messages and
+    sampling parameters) are coalesced into one upstream generation whose
+    output goes to every caller
+  - at most --concurrency requests are sent upstream at once; with several
+    --backend URLs they are spread by ModelRouter (coder/model_http.py)
+  - GET /metrics reports queue depth, in-flight requests and wait times in
+    the Prometheus text format
+
+Usage:
+    python gateway.py --backend http://localhost:8080 --port 8000
+    python rhino_coder.py --model-url localhost:8000
+
+    python gateway.py --fake     # canned replies, no model server needed
+
+Users are told apart by the OpenAI "user" field (rhino_coder sends USER_ID),
+then an X-User header, then the client address.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import sys
+import time
+from collections import deque
+
+from coder import percentile
+from coder.model_http import PROBE_TIMEOUT, ModelRouter, completion_url, list_models
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+
+GATEWAY_HOST = "127.0.0.1"
+GATEWAY_PORT = 8000
+BACKEND_URLS = ["http://localhost:8080/v1/chat/completions"]   # ./serve.sh, as in rhino_coder
+UPSTREAM_CONCURRENCY = 1     # requests sent to the model server(s) at once
+MAX_QUEUED_PER_USER = 32     # further requests from that user get HTTP 429
+COALESCE = True              # share one generation between identical requests
+REQUEST_TIMEOUT = 30         # seconds to receive a client's request
+METRICS_WINDOW = 1000        # recent requests used for the wait-time quantiles
+
+FAKE_TOKEN_DELAY = 0.02      # --fake: seconds per streamed token
+FAKE_PREFILL_DELAY = 0.2     # --fake: seconds before the first token
+FAKE_MODEL = "training/models/rhino-coder-fused"   # rhino_coder's MODEL_NAME, so its check passes
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           429: "Too Many Requests", 502: "Bad Gateway"}
+
+# ---------------------------------------------------------------------------
+# Jobs and the fair queue
+# ---------------------------------------------------------------------------
+
+class Job:
+    """One upstream generation, shared by every request coalesced into it.
+
+    The upstream body is kept as a list of raw chunks; each subscriber
+    replays it from the start, so a caller that joins late still gets the
+    whole response.
+    """
+
+    def __init__(self, key: str, payload: dict, user: str):
+        self.key = key
+        self.payload = payload
+        self.user = user
+        self.enqueued = time.perf_counter()
+        self.started: float | None = None
+        self.status: int | None = None
+        self.content_type = "application/json"
+        self.chunks: list[bytes] = []
+        self.done = False
+        self.subscribers = 0
+        self.task: asyncio.Task | None = None
+        self.changed = asyncio.Condition()
+
+    @property
+    def abandoned(self) -> bool:
+        return self.subscribers == 0
+
+    async def _update(self, **attrs):
+        async with self.changed:
+            for name, value in attrs.items():
+                setattr(self, name, value)
+            self.changed.notify_all()
+
+    async def set_head(self, status: int, content_type: str):
+        await self._update(status=status, content_type=content_type)
+
+    async def add(self, chunk: bytes):
+        async with self.changed:
+            self.chunks.append(chunk)
+            self.changed.notify_all()
+
+    async def fail(self, status: int, message: str):
+        body = json.dumps({"error": {"message": message, "type": "gateway_error"}})
+        await self._update(status=status, content_type="application/json",
+                           chunks=[body.encode("utf-8")], done=True)
+
+    async def finish(self):
+        await self._update(done=True)
+
+    async def head(self) -> tuple[int, str]:
+        async with self.changed:
+            await self.changed.wait_for(lambda: self.status is not None or self.done)
+        return self.status or 502, self.content_type
+
+    async def body(self):
+        """Yield the response body from the start, waiting for new chunks."""
+        sent = 0
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(lambda: len(self.chunks) > sent or self.done)
+                chunks = self.chunks[sent:]
+                done = self.done
+            for chunk in chunks:
+                yield chunk
+            sent += len(chunks)
+            if done and sent == len(self.chunks):
+                return
+
+
+class FairQueue:
+    """Per-user FIFO queues served round-robin."""
+
+    def __init__(self):
+        self.queues: dict[str, deque[Job]] = {}
+        self.turns: deque[str] = deque()  # users with waiting jobs, next first
+        self.ready = asyncio.Condition()
+
+    def __len__(self) -> int:
+        return sum(len(q) for q in self.queues.values())
+
+    def depth(self, user: str) -> int:
+        return len(self.queues.get(user, ()))
+
+    async def put(self, job: Job):
+        async with self.ready:
+            if job.user not in self.queues:
+                self.queues[job.user] = deque()
+                self.turns.append(job.user)
+            self.queues[job.user].append(job)
+            self.ready.notify()
+
+    async def get(self) -> Job:
+        """Next job from the user whose turn it is; that user goes to the back."""
+        async with self.ready:
+            await self.ready.wait_for(lambda: bool(self.turns))
+            user = self.turns.popleft()
+            queue = self.queues[user]
+            job = queue.popleft()
+            if queue:
+                self.turns.append(user)
+            else:
+                del self.queues[user]
+            return job
+
+    def remove(self, job: Job) -> bool:
+        """Take a job that is still waiting out of its queue; False if it isn't there."""
+        queue = self.queues.get(job.user)
+        if queue is None or job not in queue:
+            return False
+        queue.remove(job)
+        if not queue:
+            del self.queues[job.user]
+            self.turns.remove(job.user)
+        return True
+
+# ---------------------------------------------------------------------------
+# Metrics
+# ---------------------------------------------------------------------------
+
+class Metrics:
+    """Counters and recent latencies, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.requests: dict[str, int] = {}
+        self.coalesced = 0
+        self.rejected = 0
+        self.errors = 0
+        self.in_flight = 0
+        # name -> (recent values, running sum, count)
+        self.summaries: dict[str, tuple[deque[float], float, int]] = {}
+
+    def observe(self, name: str, seconds: float):
+        recent, total, count = self.summaries.get(name) or (deque(maxlen=METRICS_WINDOW), 0.0, 0)
+        recent.append(seconds)
+        self.summaries[name] = (recent, total + seconds, count + 1)
+
+    def render(self, queue: FairQueue) -> str:
+        lines = [
+            "# HELP gateway_queue_depth Requests waiting for an upstream slot.",
+            "# TYPE gateway_queue_depth gauge",
+            f"gateway_queue_depth {len(queue)}",
+        ]
+        lines += [
+            "# HELP gateway_user_queue_depth Requests waiting, per user.",
+            "# TYPE gateway_user_queue_depth gauge",
+        ]
+        lines += [f'gateway_user_queue_depth{{user="{_label(u)}"}} {len(q)}'
+                  for u, q in sorted(queue.queues.items())]
+        lines += [
+            "# HELP gateway_in_flight Generations running upstream.",
+            "# TYPE gateway_in_flight gauge",
+            f"gateway_in_flight {self.in_flight}",
+            "# HELP gateway_requests_total Requests accepted, per user.",
+            "# TYPE gateway_requests_total counter",
+        ]
+        lines += [f'gateway_requests_total{{user="{_label(u)}"}} {n}'
+                  for u, n in sorted(self.requests.items())]
+        lines += [
+            "# HELP gateway_coalesced_total Requests served by another request's generation.",
+            "# TYPE gateway_coalesced_total counter",
+            f"gateway_coalesced_total {self.coalesced}",
+            "# HELP gateway_rejected_total Requests refused because the user's queue was full.",
+            "# TYPE gateway_rejected_total counter",
+            f"gateway_rejected_total {self.rejected}",
+            "# HELP gateway_upstream_errors_total Generations that failed upstream.",
+            "# TYPE gateway_upstream_errors_total counter",
+            f"gateway_upstream_errors_total {self.errors}",
+        ]
+        for name, help_text in (
+            ("gateway_queue_wait_seconds", "Time from arrival to upstream dispatch."),
+            ("gateway_upstream_seconds", "Time from dispatch to the end of the response."),
+        ):
+            recent, total, count = self.summaries.get(name) or ((), 0.0, 0)
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} summary"]
+            lines += [f'{name}{{quantile="{q}"}} {percentile(list(recent), q):.4f}'
+                      for q in (0.5, 0.95, 0.99)]
+            lines += [f"{name}_sum {total:.4f}", f"{name}_count {count}"]
+        return "\n".join(lines) + "\n"
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+# ---------------------------------------------------------------------------
+# Fake backend (--fake)
+# ---------------------------------------------------------------------------
+
+class FakeResponse:
+    """Looks enough like coder.model_http.HTTPResponse for the gateway to relay."""
+
+    def __init__(self, payload: dict, lock: asyncio.Lock):
+        self.status = 200
+        self.payload = payload
+        self.lock = lock
+        stream = payload.get("stream")
+        self.headers = {"content-type": "text/event-stream" if stream else "application/json"}
+        self.url = "fake"
+
+    def reply(self) -> str:
+        prompt = self.payload["messages"][-1]["content"].splitlines()[0][:60]
+        return ("```python\nimport rhinoscriptsyntax as rs\n"
+                f"# {prompt}\nrs.AddSphere([0, 0, 0], 5)\n```")
+
+    async def iter_chunks(self):
+        # mlx_lm.server generates one sequence at a time, so the fake does too.
+        async with self.lock:
+            await asyncio.sleep(FAKE_PREFILL_DELAY)
+            tokens = self.reply().split(" ")
+            tokens = [t + " " for t in tokens[:-1]] + tokens[-1:]
+            max_tokens = self.payload.get("max_tokens") or len(tokens)
+            tokens = tokens[:max_tokens]
+            if not self.payload.get("stream"):
+                await asyncio.sleep(FAKE_TOKEN_DELAY * len(tokens))
+                yield json.dumps({
+                    "object": "chat.completion", "model": self.payload.get("model"),
+                    "choices": [{"index": i, "message": {"role": "assistant", "content": "".join(tokens)},
+                                 "finish_reason": "stop"} for i in range(self.payload.get("n") or 1)],
+                    "usage": {"prompt_tokens": sum(len(m["content"]) // 4 for m in self.payload["messages"]),
+                              "completion_tokens": len(tokens)},
+                }).encode("utf-8")
+                return
+            for token in tokens:
+                await asyncio.sleep(FAKE_TOKEN_DELAY)
+                event = {"object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": {"content": token}}]}
+                yield f"data: {json.dumps(event)}\n\n".encode("utf-8")
+            yield b"data: [DONE]\n\n"
+
+    def close(self):
+        pass
+
+
+class FakeBackend:
+    """Stands in for the model router: canned code replies with realistic pacing."""
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+
+    async def post(self, payload: dict) -> FakeResponse:
+        return FakeResponse(payload, self.lock)
+
+    async def models(self) -> list[str]:
+        return [FAKE_MODEL]
+
+# ---------------------------------------------------------------------------
+# Gateway
+# ---------------------------------------------------------------------------
+
+class Gateway:
+    """Accepts OpenAI-style requests and feeds them upstream fairly."""
+
+    def __init__(self, upstream, concurrency: int = UPSTREAM_CONCURRENCY,
+                 coalesce: bool = COALESCE):
+        self.upstream = upstream
+        self.concurrency = concurrency
+        self.coalesce = coalesce
+        self.queue = FairQueue()
+        self.pending: dict[str, Job] = {}  # queued or running jobs, by request key
+        self.metrics = Metrics()
+        self.workers: list[asyncio.Task] = []
+
+    def start(self):
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    # --- upstream side ---
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            if job.abandoned:
+                self.pending.pop(job.key, None)
+                continue
+            job.started = time.perf_counter()
+            self.metrics.observe("gateway_queue_wait_seconds", job.started - job.enqueued)
+            self.metrics.in_flight += 1
+            # A separate task, so that the last caller hanging up can cancel
+            # the generation without cancelling the worker.
+            job.task = asyncio.create_task(self._run(job))
+            try:
+                await asyncio.wait({job.task})
+            finally:
+                job.task = None
+                self.metrics.in_flight -= 1
+                self.metrics.observe("gateway_upstream_seconds", time.perf_counter() - job.started)
+                if self.pending.get(job.key) is job:
+                    del self.pending[job.key]
+                await job.finish()
+
+    async def _run(self, job: Job):
+        try:
+            resp = await self.upstream.post(job.payload)
+        except ConnectionError as e:
+            self.metrics.errors += 1
+            await job.fail(502, str(e))
+            return
+        try:
+            await job.set_head(resp.status, resp.headers.get("content-type", "application/json"))
+            async for chunk in resp.iter_chunks():
+                await job.add(chunk)
+        except (OSError, asyncio.TimeoutError):
+            # The caller sees a truncated body, as it would talking to the server.
+            self.metrics.errors += 1
+        finally:
+            resp.close()
+
+    async def submit(self, payload: dict, user: str) -> Job | None:
+        """Queue a request, or join an identical one; None if the user's queue is full."""
+        request = {k: v for k, v in payload.items() if k != "user"}
+        key = hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+        self.metrics.requests[user] = self.metrics.requests.get(user, 0) + 1
+        job = self.pending.get(key) if self.coalesce else None
+        if job is not None:
+            self.metrics.coalesced += 1
+        elif self.queue.depth(user) >= MAX_QUEUED_PER_USER:
+            self.metrics.rejected += 1
+            return None
+        else:
+            job = Job(key, payload, user)
+            if self.coalesce:
+                self.pending[key] = job
+            await self.queue.put(job)
+        job.subscribers += 1
+        return job
+
+    def unsubscribe(self, job: Job):
+        job.subscribers -= 1
+        if job.abandoned:
+            if self.pending.get(job.key) is job:
+                del self.pending[job.key]
+            if job.task is not None:
+                job.task.cancel()
+            else:
+                # Still queued: free the slot it holds under MAX_QUEUED_PER_USER.
+                self.queue.remove(job)
+
+    # --- client side ---
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                method, path, headers, body = await asyncio.wait_for(
+                    read_request(reader), REQUEST_TIMEOUT)
+            except (ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                await send(writer, 400, error_body("Malformed request"))
+                return
+            path = path.split("?", 1)[0]
+            if path == "/metrics" and method == "GET":
+                await send(writer, 200, self.metrics.render(self.queue).encode("utf-8"),
+                           "text/plain; version=0.0.4")
+            elif path == "/v1/models" and method == "GET":
+                await self.handle_models(writer)
+            elif path == "/v1/chat/completions" and method == "POST":
+                await self.handle_completion(reader, writer, headers, body)
+            elif path in ("/metrics", "/v1/models", "/v1/chat/completions"):
+                await send(writer, 405, error_body(f"{method} not allowed on {path}"))
+            else:
+                await send(writer, 404, error_body(f"No route for {path}"))
+        except (ConnectionError, OSError):
+            pass  # client went away
+        finally:
+            writer.close()
+
+    async def handle_models(self, writer: asyncio.StreamWriter):
+        try:
+            if isinstance(self.upstream, FakeBackend):
+                ids = await self.upstream.models()
+            else:
+                backend = self.upstream.candidates()[0]
+                ids = await list_models(backend.url, PROBE_TIMEOUT)
+        except (ConnectionError, OSError, ValueError) as e:
+            await send(writer, 502, error_body(str(e)))
+            return
+        body = {"object": "list", "data": [{"id": i, "object": "model"} for i in ids]}
+        await send(writer, 200, json.dumps(body).encode("utf-8"))
+
+    async def handle_completion(self, reader: asyncio.StreamReader,
+                                writer: asyncio.StreamWriter, headers: dict, body: bytes):
+        try:
+            payload = json.loads(body)
+            if not isinstance(payload.get("messages"), list):
+                raise ValueError("'messages' must be a list")
+        except ValueError as e:
+            await send(writer, 400, error_body(f"Invalid request body: {e}"))
+            return
+        peer = writer.get_extra_info("peername")
+        user = str(payload.get("user") or headers.get("x-user")
+                   or (peer[0] if peer else "unknown"))
+
+        job = await self.submit(payload, user)
+        if job is None:
+            await send(writer, 429, error_body(
+                f"{user} already has {MAX_QUEUED_PER_USER} requests queued"))
+            return
+        # Clients send nothing after the body; EOF means they hung up (Ctrl-C
+        # in rhino_coder), even while the request is still queued.
+        hangup = asyncio.ensure_future(reader.read(1))
+        relay = asyncio.ensure_future(self.relay(job, writer))
+        try:
+            await asyncio.wait({hangup, relay}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (hangup, relay):
+                task.cancel()
+            self.unsubscribe(job)
+        if relay.done() and not relay.cancelled() and relay.exception() is not None:
+            raise relay.exception()
+
+    async def relay(self, job: Job, writer: asyncio.StreamWriter):
+        status, content_type = await job.head()
+        streaming = content_type.startswith("text/event-stream")
+        if not streaming:
+            body = b"".join([chunk async for chunk in job.body()])
+            await send(writer, status, body, content_type)
+            return
+        # No Content-Length: the body ends when the connection closes.
+        writer.write(status_line(status, content_type) + b"Cache-Control: no-cache\r\n\r\n")
+        async for chunk in job.body():
+            writer.write(chunk)
+            await writer.drain()
+
+# ---------------------------------------------------------------------------
+# Minimal HTTP/1.1 server side
+# ---------------------------------------------------------------------------
+
+async def read_request(reader: asyncio.StreamReader) -> tuple[str, str, dict, bytes]:
+    request_line = await reader.readline()
+    parts = request_line.decode("latin-1").split()
+    if len(parts) != 3:
+        raise ValueError("bad request line")
+    method, path, _ = parts
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        key, _, value = line.decode("latin-1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+    length = int(headers.get("content-length") or 0)
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), path, headers, body
+
+
+def status_line(status: int, content_type: str) -> bytes:
+    return (f"HTTP/1.1 {status} {REASONS.get(status, 'Error')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Connection: close\r\n").encode("ascii")
+
+
+async def send(writer: asyncio.StreamWriter, status: int, body: bytes,
+               content_type: str = "application/json"):
+    writer.write(status_line(status, content_type)
+                 + f"Content-Length: {len(body)}\r\n\r\n".encode("ascii") + body)
+    await writer.drain()
+
+
+def error_body(message: str) -> bytes:
+    return json.dumps({"error": {"message": message, "type": "gateway_error"}}).encode("utf-8")
+
+# ---------------------------------------------------------------------------
+# Main
+# ---------------------------------------------------------------------------
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Shared, fair request queue in front of mlx_lm.server.")
+    parser.add_argument("--host", default=GATEWAY_HOST,
+                        help=f"address to listen on (default {GATEWAY_HOST}; 0.0.0.0 for the LAN)")
+    parser.add_argument("--port", type=int, default=GATEWAY_PORT)
+    parser.add_argument("--backend", action="append", type=completion_url, metavar="URL",
+                        help="model server to forward to; repeat for several "
+                             "(default: BACKEND_URLS)")
+    parser.add_argument("--concurrency", type=int, default=UPSTREAM_CONCURRENCY,
+                        help=f"requests sent upstream at once (default {UPSTREAM_CONCURRENCY})")
+    parser.add_argument("--no-coalesce", action="store_true",
+                        help="send identical concurrent requests upstream separately")
+    parser.add_argument("--fake", action="store_true",
+                        help="answer with canned code instead of calling a model server")
+    args = parser.parse_args(argv)
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.fake and args.backend:
+        parser.error("--fake and --backend are mutually exclusive")
+    return args
+
+
+async def serve(args: argparse.Namespace):
+    upstream = FakeBackend() if args.fake else ModelRouter(args.backend or BACKEND_URLS)
+    gateway = Gateway(upstream, args.concurrency, coalesce=not args.no_coalesce)
+    gateway.start()
+    server = await asyncio.start_server(gateway.handle, args.host, args.port)
+    target = "fake backend" if args.fake else ", ".join(b.url for b in upstream.backends)
+    print(f"  Gateway on http://{args.host}:{args.port} -> {target}  "
+          f"({args.concurrency} upstream at a time)", file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    args = parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -11,33 +11,84 @@ Usage:
     2. Start Rhino listener:    Load server.py in Rhino 8
     3. Run this CLI:            python rhino_coder.py
 
+    Batch mode runs a JSONL file of {"prompt": ...} lines unattended and
+    writes one result record per prompt:
+        python rhino_coder.py --batch prompts.jsonl --out results.jsonl
+
+    --record cassette.jsonl captures the Rhino traffic of a session, which
+    rhino_replay.py can then serve without Rhino.
+
 Commands:
     /quit, /exit   Exit the REPL
     /clear         Clear conversation history
     /run <code>    Send Python code directly to Rhino (skip model)
     /retry         Regenerate last response
     /history       Show conversation history
+    /pool          Show Rhino connection pool and model server counters
+    /candidates N  Request N fixes concurrently on each retry (1 = off)
+    /cache [clear] Show response cache counters, or empty the cache
+    /stats [export [path]]
+                   Show timing of the last turn and the session, or write
+                   every turn's spans to a JSONL file
+    /jobs          Show turns whose retries are running in the background
+    /cancel [id]   Stop a background job (default: the newest)
+
+Press Ctrl-C while a response is generating or executing to cancel it and
+return to the prompt. When the first attempt fails, the retries continue in
+the background and the prompt comes back; their output is shown, and the turn
+added to the history, once they finish.
 """
 
+import argparse
+import ast
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import copy
 import json
+import math
+import os
 import re
 import socket
 import sys
-import urllib.request
-import urllib.error
+import threading
+import time
+from asyncio import CancelledError
+from collections import deque
+from concurrent.futures import Future
+from pathlib import Path
+
+from coder import percentile
+from coder.api_index import ApiIndex, get_api_index
+from coder.incremental import (INCREMENTAL_MARKER, INCREMENTAL_ROLLBACK, INCREMENTAL_RUNNER,
+                               split_statements, take_marker)
+from coder.model_http import (MODEL_TIMEOUT, PROBE_TIMEOUT, HTTPResponse, ModelBackend,
+                              ModelRouter, completion_url, http_request, list_models)
+from coder.prompt_budget import TokenCounter, fit_history
+from coder.response_cache import ResponseCache
+from coder.rhino_link import FRAMING_VERSION, RHINO_HOST, RHINO_PORT, RhinoConnectionPool
 
 # ---------------------------------------------------------------------------
 # Configuration
+#
+# The parts in coder/ keep their own settings, imported above: the Rhino
+# connection (rhino_link), model server timeouts and circuit breaker
+# (model_http), cache size, TTL and near-hit threshold (response_cache) and
+# the prompt budget (prompt_budget).
 # ---------------------------------------------------------------------------
 
 MODEL_URL = "http://localhost:8080/v1/chat/completions"
+# Several mlx_lm servers serving the same model (--model-url, repeatable): each
+# request goes to the one with the fewest requests in flight.
+MODEL_URLS = [MODEL_URL]
+# Sent as the OpenAI "user" field; gateway.py queues requests fairly per user
+USER_ID = f"{os.environ.get('USER') or os.environ.get('USERNAME') or 'user'}@{socket.gethostname()}"
 # Must match the model ID reported by mlx_lm.server (/v1/models)
 MODEL_NAME = "training/models/rhino-coder-fused"
-
-RHINO_HOST = "localhost"
-RHINO_PORT = 54321
-SOCKET_TIMEOUT = 30
-RECV_CHUNK_SIZE = 8192
+BACKEND = "server"   # "server" (mlx_lm.server at MODEL_URLS) or "mlx" (load MODEL_NAME in-process)
+MLX_ADAPTER_PATH: str | None = None   # LoRA adapter for the mlx backend
+CONSTRAINED_DECODING = True           # mlx backend: only allow real rs./rg. names
 
 SYSTEM_PROMPT = (
     "You are an expert Rhino3D Python programmer. "
@@ -48,98 +99,503 @@ SYSTEM_PROMPT = (
 MAX_TOKENS = 2048
 TEMPERATURE = 0.1
 MAX_RETRIES = 3  # auto-retry limit on execution errors
+STREAM = True    # stream tokens over SSE and start executing at the first closing fence
+NUM_CANDIDATES = 1              # fixes requested concurrently per retry (1 = sequential)
+CANDIDATE_MAX_TEMPERATURE = 0.9
+CANDIDATES_USE_N_PARAM = False  # one request with "n" instead of N parallel requests
+MODEL_CONCURRENCY = 4           # model requests in flight at once (candidates, --batch)
+
+CACHE_ENABLED = True
+CACHE_PATH = Path.home() / ".cache" / "rhino_coder" / "responses.json"
+
+# tokenizer.json of the served model; without it tokens are estimated at ~4 chars each
+TOKENIZER_PATH = Path(__file__).resolve().parent / MODEL_NAME / "tokenizer.json"
+
+STATS_MAX_TURNS = 500    # finished turn traces kept in memory for /stats
+STATS_PATH: Path | None = None   # append every finished turn here as JSONL (--stats-out)
+RECORD_PATH: Path | None = None  # append every Rhino command and reply here as JSONL (--record)
+
+# Pre-flight check: generated code is parsed and its rs./rg. names looked up in
+# an index of the docs parse_docs.py reads, before anything is sent to Rhino.
+PREFLIGHT = True
+
+# Retries delete the objects a failed attempt added before running the fix,
+# and skip statements before the failure point when the fix left them unchanged.
+INCREMENTAL_RETRY = True
+
+# Add a summary of the Rhino document to prompts that refer to its state
+DOC_CONTEXT = True
+DOC_SNAPSHOT_TTL = 60    # seconds before a cached summary is re-fetched when needed
+DOC_MAX_LAYERS = 20      # layers listed in the summary
+DOC_MAX_OBJECTS = 2000   # objects the snapshot script looks at; the rest are only counted
+
+# After a failed first attempt, the REPL hands the retries to a background job
+# and takes the next prompt (see /jobs and /cancel).
+BACKGROUND_RETRIES = True
+
+# At REPL start, check both backends and send a one-token warm-up request so the
+# first real prompt doesn't pay model load and kernel compilation.
+STARTUP_PROBES = True
+# The /v1/models and Rhino checks wait PROBE_TIMEOUT, the warm-up MODEL_TIMEOUT.
+
+# ---------------------------------------------------------------------------
+# Turn tracing
+#
+# Each turn (a REPL prompt or a batch item) gets a TurnTrace in a context
+# variable, so the model and Rhino calls deep inside it can add timing spans
+# without passing it around; tasks spawned during the turn inherit it.
+# Spans are plain dicts stamped with time.perf_counter().
+# ---------------------------------------------------------------------------
+
+class TurnTrace:
+    """Timing spans for one turn: model calls, code extraction, Rhino round-trips."""
+
+    def __init__(self, prompt: str):
+        self.prompt = prompt
+        self.started = time.time()
+        self.t0 = time.perf_counter()
+        self.attempt = 1
+        self.spans: list[dict] = []
+        self.total_s: float | None = None
+        self.outcome: dict = {}
+
+    def add(self, name: str, start: float, **attrs):
+        """Record a span that began at perf_counter() value ``start`` and ends now."""
+        self.spans.append({"name": name, "attempt": self.attempt,
+                           "at_s": round(start - self.t0, 4),
+                           "duration_s": round(time.perf_counter() - start, 4), **attrs})
+
+    def finish(self, outcome: dict):
+        self.total_s = round(time.perf_counter() - self.t0, 4)
+        self.outcome = {k: outcome[k] for k in ("ok", "attempts", "cached", "error")
+                        if k in outcome}
+
+    def summary(self) -> dict:
+        """Per-turn totals: first-token latency, decode rate and time per stage."""
+        generate = [s for s in self.spans if s["name"] == "generate"]
+        rhino = [s for s in self.spans if s["name"] == "rhino"]
+        tokens = sum(s.get("tokens") or s.get("completion_tokens") or 0 for s in generate)
+        streamed = [s for s in generate if "decode_s" in s]
+        decoded = sum(s["tokens"] - 1 for s in streamed)  # the first token is prefill
+        decode_s = sum(s["decode_s"] for s in streamed)
+        ttft = next((s["ttft_s"] for s in generate if "ttft_s" in s), None)
+        return {
+            "total_s": self.total_s,
+            "ttft_s": ttft,
+            "model_s": round(sum(s["duration_s"] for s in generate), 4),
+            "decode_tok_s": round(decoded / decode_s, 1) if decode_s else None,
+            "tokens": tokens,
+            "extract_s": round(sum(s["duration_s"] for s in self.spans if s["name"] == "extract"), 4),
+            "rhino_s": round(sum(s["duration_s"] for s in rhino), 4),
+            "rhino_calls": len(rhino),
+            "retries": self.attempt - 1,
+        }
+
+    def to_dict(self) -> dict:
+        return {"started": round(self.started, 3), "prompt": self.prompt, **self.outcome,
+                **self.summary(), "spans": self.spans}
+
+
+current_trace: contextvars.ContextVar[TurnTrace | None] = contextvars.ContextVar(
+    "current_trace", default=None)
+turn_traces: deque[TurnTrace] = deque(maxlen=STATS_MAX_TURNS)
+
+
+def record_span(name: str, start: float, **attrs):
+    """Add a span to the current turn's trace, if a turn is being traced."""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add(name, start, **attrs)
+
+
+def save_trace(trace: TurnTrace):
+    turn_traces.append(trace)
+    if STATS_PATH is not None:
+        with open(STATS_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(trace.to_dict(), ensure_ascii=False) + "\n")
 
 # ---------------------------------------------------------------------------
-# Rhino TCP communication (same protocol as rhino-mcp/tools/utils.py)
+# Rhino TCP communication (connections and framing: coder/rhino_link.py)
 # ---------------------------------------------------------------------------
 
-def send_to_rhino(command_type: str, params: dict | None = None) -> dict:
+rhino_pool = RhinoConnectionPool(RHINO_HOST, RHINO_PORT)
+# Rhino runs one script at a time on its UI thread; commands wait here in FIFO
+# order instead of piling up on the listener.
+rhino_queue = asyncio.Lock()
+
+
+async def send_to_rhino(command_type: str, params: dict | None = None) -> dict:
     """Send a JSON command to Rhino's TCP socket and return the response."""
     if params is None:
         params = {}
 
     command = {"type": command_type, "params": params}
+    start = time.perf_counter()
+    queue_s = 0.0
 
     try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(SOCKET_TIMEOUT)
-        sock.connect((RHINO_HOST, RHINO_PORT))
-        sock.sendall(json.dumps(command).encode("utf-8"))
-
-        chunks = []
-        while True:
-            chunk = sock.recv(RECV_CHUNK_SIZE)
-            if not chunk:
-                break
-            chunks.append(chunk)
-            try:
-                data = b"".join(chunks)
-                response = json.loads(data.decode("utf-8"))
-                break
-            except (json.JSONDecodeError, UnicodeDecodeError):
-                continue
-
-        sock.close()
-
-        if not chunks:
-            raise ConnectionError("Empty response from Rhino")
-
-        data = b"".join(chunks)
-        response = json.loads(data.decode("utf-8"))
+        async with rhino_queue:
+            queue_s = time.perf_counter() - start
+            response = await rhino_pool.request(command)
+        if RECORD_PATH is not None:
+            record_exchange(command, response, time.perf_counter() - start - queue_s)
 
         if response.get("status") == "error":
-            return {"ok": False, "error": response.get("message", "Unknown error")}
-
-        return {"ok": True, "result": response.get("result", {})}
+            result = {"ok": False, "error": response.get("message", "Unknown error")}
+        else:
+            result = {"ok": True, "result": response.get("result", {})}
 
     except ConnectionRefusedError:
-        return {"ok": False, "error": "Cannot connect to Rhino. Is the listener running?"}
-    except socket.timeout:
-        return {"ok": False, "error": "Rhino connection timed out."}
+        result = {"ok": False, "error": "Cannot connect to Rhino. Is the listener running?",
+                  "unreachable": True}
+    except asyncio.TimeoutError:
+        result = {"ok": False, "error": "Rhino connection timed out."}
     except Exception as e:
-        return {"ok": False, "error": str(e)}
+        result = {"ok": False, "error": str(e)}
 
+    record_span("rhino", start, command=command_type, queue_s=round(queue_s, 4), ok=result["ok"])
+    return result
 
-def execute_in_rhino(code: str) -> dict:
+
+def record_exchange(command: dict, response: dict, latency: float):
+    """Append one command and the listener's reply to the RECORD_PATH cassette."""
+    entry = {"time": round(time.time(), 3), **command,
+             "response": response, "latency_s": round(latency, 4)}
+    with open(RECORD_PATH, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+async def execute_in_rhino(code: str) -> dict:
     """Execute Python code in Rhino via the TCP socket."""
-    return send_to_rhino("execute_python_code", {"code": code})
+    doc_snapshot.stale = True
+    return await send_to_rhino("execute_python_code", {"code": code})
 
 # ---------------------------------------------------------------------------
-# Model API (OpenAI-compatible, served by mlx_lm.server)
+# Incremental re-execution
+#
+# Within a turn, generated scripts run inside the runner in
+# coder/incremental.py, so a retry deletes what the failed attempt added and
+# can resume after the statements it left unchanged. A turn that gives up or
+# is cancelled deletes whatever its last attempt left behind.
 # ---------------------------------------------------------------------------
 
-def chat_completion(messages: list[dict], temperature: float | None = None) -> str:
-    """Call the local model's chat completion endpoint."""
-    payload = json.dumps({
+# Per-turn state: the sticky key, and whether Rhino holds a failed attempt for it
+incremental_state: contextvars.ContextVar[dict | None] = contextvars.ContextVar(
+    "incremental_state", default=None)
+
+
+async def execute_generated(code: str) -> dict:
+    """Execute model-written code, incrementally when inside a turn."""
+    state = incremental_state.get()
+    stmts = split_statements(code)
+    if stmts is None:
+        return await execute_in_rhino(code)
+    incremental = INCREMENTAL_RETRY and state is not None
+    if incremental:
+        runner = INCREMENTAL_RUNNER.replace("MARKER", repr(INCREMENTAL_MARKER))
+        script = f"{runner}\n_rc_run({state['key']!r}, {stmts!r})\n"
+        # Until the reply says otherwise, Rhino may hold a partial attempt.
+        state["pending"] = True
+    else:
+        script = code + "\n"
+    result = await send_to_rhino("execute_python_code", {"code": script})
+    doc_snapshot.stale = True
+    info = take_marker(result, INCREMENTAL_MARKER)
+    if info is not None:
+        result["resumed_at"], result["rolled_back"] = map(int, info.split())
+    if incremental:
+        state["pending"] = not result["ok"] and not result.get("unreachable")
+    return result
+
+
+async def discard_failed_attempt() -> int:
+    """Delete the objects left by the turn's last failed attempt; returns the count."""
+    state = incremental_state.get()
+    if state is None or not state["pending"]:
+        return 0
+    script = (INCREMENTAL_ROLLBACK.replace("MARKER", repr(INCREMENTAL_MARKER))
+              .replace("KEY", repr(state["key"])))
+    result = await send_to_rhino("execute_python_code", {"code": script})
+    state["pending"] = False
+    doc_snapshot.stale = True
+    info = take_marker(result, INCREMENTAL_MARKER)
+    return int(info.split()[1]) if info else 0
+
+# ---------------------------------------------------------------------------
+# Document snapshot
+#
+# A compact summary of the active document (object counts by type, layers,
+# selection, extents) that is added to a prompt only when the request or the
+# error refers to document state ("the selected curves", "no curve
+# selected"). It is fetched only then, and only if a run since the last
+# fetch may have changed the document or the summary is old, so running
+# generated code never pays for it. The script looks at no more than
+# DOC_MAX_OBJECTS objects and lists no more than DOC_MAX_LAYERS layers, so
+# its cost on Rhino's UI thread doesn't grow with the document.
+# ---------------------------------------------------------------------------
+
+DOC_MARKER = "#rhino_coder-doc"
+
+# Runs inside Rhino; prints one JSON line, or nothing if the document can't be read.
+DOC_SNAPSHOT_SCRIPT = """
+def _rc_snapshot():
+    import json
+    import Rhino
+    doc = Rhino.RhinoDoc.ActiveDoc
+    types, layers, selected = {}, {}, {}
+    extents = Rhino.Geometry.BoundingBox.Empty
+    chosen = Rhino.Geometry.BoundingBox.Empty
+    scanned = 0
+    for obj in doc.Objects:
+        if scanned >= MAX_OBJECTS:
+            break
+        scanned += 1
+        kind = str(obj.ObjectType)
+        box = obj.Geometry.GetBoundingBox(True)
+        types[kind] = types.get(kind, 0) + 1
+        layers[obj.Attributes.LayerIndex] = layers.get(obj.Attributes.LayerIndex, 0) + 1
+        extents.Union(box)
+        if obj.IsSelected(False):
+            selected[kind] = selected.get(kind, 0) + 1
+            chosen.Union(box)
+    def corners(b):
+        if not b.IsValid:
+            return None
+        return [[round(c, 3) for c in (p.X, p.Y, p.Z)] for p in (b.Min, b.Max)]
+    all_layers = [l for l in doc.Layers if not l.IsDeleted]
+    print(MARKER + " " + json.dumps({
+        "units": str(doc.ModelUnitSystem),
+        "total": doc.Objects.Count,
+        "scanned": scanned,
+        "types": types,
+        "selected": selected,
+        "extents": corners(extents),
+        "selection_extents": corners(chosen),
+        "current_layer": doc.Layers.CurrentLayer.FullPath,
+        "layers": [[l.FullPath, layers.get(l.Index, 0), l.IsVisible, l.IsLocked]
+                   for l in all_layers[:MAX_LAYERS]],
+        "layer_count": len(all_layers),
+    }))
+try:
+    _rc_snapshot()
+except Exception:
+    pass  # never turn a successful script into a failure
+"""
+
+
+def snapshot_script() -> str:
+    return (DOC_SNAPSHOT_SCRIPT.replace("MARKER", repr(DOC_MARKER))
+            .replace("MAX_OBJECTS", str(DOC_MAX_OBJECTS))
+            .replace("MAX_LAYERS", str(DOC_MAX_LAYERS)))
+
+
+DOC_RELEVANT = re.compile(
+    r"\b(select(ed|ion)?|layers?|existing|current|document|scene|these|those|them|"
+    r"all (the )?objects?|the (curves?|surfaces?|breps?|meshes|mesh|points?|objects?|lines?|"
+    r"polylines?|polysurfaces?|solids?|blocks?|geometry))\b", re.IGNORECASE)
+DOC_ERROR = re.compile(r"select|layer|NoneType|not found|no (objects?|curves?|surfaces?)",
+                       re.IGNORECASE)
+
+
+class DocSnapshot:
+    """Cached document summary, rendered as a few lines of prompt context."""
+
+    def __init__(self):
+        self.data: dict | None = None
+        self.fetched = 0.0
+        self.stale = True
+
+    def update(self, line: str | None):
+        """Take a summary printed by snapshot_script(); None marks the cache stale."""
+        try:
+            self.data = json.loads(line) if line is not None else self.data
+        except ValueError:
+            line = None
+        self.stale = line is None
+        if line is not None:
+            self.fetched = time.monotonic()
+
+    async def get(self) -> dict | None:
+        """The summary, fetched first if stale or older than DOC_SNAPSHOT_TTL."""
+        if self.stale or time.monotonic() - self.fetched > DOC_SNAPSHOT_TTL:
+            result = await send_to_rhino("execute_python_code", {"code": snapshot_script()})
+            self.update(take_marker(result, DOC_MARKER) if result["ok"] else None)
+        return self.data
+
+    def render(self) -> str | None:
+        d = self.data
+        if d is None:
+            return None
+
+        def counts(by_type: dict) -> str:
+            total = sum(by_type.values())
+            parts = ", ".join(f"{k} {v}" for k, v in sorted(by_type.items(), key=lambda kv: -kv[1]))
+            return f"{total} ({parts})" if total else "none"
+
+        def box(corners) -> str:
+            return f"{corners[0]} to {corners[1]}" if corners else "empty"
+
+        layers = []
+        for path, count, visible, locked in d["layers"][:DOC_MAX_LAYERS]:
+            flags = [f for f, on in (("current", path == d["current_layer"]),
+                                     ("hidden", not visible), ("locked", locked)) if on]
+            layers.append(f"{path} ({', '.join(flags + [str(count)])})")
+        layer_count = d.get("layer_count", len(d["layers"]))
+        if layer_count > len(layers):
+            layers.append(f"... {layer_count - len(layers)} more")
+        objects = counts(d["types"])
+        if d.get("total", 0) > d.get("scanned", 0):
+            objects = f"{d['total']}, of which the first {d['scanned']}: {objects}"
+        lines = [f"Current Rhino document ({d['units']}):",
+                 f"- objects: {objects}, extents {box(d['extents'])}",
+                 f"- selected: {counts(d['selected'])}"
+                 + (f", extents {box(d['selection_extents'])}" if d["selected"] else ""),
+                 f"- layers: {'; '.join(layers)}"]
+        return "\n".join(lines)
+
+
+doc_snapshot = DocSnapshot()
+
+
+async def document_context(text: str, pattern: re.Pattern = DOC_RELEVANT) -> str | None:
+    """Rendered snapshot if ``text`` refers to document state, else None."""
+    if not DOC_CONTEXT or not pattern.search(text):
+        return None
+    start = time.perf_counter()
+    cached = not doc_snapshot.stale and time.monotonic() - doc_snapshot.fetched <= DOC_SNAPSHOT_TTL
+    await doc_snapshot.get()
+    record_span("doc_snapshot", start, cached=cached)
+    return doc_snapshot.render()
+
+# ---------------------------------------------------------------------------
+# Model API (OpenAI-compatible, served by mlx_lm.server; client: coder/model_http.py)
+# ---------------------------------------------------------------------------
+
+model_router = ModelRouter(MODEL_URLS)
+
+
+# Caps concurrent requests to the model server; excess requests wait here.
+# A context variable, so run_batch can give its own tasks a different cap
+# without replacing the semaphore other callers are waiting on.
+model_slots: contextvars.ContextVar[asyncio.Semaphore] = contextvars.ContextVar(
+    "model_slots", default=asyncio.Semaphore(MODEL_CONCURRENCY))
+
+
+def _completion_payload(messages: list[dict], temperature: float | None,
+                        stream: bool) -> dict:
+    return {
         "model": MODEL_NAME,
         "messages": messages,
         "max_tokens": MAX_TOKENS,
         "temperature": temperature if temperature is not None else TEMPERATURE,
         "stop": ["<|im_end|>", "<|endoftext|>"],
-    }).encode("utf-8")
+        "stream": stream,
+        "user": USER_ID,
+    }
 
-    req = urllib.request.Request(
-        MODEL_URL,
-        data=payload,
-        headers={"Content-Type": "application/json"},
-    )
 
-    try:
-        with urllib.request.urlopen(req, timeout=120) as resp:
-            body = json.loads(resp.read().decode("utf-8"))
-            content = body["choices"][0]["message"]["content"]
-            # Clean up any residual special tokens
-            content = re.sub(r"<\|im_end\|>.*", "", content, flags=re.DOTALL).strip()
-            return content
-    except urllib.error.URLError as e:
-        raise ConnectionError(
-            f"Cannot reach model server at {MODEL_URL}. Is ./serve.sh running?\n{e}"
-        )
+async def _post_completion(payload: dict) -> HTTPResponse:
+    resp = await model_router.post(payload)
+    if resp.status != 200:
+        try:
+            detail = (await resp.read()).decode("utf-8", "replace")[:300]
+        finally:
+            resp.close()
+        raise ConnectionError(f"Model server returned HTTP {resp.status}: {detail}")
+    return resp
+
+
+def _clean_content(content: str) -> str:
+    """Clean up any residual special tokens."""
+    return re.sub(r"<\|im_end\|>.*", "", content, flags=re.DOTALL).strip()
+
+
+async def chat_completion(messages: list[dict], temperature: float | None = None) -> str:
+    """Call the local model's chat completion endpoint."""
+    return (await chat_completion_choices(messages, temperature))[0]
+
+
+async def chat_completion_choices(messages: list[dict], temperature: float | None = None,
+                                  n: int = 1) -> list[str]:
+    """Request ``n`` completions in one call via the OpenAI ``n`` parameter."""
+    if BACKEND == "mlx":
+        return [await mlx_backend.complete(messages, temperature) for _ in range(n)]
+    payload = _completion_payload(messages, temperature, stream=False)
+    if n > 1:
+        payload["n"] = n
+    start = time.perf_counter()
+    async with model_slots.get():
+        queue_s = time.perf_counter() - start
+        resp = await _post_completion(payload)
+        try:
+            body = json.loads(await resp.read())
+        except (OSError, asyncio.TimeoutError) as e:
+            raise ConnectionError(f"Model server connection failed: {e}")
+        finally:
+            resp.close()
+    usage = body.get("usage") or {}
+    record_span("generate", start, stream=False, n=n, server=resp.url, queue_s=round(queue_s, 4),
+                prompt_tokens=usage.get("prompt_tokens"),
+                completion_tokens=usage.get("completion_tokens"))
+    return [_clean_content(c["message"]["content"]) for c in body["choices"]]
+
+
+async def chat_completion_stream(messages: list[dict], temperature: float | None = None,
+                                 on_token=None) -> str:
+    """Stream a chat completion over SSE, calling ``on_token(text)`` per delta.
+
+    Returns the full cleaned response once the server sends ``[DONE]``.
+    Cancelling the caller closes the connection, which stops the server
+    from generating further tokens.
+    """
+    if BACKEND == "mlx":
+        return await mlx_backend.complete(messages, temperature, on_token)
+    start = time.perf_counter()
+    async with model_slots.get():
+        queue_s = time.perf_counter() - start
+        resp = await _post_completion(_completion_payload(messages, temperature, stream=True))
+        headers_s = time.perf_counter() - start
+        first = None
+
+        parts = []
+        try:
+            async for line in resp.iter_lines():
+                line = line.strip()
+                if not line.startswith("data:"):
+                    continue  # blank separators, SSE comments, keep-alives
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                choice = json.loads(data)["choices"][0]
+                text = (choice.get("delta") or {}).get("content") or ""
+                if not text:
+                    continue
+                if first is None:
+                    first = time.perf_counter()
+                parts.append(text)
+                if "<|im_end|>" in text:
+                    break
+                if on_token is not None:
+                    on_token(text)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise ConnectionError(f"Model server connection failed: {e}")
+        finally:
+            resp.close()
+
+    # mlx_lm.server sends one token per SSE delta
+    if first is not None:
+        decode_s = time.perf_counter() - first
+        record_span("generate", start, stream=True, server=resp.url, queue_s=round(queue_s, 4),
+                    headers_s=round(headers_s, 4), ttft_s=round(first - start, 4),
+                    tokens=len(parts), decode_s=round(decode_s, 4))
+    return _clean_content("".join(parts))
 
 # ---------------------------------------------------------------------------
 # Code extraction
 # ---------------------------------------------------------------------------
 
+FENCE_PATTERN = r"```(?:python)?\s*\n(.*?)```"
+
 def extract_code(text: str) -> str | None:
     """Extract Python code from the model response.
 
@@ -149,8 +605,7 @@ def extract_code(text: str) -> str | None:
     - Raw code (if the response looks like pure code)
     """
     # Try fenced code blocks first
-    pattern = r"```(?:python)?\s*\n(.*?)```"
-    matches = re.findall(pattern, text, re.DOTALL)
+    matches = re.findall(FENCE_PATTERN, text, re.DOTALL)
     if matches:
         return "\n\n".join(m.strip() for m in matches)
 
@@ -163,6 +618,261 @@ def extract_code(text: str) -> str | None:
 
     return None
 
+
+class FirstBlockWatcher:
+    """Spot the first complete fenced code block while tokens are streaming in.
+
+    ``on_block(code)`` fires once, as soon as the closing fence arrives, so the
+    block can be executed while the model is still generating.
+    """
+
+    def __init__(self, on_block):
+        self.on_block = on_block
+        self.text = ""
+        self.code: str | None = None
+
+    def feed(self, token: str):
+        if self.code is not None:
+            return
+        self.text += token
+        if "`" not in token:
+            return  # a fence can only close on a token containing a backtick
+        match = re.search(FENCE_PATTERN, self.text, re.DOTALL)
+        if match:
+            self.code = match.group(1).strip()
+            self.on_block(self.code)
+
+# ---------------------------------------------------------------------------
+# API pre-flight check
+#
+# A script that calls rs.AddRing or rg.Brep.CreatePipeSurface fails in Rhino
+# with an AttributeError; the same answer is available locally from the API
+# docs (coder/api_index.py), so such scripts go straight back to the model
+# without a round-trip.
+# ---------------------------------------------------------------------------
+
+def preflight(code: str) -> str | None:
+    """Return why ``code`` can't run, without asking Rhino, or None.
+
+    Always checks syntax; with PREFLIGHT set, also checks rs./rg. names.
+    Names only the partial rs. index doesn't know are printed as warnings.
+    """
+    start = time.perf_counter()
+    warnings = []
+    if PREFLIGHT:
+        problems, warnings = get_api_index().lint(code)
+    else:
+        problems = [e for e in [syntax_error(code)] if e]
+    record_span("preflight", start, ok=not problems, warnings=len(warnings))
+    for warning in warnings[:3]:
+        print(f"\033[90m  Pre-flight warning (partial rs. index): {warning}\033[0m")
+    if not problems:
+        return None
+    return "Pre-flight check failed (not run in Rhino): " + "; ".join(problems[:3])
+
+# ---------------------------------------------------------------------------
+# In-process generation with mlx_lm (--backend mlx)
+#
+# Instead of calling mlx_lm.server, the model is loaded into this process so a
+# logits processor can veto tokens: right after "rs." or "rg.X." only tokens
+# that continue a real name from the ApiIndex are allowed, so the model can't
+# write rs.AddRing in the first place. Needs mlx_lm (training/venv).
+# ---------------------------------------------------------------------------
+
+# The chain being written at the end of the text: owner, middle parts, partial name
+API_CHAIN_TAIL = re.compile(r"(?<![\w.])(rs|rg)((?:\.\w+)*)\.(\w*)$")
+API_OWNER_TAIL = re.compile(r"(?<![\w.])(rs|rg)$")
+IDENT_PREFIX = re.compile(r"\w*")
+
+
+class ApiConstraint:
+    """mlx_lm logits processor that keeps ``rs.``/``rg.`` names real.
+
+    Each vocabulary token is grouped by its leading identifier characters. A
+    token that is all identifier may only extend the partial name towards some
+    known name; a token that ends the name (``(``, ``.``, space) is only
+    allowed if the name is complete. Masks are cached per (scope, partial).
+    Only the literal aliases ``rs`` and ``rg`` are recognized.
+    """
+
+    TAIL_TOKENS = 12  # enough decoded context to see "rg.Intersect.Intersection.Cu"
+    MAX_MASKS = 4096
+
+    def __init__(self, tokenizer, index: ApiIndex):
+        self.tokenizer = tokenizer
+        self.index = index
+        size = max(tokenizer.get_vocab().values()) + 1
+        # ident -> (ids that are just the ident, ids with more after it)
+        self.groups: dict[str, tuple[list[int], list[int]]] = {}
+        self.dot_groups: dict[str, tuple[list[int], list[int]]] = {}
+        self.non_dot: list[int] = []
+        for i in range(size):
+            text = tokenizer.decode([i])
+            groups = self.groups
+            ident = IDENT_PREFIX.match(text).group()
+            groups.setdefault(ident, ([], []))[len(text) > len(ident)].append(i)
+            if text.startswith("."):
+                ident = IDENT_PREFIX.match(text, 1).group()
+                self.dot_groups.setdefault(ident, ([], []))[len(text) > len(ident) + 1].append(i)
+            else:
+                self.non_dot.append(i)
+        self._masks: dict[tuple, object] = {}
+
+    def symbols(self, owner: str, parts: list[str]) -> list[str] | None:
+        """Sorted names valid after ``owner.parts.``, or None if unknown."""
+        if owner == "rs":
+            if not self.index.rs_complete:
+                return None  # the partial index would veto real names
+            if not parts:
+                return sorted(self.index.rs)
+            attrs = self.index.rs.get(parts[0]) if len(parts) == 1 else None
+            return sorted(attrs) if attrs else None
+        scope = ".".join(["Rhino", "Geometry", *parts])
+        names = self.index.rhino.get(scope)
+        if not names:
+            return None
+        if scope in self.index.types:
+            names = names | self.index.members  # inherited members aren't listed
+        return sorted(names)
+
+    @staticmethod
+    def _allowed(groups, symbols: list[str], partial: str) -> list[int]:
+        ids = []
+        for ident, (whole, more) in groups.items():
+            name = partial + ident
+            i = bisect.bisect_left(symbols, name)
+            if i == len(symbols):
+                continue
+            if whole and symbols[i].startswith(name):
+                ids += whole
+            if more and symbols[i] == name:
+                ids += more
+        return ids
+
+    def _mask(self, key: tuple, size: int):
+        import mlx.core as mx
+        mask = self._masks.get(key)
+        if mask is None:
+            dot, owner, parts, partial = key
+            symbols = self.symbols(owner, list(parts))
+            if symbols is None:
+                ids = None
+            elif dot:
+                ids = self.non_dot + self._allowed(self.dot_groups, symbols, "")
+            else:
+                ids = self._allowed(self.groups, symbols, partial)
+            if ids:
+                allowed = [-math.inf] * size
+                for i in ids:
+                    allowed[i] = 0.0
+                mask = mx.array(allowed, dtype=mx.float32)
+            else:
+                mask = False  # nothing to constrain, or no way to continue
+            if len(self._masks) >= self.MAX_MASKS:
+                self._masks.clear()
+            self._masks[key] = mask
+        return mask
+
+    def __call__(self, tokens, logits):
+        tail = self.tokenizer.decode(tokens[-self.TAIL_TOKENS:].tolist())
+        match = API_CHAIN_TAIL.search(tail)
+        if match:
+            parts = tuple(match.group(2).split(".")[1:])
+            key = (False, match.group(1), parts, match.group(3))
+        else:
+            match = API_OWNER_TAIL.search(tail)
+            if not match:
+                return logits
+            key = (True, match.group(1), (), "")
+        mask = self._mask(key, logits.shape[-1])
+        return logits if mask is False else logits + mask
+
+
+class MLXBackend:
+    """Chat completions generated in-process by mlx_lm, one at a time."""
+
+    def __init__(self, model_path: str, adapter_path: str | None = None,
+                 constrain: bool = True):
+        self.model_path = model_path
+        self.adapter_path = adapter_path
+        self.constrain = constrain
+        self.model = None
+        self.tokenizer = None
+        self.constraint: ApiConstraint | None = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Load the model (and build the constraint); safe to call repeatedly."""
+        with self._lock:
+            if self.model is not None:
+                return
+            try:
+                from mlx_lm import load
+            except ImportError:
+                raise ConnectionError(
+                    "--backend mlx needs mlx_lm; run with training/venv/bin/python")
+            self.model, self.tokenizer = load(self.model_path, adapter_path=self.adapter_path)
+            if self.constrain:
+                self.constraint = ApiConstraint(self.tokenizer, get_api_index())
+
+    def _generate(self, messages: list[dict], temperature: float, on_token,
+                  stop: threading.Event, max_tokens: int = MAX_TOKENS) -> str:
+        self.load()
+        from mlx_lm import stream_generate
+        from mlx_lm.sample_utils import make_sampler
+
+        prompt = self.tokenizer.apply_chat_template(messages, add_generation_prompt=True)
+        processors = [self.constraint] if self.constraint is not None else None
+        start = time.perf_counter()
+        first = None
+        parts = []
+        with self._lock:
+            for chunk in stream_generate(self.model, self.tokenizer, prompt,
+                                         max_tokens=max_tokens,
+                                         sampler=make_sampler(temp=temperature),
+                                         logits_processors=processors):
+                if first is None:
+                    first = time.perf_counter()
+                parts.append(chunk.text)
+                if stop.is_set() or "<|im_end|>" in chunk.text or "<|endoftext|>" in chunk.text:
+                    break
+                if on_token is not None and chunk.text:
+                    on_token(chunk.text)
+        if first is not None:
+            record_span("generate", start, backend="mlx", constrained=processors is not None,
+                        ttft_s=round(first - start, 4), tokens=len(parts),
+                        decode_s=round(time.perf_counter() - first, 4))
+        return _clean_content("".join(parts))
+
+    async def complete(self, messages: list[dict], temperature: float | None = None,
+                       on_token=None, max_tokens: int = MAX_TOKENS) -> str:
+        """Generate on a worker thread; ``on_token`` is called on the event loop."""
+        loop = asyncio.get_running_loop()
+        relay = None
+        if on_token is not None:
+            def relay(text: str):
+                loop.call_soon_threadsafe(on_token, text)
+        stop = threading.Event()
+        try:
+            return await asyncio.to_thread(
+                self._generate, messages,
+                temperature if temperature is not None else TEMPERATURE, relay, stop,
+                max_tokens)
+        except BaseException:
+            stop.set()  # the thread finishes its current token, then stops
+            raise
+
+
+mlx_backend = MLXBackend(str(Path(__file__).resolve().parent / MODEL_NAME),
+                         MLX_ADAPTER_PATH, constrain=CONSTRAINED_DECODING)
+
+# ---------------------------------------------------------------------------
+# Response cache (coder/response_cache.py) and prompt budget (coder/prompt_budget.py)
+# ---------------------------------------------------------------------------
+
+response_cache = ResponseCache(CACHE_PATH)
+token_counter = TokenCounter(TOKENIZER_PATH)
+
 # ---------------------------------------------------------------------------
 # Display helpers
 # ---------------------------------------------------------------------------
@@ -177,6 +887,13 @@ def show_code(code: str):
 
 def show_result(result: dict):
     """Print Rhino execution result."""
+    notes = []
+    if result.get("rolled_back"):
+        notes.append(f"removed {result['rolled_back']} object(s) from the failed attempt")
+    if result.get("resumed_at"):
+        notes.append(f"resumed at statement {result['resumed_at'] + 1}")
+    if notes:
+        print(f"\033[90m  ({'; '.join(notes)})\033[0m")
     if result["ok"]:
         msg = result["result"].get("message", "Code executed.")
         output = result["result"].get("output", "")
@@ -186,106 +903,953 @@ def show_result(result: dict):
     else:
         print(f"\033[31m  ERROR: {result['error']}\033[0m")
 
+
+class TokenPrinter:
+    """Render streamed tokens as they arrive, indented like show_code."""
+
+    def __init__(self):
+        self.started = False
+
+    def __call__(self, text: str):
+        if not self.started:
+            print("\r\033[K  ", end="")  # replace the "Generating..." status line
+            self.started = True
+        text = text.replace("\n", "\n  ")
+        print(f"\033[32m{text}\033[0m", end="", flush=True)
+
+    def finish(self):
+        print() if self.started else print("\r\033[K", end="")
+
+
+def show_prompt_size(info: dict):
+    """Print the per-request prompt size against the budget."""
+    approx = "" if info["exact"] else "~"
+    color = "31" if info["tokens"] > info["budget"] else "90"
+    trimmed = []
+    if info["collapsed"]:
+        trimmed.append(f"{info['collapsed']} turn(s) collapsed")
+    if info["dropped"]:
+        trimmed.append(f"{info['dropped']} turn(s) dropped")
+    extra = f"  ({', '.join(trimmed)})" if trimmed else ""
+    print(f"\033[{color}m  Prompt: {approx}{info['tokens']:,} / {info['budget']:,} tokens{extra}\033[0m")
+
+
+def show_turn_stats(traces: list[TurnTrace]):
+    """Print the last turn's spans and per-stage figures across the session."""
+    if not traces:
+        print("  No turns recorded yet.")
+        return
+    last = traces[-1]
+    status = "ok" if last.outcome.get("ok") else last.outcome.get("error") or "failed"
+    print(f"  Last turn: {last.total_s:.2f}s  {status}  ({last.attempt} attempt(s))")
+    for span in sorted(last.spans, key=lambda sp: sp["at_s"]):
+        if span["name"] == "generate" and "ttft_s" in span:
+            rate = (span["tokens"] - 1) / span["decode_s"] if span["decode_s"] else 0.0
+            detail = (f"TTFT {span['ttft_s'] * 1000:.0f} ms, {span['tokens']} tokens "
+                      f"at {rate:.1f} tok/s")
+        elif span["name"] == "generate":
+            detail = f"{span.get('completion_tokens') or '?'} tokens, n={span['n']}"
+        elif span["name"] == "rhino":
+            detail = f"{span['command']}, queued {span['queue_s'] * 1000:.0f} ms"
+        elif span["name"] == "fit_history":
+            detail = f"{span['prompt_tokens']:,} prompt tokens"
+        else:
+            detail = ""
+        print(f"    #{span['attempt']} {span['name']:<12} +{span['at_s']:7.3f}s "
+              f"{span['duration_s'] * 1000:9.1f} ms  {detail}".rstrip())
+
+    summaries = [t.summary() for t in traces]
+    ttfts = [s["ttft_s"] for s in summaries if s["ttft_s"] is not None]
+    rates = [s["decode_tok_s"] for s in summaries if s["decode_tok_s"]]
+    rhino = [s["rhino_s"] / s["rhino_calls"] for s in summaries if s["rhino_calls"]]
+    ok = sum(1 for t in traces if t.outcome.get("ok"))
+    print(f"  Session: {len(traces)} turns, {ok} ok, "
+          f"{sum(s['retries'] for s in summaries) / len(traces):.2f} retries/turn, "
+          f"p50 {percentile([s['total_s'] for s in summaries], 0.5):.2f}s per turn")
+    if ttfts:
+        print(f"    TTFT p50 {percentile(ttfts, 0.5) * 1000:.0f} ms  "
+              f"p95 {percentile(ttfts, 0.95) * 1000:.0f} ms")
+    if rates:
+        print(f"    Decode {sum(rates) / len(rates):.1f} tok/s avg")
+    if rhino:
+        print(f"    Rhino round-trip p50 {percentile(rhino, 0.5) * 1000:.0f} ms  "
+              f"p95 {percentile(rhino, 0.95) * 1000:.0f} ms")
+
+
+def show_jobs(jobs: list["Job"]):
+    """Print the background jobs that are still running."""
+    if not jobs:
+        print("  No background jobs.")
+    for job in jobs:
+        prompt = job.prompt[:60] + ("..." if len(job.prompt) > 60 else "")
+        print(f"  [{job.id}] {job.status():<24} {prompt}")
+
+
+def show_finished_job(job: "Job"):
+    """Print a background job's outcome and the output it held back."""
+    print(f"\033[36m  [{job.id}] {job.status()}: {job.prompt[:60]}\033[0m")
+    print("".join(job.output), end="")
+
+
+def export_traces(traces: list[TurnTrace], path: Path) -> int:
+    """Write traces to ``path`` as JSONL; returns the number written."""
+    with open(path, "w", encoding="utf-8") as f:
+        for trace in traces:
+            f.write(json.dumps(trace.to_dict(), ensure_ascii=False) + "\n")
+    return len(traces)
+
+
+def show_model_servers(stats: dict):
+    """Print per-server load and breaker state."""
+    print(f"  Model servers ({stats['failovers']} failovers):")
+    for b in stats["servers"]:
+        color = "31" if b["state"] == "tripped" else "0"
+        print(f"  \033[{color}m[{b['state']:>7}] {b['url']}  {b['outstanding']} in flight  "
+              f"{b['requests']:>4} req  {b['failures']} fail  avg {b['avg_ms']:.0f} ms\033[0m")
+        if b["state"] == "tripped" and b["last_error"]:
+            print(f"            \033[90m{b['last_error'][:100]}\033[0m")
+
+
+def show_pool_stats(stats: dict):
+    """Print Rhino connection pool counters."""
+    framing = {None: "not negotiated", True: FRAMING_VERSION, False: "legacy"}[stats["framing"]]
+    print(f"  Protocol: {framing}  Connects: {stats['connects']}  Reconnects: {stats['reconnects']}")
+    rows = [("idle", c) for c in stats["idle"]] + [("closed", c) for c in stats["retired"]]
+    if not rows:
+        print("  No connections yet.")
+    for state, c in rows:
+        print(f"  [{state:>6}] {c['requests']:>4} req  {c['failures']} fail  "
+              f"avg {c['avg_ms']:.1f} ms  last {c['last_ms']:.1f} ms  "
+              f"max {c['max_ms']:.1f} ms  age {c['age_s']:.0f}s")
+
 # ---------------------------------------------------------------------------
 # Core loop: generate → execute → retry on error
 # ---------------------------------------------------------------------------
 
-def generate_and_execute(history: list[dict]) -> None:
-    """Generate code from the model, execute in Rhino, auto-retry on errors."""
+async def execute_checked(code: str) -> dict:
+    """Execute generated code in Rhino unless the pre-flight check rejects it."""
+    error = preflight(code)
+    if error is not None:
+        return {"ok": False, "error": error, "preflight": True}
+    return await execute_generated(code)
 
-    # --- Generate ---
-    print(f"\033[33m  Generating...\033[0m", end="", flush=True)
-    try:
-        response = chat_completion(history)
-    except ConnectionError as e:
-        print(f"\r\033[31m  {e}\033[0m")
-        return
-    print(f"\r\033[K", end="")  # clear line
 
-    history.append({"role": "assistant", "content": response})
+def prepare_prompt(history: list[dict]) -> list[dict]:
+    """Fit ``history`` to the prompt budget and print the resulting size."""
+    start = time.perf_counter()
+    messages, info = fit_history(history, token_counter)
+    record_span("fit_history", start, prompt_tokens=info["tokens"],
+                collapsed=info["collapsed"], dropped=info["dropped"])
+    show_prompt_size(info)
+    return messages
+
 
+def extract_code_timed(response: str) -> str | None:
+    start = time.perf_counter()
     code = extract_code(response)
+    record_span("extract", start, found=code is not None)
+    return code
+
+
+async def generate_code(history: list[dict], temperature: float | None = None,
+                        status: str = "Generating...") -> tuple[str, str | None, asyncio.Task | None]:
+    """Run one model turn and return ``(response, code, pending)``.
+
+    In streaming mode tokens are printed as they arrive and the first code
+    block is sent to Rhino as soon as its closing fence is seen; ``pending``
+    is then the task running that execution. Raises ConnectionError if the
+    model server is unreachable.
+    """
+    messages = prepare_prompt(history)
+    print(f"\033[33m  {status}\033[0m", end="", flush=True)
+
+    if not STREAM:
+        response = await chat_completion(messages, temperature=temperature)
+        print(f"\r\033[K", end="")  # clear line
+        code = extract_code_timed(response)
+        if code is not None:
+            show_code(code)
+        return response, code, None
+
+    pending = None
+    block_failed = asyncio.Event()
+
+    def on_done(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is None and not task.result()["ok"]:
+            block_failed.set()
+
+    def on_block(code: str):
+        nonlocal pending
+        pending = asyncio.create_task(execute_checked(code))
+        pending.add_done_callback(on_done)
+
+    watcher = FirstBlockWatcher(on_block)
+    printer = TokenPrinter()
+
+    def on_token(text: str):
+        printer(text)
+        watcher.feed(text)
+
+    # If the first block fails while the model is still writing, the rest of
+    # the reply is moot: stop the stream so the fix request can go out now.
+    stream = asyncio.ensure_future(
+        chat_completion_stream(messages, temperature=temperature, on_token=on_token))
+    failed = asyncio.ensure_future(block_failed.wait())
+    try:
+        await asyncio.wait({stream, failed}, return_when=asyncio.FIRST_COMPLETED)
+        if not stream.done():
+            stream.cancel()
+            await asyncio.wait({stream})
+        if stream.cancelled():
+            match = re.search(FENCE_PATTERN, watcher.text, re.DOTALL)
+            response = watcher.text[:match.end()]
+        else:
+            response = stream.result()
+    except BaseException:
+        stream.cancel()
+        if pending is not None:
+            pending.cancel()
+        raise
+    finally:
+        failed.cancel()
+        printer.finish()
+    if stream.cancelled():
+        print(f"\033[90m  (stopped the reply: the code already failed)\033[0m")
+
+    code = extract_code_timed(response)
+    if watcher.code is None:
+        return response, code, None
+    if code != watcher.code:
+        print(f"\033[90m  (running the first code block only)\033[0m")
+    return response, watcher.code, pending
+
+
+# Identical in every retry turn; only the error that follows it changes. The
+# failed code is the assistant turn right before, so it isn't repeated here.
+RETRY_INSTRUCTIONS = (
+    "You MUST use a completely different approach. Do NOT repeat the same code.\n"
+    "Rhino API reference:\n"
+    "- Ring/torus: rs.AddTorus(base_point, major_radius, minor_radius)\n"
+    "- Pipe: rs.AddPipe(curve_id, ...) — requires an existing curve GUID\n"
+    "- Sphere: rs.AddSphere(center, radius)\n"
+    "- Box: rs.AddBox([8 corner points])\n"
+    "- Cylinder: rs.AddCylinder(base, height, radius)\n"
+    "- Cone: rs.AddCone(base, height, radius)\n"
+    "- Circle: rs.AddCircle(plane, radius)\n"
+    "- Line: rs.AddLine(start, end)\n"
+    "Write the corrected code. Only output code."
+)
+
+
+def retry_message(error: str) -> str:
+    """Build the user turn that asks the model to fix the script it just wrote."""
+    return f"{RETRY_INSTRUCTIONS}\n\nERROR when running your code above in Rhino:\n{error}"
+
+
+def candidate_temperatures(n: int) -> list[float]:
+    """Spread ``n`` sampling temperatures across the retry range."""
+    low = min(TEMPERATURE + 0.3, CANDIDATE_MAX_TEMPERATURE)
+    if n == 1:
+        return [low]
+    step = (CANDIDATE_MAX_TEMPERATURE - low) / (n - 1)
+    return [round(low + i * step, 2) for i in range(n)]
+
+
+def syntax_error(code: str) -> str | None:
+    """Return a SyntaxError message for ``code``, or None if it parses."""
+    try:
+        ast.parse(code)
+    except SyntaxError as e:
+        return f"SyntaxError: {e.msg} (line {e.lineno})"
+    return None
+
+
+async def generate_candidates(messages: list[dict], n: int) -> list[str]:
+    """Ask for ``n`` fix candidates at once, lowest temperature first.
+
+    Uses one request with the ``n`` parameter when CANDIDATES_USE_N_PARAM is
+    set, otherwise ``n`` concurrent requests at spread temperatures. A
+    candidate whose request failed is dropped; ConnectionError is raised only
+    if all of them failed.
+    """
+    temps = candidate_temperatures(n)
+    if CANDIDATES_USE_N_PARAM:
+        return await chat_completion_choices(messages, temperature=temps[n // 2], n=n)
+
+    results = await asyncio.gather(
+        *(chat_completion(messages, temperature=t) for t in temps),
+        return_exceptions=True,
+    )
+    responses = [r for r in results if isinstance(r, str)]
+    if not responses:
+        raise next(r for r in results if isinstance(r, ConnectionError))
+    return responses
+
+
+async def fix_once(history: list[dict], attempt: int) -> tuple[str, str | None, dict | None]:
+    """Generate one fix and execute it; returns ``(response, code, result)``."""
+    # Increase temperature on retries to avoid repeating the same bad output
+    retry_temp = min(TEMPERATURE + (attempt - 1) * 0.3, 0.9)
+    response, code, pending = await generate_code(
+        history, temperature=retry_temp,
+        status=f"Fixing (attempt {attempt}/{MAX_RETRIES})...",
+    )
     if code is None:
-        print(response)
-        return
+        if not STREAM:
+            print(f"  Model response (no code found):")
+            print(f"  {response}")
+        return response, None, None
 
-    show_code(code)
+    print(f"\033[33m  Executing in Rhino... (retry {attempt}/{MAX_RETRIES})\033[0m")
+    result = await (pending if pending is not None else execute_checked(code))
+    show_result(result)
+    return response, code, result
 
-    # --- Execute + auto-retry loop ---
-    for attempt in range(1, MAX_RETRIES + 1):
-        print(f"\033[33m  Executing in Rhino...{f' (retry {attempt}/{MAX_RETRIES})' if attempt > 1 else ''}\033[0m")
-        result = execute_in_rhino(code)
-        show_result(result)
 
+async def fix_with_candidates(history: list[dict], attempt: int, n: int,
+                              failed_code: str) -> tuple[str, str | None, dict | None]:
+    """Generate ``n`` fixes concurrently and run them in order until one works.
+
+    Candidates that fail the pre-flight check, or repeat code that already
+    failed, never reach Rhino. Returns the first success, else the last candidate tried.
+    """
+    messages = prepare_prompt(history)
+    print(f"\033[33m  Fixing (attempt {attempt}/{MAX_RETRIES}, {n} candidates)...\033[0m",
+          end="", flush=True)
+    responses = await generate_candidates(messages, n)
+    print(f"\r\033[K", end="")
+
+    tried = {failed_code}
+    last = (responses[0], None, None)
+    for i, response in enumerate(responses, 1):
+        code = extract_code_timed(response)
+        if code is None or code in tried:
+            continue
+        tried.add(code)
+
+        error = preflight(code)
+        if error:
+            print(f"\033[90m  Candidate {i}/{len(responses)} skipped: {error}\033[0m")
+            last = (response, code, {"ok": False, "error": error})
+            continue
+
+        show_code(code)
+        print(f"\033[33m  Executing candidate {i}/{len(responses)} in Rhino... "
+              f"(retry {attempt}/{MAX_RETRIES})\033[0m")
+        result = await execute_generated(code)
+        show_result(result)
+        last = (response, code, result)
         if result["ok"]:
-            return  # success — done
+            break
+
+    if last[1] is None:
+        print(f"  No new code in {len(responses)} candidates.")
+    return last
+
 
-        # --- Error: ask model to fix ---
-        if attempt == MAX_RETRIES:
+async def generate_and_execute(history: list[dict], candidates: int = NUM_CANDIDATES,
+                               use_cache: bool = CACHE_ENABLED) -> dict:
+    """Generate code from the model, execute in Rhino, auto-retry on errors.
+
+    With ``candidates`` > 1, each retry asks for that many fixes concurrently
+    instead of one. With ``use_cache``, a cached script for the same prompt is
+    executed without calling the model, and scripts that end up working are
+    cached.
+
+    Returns an outcome with ``ok``, ``attempts`` (generations tried),
+    ``cached``, the last ``code`` and the ``errors`` of every failed attempt;
+    ``error`` is the one that ended the turn, or None. ``timings`` has the
+    turn's TurnTrace summary; the full trace is kept for /stats.
+    """
+    trace = TurnTrace(history[-1]["content"])
+    token = current_trace.set(trace)
+    state_token = incremental_state.set({"key": f"rhino_coder:{os.urandom(8).hex()}",
+                                         "pending": False})
+    outcome: dict = {"ok": False}
+    try:
+        outcome = await _generate_and_execute(history, candidates, use_cache, trace)
+    except BaseException as e:
+        outcome["error"] = "Cancelled." if isinstance(e, CancelledError) else f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        if not outcome["ok"]:
+            # Shielded, so a cancelled turn still cleans up after itself.
+            with contextlib.suppress(Exception, CancelledError):
+                removed = await asyncio.shield(discard_failed_attempt())
+                if removed:
+                    print(f"\033[90m  Removed {removed} object(s) left by the failed attempt.\033[0m")
+        incremental_state.reset(state_token)
+        current_trace.reset(token)
+        trace.finish(outcome)
+        save_trace(trace)
+    outcome["timings"] = trace.summary()
+    return outcome
+
+
+async def _generate_and_execute(history: list[dict], candidates: int, use_cache: bool,
+                                trace: TurnTrace) -> dict:
+    system, prompt = history[0]["content"], history[-1]["content"]
+    turn_start = len(history) - 1
+    outcome = {"ok": False, "attempts": 1, "cached": False, "code": None,
+               "errors": [], "error": None}
+
+    def fail(error: str) -> dict:
+        outcome["error"] = error
+        return outcome
+
+    # --- Generate (or reuse a cached script) ---
+    cached = response_cache.lookup(system, prompt) if use_cache else None
+    if cached is not None:
+        response, code, pending = cached["response"], cached["code"], None
+        outcome["cached"] = True
+        note = f" for similar prompt: {cached['similar_to']!r}" if "similar_to" in cached else ""
+        print(f"\033[90m  (cached{note})\033[0m")
+        show_code(code)
+    else:
+        try:
+            context = await document_context(prompt)
+            if context is not None:
+                history[-1]["context"] = context
+                print(f"\033[90m  (with document state: {context.splitlines()[1][2:]})\033[0m")
+            response, code, pending = await generate_code(history)
+        except ConnectionError as e:
+            print(f"\r\033[31m  {e}\033[0m")
+            return fail(str(e))
+
+    history.append({"role": "assistant", "content": response})
+
+    if code is None:
+        if not STREAM:
+            print(response)
+        return fail("No code in model response.")
+
+    # --- Execute ---
+    print(f"\033[33m  Executing in Rhino...\033[0m")
+    result = await (pending if pending is not None else execute_checked(code))
+    show_result(result)
+    outcome["code"] = code
+
+    if cached is not None and not result["ok"]:
+        response_cache.invalidate(code)
+
+    # --- Auto-retry loop: ask the model to fix the error ---
+    while not result["ok"]:
+        outcome["errors"].append(result["error"])
+        if result.get("unreachable"):
+            return fail(result["error"])  # a new script won't fix that
+        if outcome["attempts"] == MAX_RETRIES:
             print(f"\033[31m  Gave up after {MAX_RETRIES} attempts.\033[0m")
-            return
+            return fail(result["error"])
+
+        job = current_job.get()
+        if job is not None:
+            job.retrying(outcome["attempts"] + 1)
+        retry = {"role": "user", "content": retry_message(result["error"]),
+                 "kind": "retry", "error": result["error"]}
+        # Errors like "no curve selected" call for the document state, once per turn
+        if not any(m.get("context") for m in history[turn_start:]):
+            context = await document_context(result["error"], DOC_ERROR)
+            if context is not None:
+                retry["context"] = context
+        history.append(retry)
+        outcome["attempts"] += 1
+        attempt = trace.attempt = outcome["attempts"]
 
-        error_msg = (
-            f"ERROR when running this code:\n```python\n{code}\n```\n"
-            f"Error message: {result['error']}\n\n"
-            f"You MUST use a completely different approach. Do NOT repeat the same code.\n"
-            f"Rhino API reference:\n"
-            f"- Ring/torus: rs.AddTorus(base_point, major_radius, minor_radius)\n"
-            f"- Pipe: rs.AddPipe(curve_id, ...) — requires an existing curve GUID\n"
-            f"- Sphere: rs.AddSphere(center, radius)\n"
-            f"- Box: rs.AddBox([8 corner points])\n"
-            f"- Cylinder: rs.AddCylinder(base, height, radius)\n"
-            f"- Cone: rs.AddCone(base, height, radius)\n"
-            f"- Circle: rs.AddCircle(plane, radius)\n"
-            f"- Line: rs.AddLine(start, end)\n"
-            f"Write the corrected code. Only output code."
-        )
-        history.append({"role": "user", "content": error_msg})
-
-        # Increase temperature on retries to avoid repeating the same bad output
-        retry_temp = min(TEMPERATURE + attempt * 0.3, 0.9)
-        print(f"\033[33m  Fixing (attempt {attempt + 1}/{MAX_RETRIES})...\033[0m", end="", flush=True)
         try:
-            fix_response = chat_completion(history, temperature=retry_temp)
+            if candidates > 1:
+                fix_response, fix_code, result = await fix_with_candidates(
+                    history, attempt, candidates, code)
+            else:
+                fix_response, fix_code, result = await fix_once(history, attempt)
         except ConnectionError as e:
             print(f"\r\033[31m  {e}\033[0m")
-            return
-        print(f"\r\033[K", end="")
+            return fail(str(e))
 
         history.append({"role": "assistant", "content": fix_response})
 
-        fix_code = extract_code(fix_response)
         if fix_code is None:
-            print(f"  Model response (no code found):")
-            print(f"  {fix_response}")
-            return
+            return fail("No code in model response.")
+
+        code = fix_code  # the next round of candidates must not repeat this
+        response = fix_response
+        outcome["code"] = code
+
+    # An exact hit that worked is already stored; anything else is new.
+    if use_cache and (cached is None or "similar_to" in cached or code != cached["code"]):
+        response_cache.store(system, prompt, response, code)
+    outcome["ok"] = True
+    return outcome
+
+# ---------------------------------------------------------------------------
+# Async runtime
+# ---------------------------------------------------------------------------
+
+class AsyncRuntime:
+    """Event loop on a background thread, driven from the blocking REPL.
+
+    The REPL keeps the main thread (and therefore Ctrl-C). ``run`` waits for a
+    coroutine; a Ctrl-C while waiting cancels that coroutine — closing its
+    model or Rhino connection — and returns to the prompt instead of exiting.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, name="rhino-coder-loop", daemon=True)
+        self.thread.start()
+
+    def submit(self, coro) -> Future:
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro):
+        """Run ``coro`` on the loop and return its result.
+
+        Raises CancelledError if the user pressed Ctrl-C while waiting.
+        """
+        future = self.submit(coro)
+        try:
+            return future.result()
+        except KeyboardInterrupt:
+            self.cancel(future)
+            raise CancelledError from None
+
+    def wait(self, future: Future, until: threading.Event):
+        """Block until ``until`` is set, cancelling ``future`` on Ctrl-C like ``run``."""
+        try:
+            until.wait()
+        except KeyboardInterrupt:
+            self.cancel(future)
+            raise CancelledError from None
+
+    def cancel(self, future: Future):
+        future.cancel()
+        # The task is cancelled from the loop thread; one no-op round-trip
+        # through the loop guarantees it has unwound before we return.
+        self.submit(asyncio.sleep(0)).result()
+
+    def close(self):
+        async def shutdown():
+            rhino_pool.close()
+        try:
+            self.submit(shutdown()).result(timeout=5)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+
+# ---------------------------------------------------------------------------
+# Background jobs
+#
+# Each REPL turn runs as a Job on the event loop, against a deep copy of the
+# history, so nothing a running job writes (messages, trim marks) is seen by
+# the REPL or by other jobs. The REPL waits for it until it finishes or its
+# first attempt fails; the retries then carry on in the background with their
+# output held back, and the REPL takes the next prompt. The turn holds its
+# place in the history with a placeholder message (left out of later forks):
+# a finished job's new messages (the delta past the fork point) replace it, so
+# turns land whole and in the order they were asked, and a cancelled or
+# crashed job's placeholder is removed.
+# ---------------------------------------------------------------------------
+
+current_job: contextvars.ContextVar["Job | None"] = contextvars.ContextVar(
+    "current_job", default=None)
+
+
+class Job:
+    """One REPL turn: its task, forked history and held-back output."""
+
+    def __init__(self, job_id: int, history: list[dict], prompt: str):
+        self.id = job_id
+        self.source = [m for m in history if m.get("kind") != "pending"]
+        self.history = copy.deepcopy(self.source) + [{"role": "user", "content": prompt}]
+        self.base = len(self.source)      # the delta starts at the user turn
+        self.placeholder = {"role": "user", "content": prompt, "kind": "pending"}
+        self.prompt = prompt
+        self.started = time.monotonic()
+        self.attempt = 1
+        self.background = False
+        self.settled = threading.Event()  # finished, or moved to the background
+        self.output: list[str] = []
+        self.future: Future | None = None
+        self.merged = False
+
+    @property
+    def delta(self) -> list[dict]:
+        return self.history[self.base:]
+
+    def land(self, history: list[dict]) -> bool:
+        """Replace the placeholder in ``history`` with the delta, or drop it if
+        the job was cancelled or crashed. Trim marks the job's fit_history
+        set on its copy of older turns are carried over. False if the
+        placeholder is gone (/clear, or already landed)."""
+        index = next((i for i, m in enumerate(history) if m is self.placeholder), None)
+        if index is None:
+            return False
+        if self.future.cancelled() or self.future.exception() is not None:
+            del history[index]
+            return False
+        history[index:index + 1] = self.delta
+        for original, forked in zip(self.source, self.history):
+            if forked.get("trim"):
+                original["trim"] = forked["trim"]
+        self.merged = True
+        return True
+
+    def start(self, runtime: AsyncRuntime, candidates: int, use_cache: bool):
+        async def run():
+            current_job.set(self)  # the task runs in a copy of the context
+            return await generate_and_execute(
+                self.history, candidates=candidates, use_cache=use_cache)
+        self.future = runtime.submit(run())
+        self.future.add_done_callback(lambda _: self.settled.set())
+
+    def retrying(self, attempt: int):
+        """Called from the task as each retry starts; the first one detaches."""
+        self.attempt = attempt
+        if BACKGROUND_RETRIES and not self.background:
+            self.background = True
+            self.settled.set()
+
+    def status(self) -> str:
+        if not self.future.done():
+            return f"retrying ({self.attempt}/{MAX_RETRIES}, {time.monotonic() - self.started:.0f}s)"
+        if self.future.cancelled():
+            return "cancelled"
+        if self.future.exception() is not None:
+            return f"failed: {self.future.exception()}"
+        outcome = self.future.result()
+        attempts = f" after {outcome['attempts']} attempts" if outcome["attempts"] > 1 else ""
+        return f"done{attempts}" if outcome["ok"] else f"failed: {outcome['error']}"
+
+
+class JobOutput:
+    """Stand-in for sys.stdout that holds back a background job's prints."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text: str) -> int:
+        job = current_job.get()
+        if job is not None and job.background:
+            job.output.append(text)
+            return len(text)
+        return self.stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+# ---------------------------------------------------------------------------
+# Batch mode
+# ---------------------------------------------------------------------------
+
+def load_batch(path: Path) -> list[dict]:
+    """Read batch prompts from JSONL.
+
+    Each line is an object with "prompt" (or "instruction", as in the
+    dataset files) and an optional "id"; the line number is the default id.
+    """
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            prompt = entry.get("prompt") or entry.get("instruction")
+            if not prompt:
+                raise ValueError(f"{path}:{line_no}: no \"prompt\" field")
+            items.append({"id": entry.get("id", line_no), "prompt": prompt})
+    return items
+
+
+async def run_batch(items: list[dict], out_path: Path, concurrency: int = MODEL_CONCURRENCY,
+                    candidates: int = NUM_CANDIDATES, use_cache: bool = CACHE_ENABLED) -> dict:
+    """Run every prompt through generate → execute → retry and write one
+    result record per line to ``out_path`` as each finishes.
+
+    ``concurrency`` prompts are worked on at once and model requests are
+    capped at the same number; Rhino executions go through ``rhino_queue`` one
+    at a time. The usual per-turn output is discarded; progress goes to
+    stderr. Returns summary counters.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    for index, item in enumerate(items):
+        queue.put_nowait((index, item))
+    latencies: list[float] = []
+    summary = {"total": len(items), "ok": 0, "failed": 0, "cached": 0}
+
+    async def worker(out):
+        while not queue.empty():
+            index, item = queue.get_nowait()
+            history = [{"role": "system", "content": SYSTEM_PROMPT},
+                       {"role": "user", "content": item["prompt"]}]
+            start = time.monotonic()
+            try:
+                outcome = await generate_and_execute(history, candidates, use_cache)
+            except Exception as e:
+                outcome = {"ok": False, "attempts": 0, "cached": False, "code": None,
+                           "errors": [], "error": f"{type(e).__name__}: {e}"}
+            latency = time.monotonic() - start
+            latencies.append(latency)
+
+            record = {"id": item["id"], "index": index, "prompt": item["prompt"],
+                      **outcome, "latency_s": round(latency, 3)}
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+
+            summary["ok" if outcome["ok"] else "failed"] += 1
+            summary["cached"] += outcome["cached"]
+            done = summary["ok"] + summary["failed"]
+            status = "\033[32mok\033[0m" if outcome["ok"] else "\033[31mFAIL\033[0m"
+            print(f"  [{done}/{len(items)}] {status} {item['id']}  "
+                  f"{outcome['attempts']} attempt(s)  {latency:.1f}s", file=sys.stderr)
+
+    start = time.monotonic()
+    with open(out_path, "w", encoding="utf-8") as out, \
+            open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        # The workers' tasks copy the context, and with it this cap.
+        slots_token = model_slots.set(asyncio.Semaphore(concurrency))
+        try:
+            await asyncio.gather(*(worker(out) for _ in range(concurrency)))
+        finally:
+            model_slots.reset(slots_token)
+            rhino_pool.close()
+
+    summary["elapsed_s"] = round(time.monotonic() - start, 3)
+    summary["p50_s"] = round(percentile(latencies, 0.5), 3)
+    summary["p95_s"] = round(percentile(latencies, 0.95), 3)
+    return summary
+
+
+def batch_main(args: argparse.Namespace) -> int:
+    items = load_batch(args.batch)
+    out_path = args.out or args.batch.with_name(args.batch.stem + ".results.jsonl")
+    print(f"  Running {len(items)} prompts from {args.batch} "
+          f"({args.concurrency} at a time) -> {out_path}", file=sys.stderr)
+    try:
+        summary = asyncio.run(run_batch(
+            items, out_path, concurrency=args.concurrency,
+            candidates=args.candidates, use_cache=not args.no_cache))
+    except KeyboardInterrupt:
+        print(f"\n  Interrupted; finished results are in {out_path}", file=sys.stderr)
+        return 130
+    print(f"  {summary['ok']}/{summary['total']} ok, {summary['failed']} failed, "
+          f"{summary['cached']} from cache  in {summary['elapsed_s']:.1f}s  "
+          f"(p50 {summary['p50_s']:.1f}s, p95 {summary['p95_s']:.1f}s)", file=sys.stderr)
+    return 1 if summary["failed"] else 0
+
+# ---------------------------------------------------------------------------
+# Startup probes
+#
+# Run concurrently before the first prompt. Each probe returns a dict with
+# "status" ("ready", "warning" or "down"), "ms" and a short "detail".
+# ---------------------------------------------------------------------------
+
+WARMUP_MESSAGES = [{"role": "system", "content": SYSTEM_PROMPT},
+                   {"role": "user", "content": "Reply with OK."}]
+
+
+def _some_down(results: list, what: str) -> dict | None:
+    """Probe result when not every server answered (raises if none did)."""
+    down = [(b, r) for b, r in zip(model_router.backends, results) if isinstance(r, BaseException)]
+    if not down:
+        return None
+    if len(down) == len(results):
+        raise down[0][1]
+    hosts = ", ".join(f"{b.host} ({str(r).splitlines()[0] if str(r) else type(r).__name__})"
+                      for b, r in down)
+    return {"status": "warning", "detail": f"{len(down)}/{len(results)} {what}: {hosts}"}
+
+
+async def probe_model_id() -> dict:
+    """Check every server is up and reports MODEL_NAME among its models."""
+    results = await asyncio.gather(
+        *(list_models(b.url, PROBE_TIMEOUT) for b in model_router.backends),
+        return_exceptions=True)
+    for backend, ids in zip(model_router.backends, results):
+        if isinstance(ids, BaseException):
+            backend.failed(str(ids).splitlines()[0] if str(ids) else type(ids).__name__)
+        elif MODEL_NAME not in ids:
+            listed = ", ".join(map(str, ids[:3])) + (", ..." if len(ids) > 3 else "") or "none"
+            return {"status": "warning",
+                    "detail": f"{MODEL_NAME} not listed by {backend.host} (has: {listed})"}
+    return _some_down(results, "servers down") or {"status": "ready", "detail": "model ID matches"}
+
+
+async def warm_up_model() -> dict:
+    """Generate one token on every server, loading weights and compiling kernels.
+
+    The warm-up prompt starts with the real system prompt, so a server with a
+    prompt cache also has that prefix ready for the first turn.
+    """
+    if BACKEND == "mlx":
+        await mlx_backend.complete(WARMUP_MESSAGES, 0.0, max_tokens=1)
+        return {"status": "ready", "detail": "model loaded"}
+    payload = _completion_payload(WARMUP_MESSAGES, 0.0, stream=False)
+    payload["max_tokens"] = 1
+
+    async def warm(backend: ModelBackend):
+        resp = await http_request("POST", backend.url, payload)
+        try:
+            await resp.read()
+        finally:
+            resp.close()
+        if resp.status != 200:
+            raise ConnectionError(f"HTTP {resp.status}")
 
-        show_code(fix_code)
-        code = fix_code  # use the fixed code in the next iteration
+    results = await asyncio.gather(*(warm(b) for b in model_router.backends),
+                                   return_exceptions=True)
+    return _some_down(results, "warm-ups failed") or {"status": "ready", "detail": "warm-up done"}
+
+
+async def probe_rhino() -> dict:
+    """Fetch the document summary, which also leaves a pooled connection open."""
+    result = await send_to_rhino("execute_python_code", {"code": snapshot_script()})
+    if result["ok"]:
+        doc_snapshot.update(take_marker(result, DOC_MARKER))
+        return {"status": "ready", "detail": "listener answered"}
+    status = "down" if result.get("unreachable") else "warning"
+    return {"status": status, "detail": result["error"]}
+
+
+async def _timed_probe(probe, timeout: float | None) -> dict:
+    start = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(probe(), timeout)
+    except asyncio.TimeoutError:
+        result = {"status": "down", "detail": f"no answer within {timeout:g}s"}
+    except (ConnectionError, OSError, ValueError) as e:
+        result = {"status": "down", "detail": str(e).splitlines()[0]}
+    result["ms"] = round(1000 * (time.perf_counter() - start))
+    return result
+
+
+async def run_startup_probes() -> dict[str, dict]:
+    """Probe the model and Rhino concurrently; keyed by probe name."""
+    probes = {"warmup": (warm_up_model, None if BACKEND == "mlx" else MODEL_TIMEOUT),
+              "rhino": (probe_rhino, PROBE_TIMEOUT)}
+    if BACKEND != "mlx":
+        probes["models"] = (probe_model_id, PROBE_TIMEOUT)
+        model_router.start_health_checks()
+    results = await asyncio.gather(*(_timed_probe(p, t) for p, t in probes.values()))
+    return dict(zip(probes, results))
 
 # ---------------------------------------------------------------------------
 # REPL
 # ---------------------------------------------------------------------------
 
-def print_banner():
+PROBE_MARKS = {"ready": "\033[32m✓", "warning": "\033[33m!", "down": "\033[31m✗"}
+PROBE_LABELS = {"models": "/v1/models", "warmup": "warm-up", "rhino": "ping"}
+
+
+def probe_lines(probes: dict[str, dict], names: tuple[str, ...]) -> tuple[str, str]:
+    """Status suffix for a banner line and, unless ready, the worst probe's detail."""
+    results = [(name, probes[name]) for name in names if name in probes]
+    if not results:
+        return "", ""
+    _, worst = max(results, key=lambda nr: list(PROBE_MARKS).index(nr[1]["status"]))
+    ms = ", ".join(f"{PROBE_LABELS[name]} {r['ms']:,} ms" for name, r in results)
+    status = f"  {PROBE_MARKS[worst['status']]} {worst['status']}\033[0m \033[90m({ms})\033[0m"
+    detail = "" if worst["status"] == "ready" else f"                 \033[90m{worst['detail']}\033[0m"
+    return status, detail
+
+
+def print_banner(probes: dict[str, dict] | None = None):
+    probes = probes or {}
     print()
     print("  rhino-coder  —  Local Rhino3D Code Generation")
     print("  ──────────────────────────────────────────────")
-    print("  Model server:  localhost:8080 (mlx_lm.server)")
-    print("  Rhino socket:  localhost:54321")
+    model_status, model_detail = probe_lines(probes, ("models", "warmup"))
+    if BACKEND == "mlx":
+        constrained = ", rs./rg. names constrained" if CONSTRAINED_DECODING else ""
+        print(f"  Model:         in-process (mlx_lm{constrained}){model_status}")
+    else:
+        hosts = ", ".join(b.host for b in model_router.backends)
+        print(f"  Model server:  {hosts} (mlx_lm.server){model_status}")
+    if model_detail:
+        print(model_detail)
+    rhino_status, rhino_detail = probe_lines(probes, ("rhino",))
+    print(f"  Rhino socket:  localhost:54321{rhino_status}")
+    if rhino_detail:
+        print(rhino_detail)
     print(f"  Auto-execute:  ON  (max {MAX_RETRIES} retries on error)")
+    if RECORD_PATH is not None:
+        print(f"  Recording:     Rhino commands to {RECORD_PATH}")
     print()
-    print("  Commands: /quit  /clear  /run <code>  /retry  /history")
+    print("  Commands: /quit  /clear  /run <code>  /retry  /history  /pool  /candidates N  /cache  /stats")
+    print("            /jobs  /cancel [id]")
     print()
 
 
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Local Rhino3D code generation & execution CLI.")
+    parser.add_argument("--batch", type=Path, metavar="PROMPTS.jsonl",
+                        help="run prompts from a JSONL file instead of the REPL")
+    parser.add_argument("--out", type=Path, metavar="RESULTS.jsonl",
+                        help="batch results file (default: <prompts>.results.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=MODEL_CONCURRENCY,
+                        help=f"prompts in flight at once in batch mode (default {MODEL_CONCURRENCY})")
+    parser.add_argument("--candidates", type=int, default=NUM_CANDIDATES,
+                        help="fixes requested concurrently per retry in batch mode")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="neither use nor fill the response cache in batch mode")
+    parser.add_argument("--backend", choices=["server", "mlx"], default=BACKEND,
+                        help="call mlx_lm.server, or load the model in-process with "
+                             "constrained rs./rg. names (needs mlx_lm)")
+    parser.add_argument("--stats-out", type=Path, metavar="STATS.jsonl",
+                        help="append a timing trace of every turn to this file")
+    parser.add_argument("--record", type=Path, metavar="CASSETTE.jsonl",
+                        help="append every Rhino command, reply and latency to this file "
+                             "(replay it with rhino_replay.py)")
+    parser.add_argument("--model-url", action="append", type=completion_url, metavar="URL",
+                        help="model server, e.g. http://mac2:8080; repeat to spread "
+                             "requests over several (default: MODEL_URLS)")
+    args = parser.parse_args(argv)
+    if args.concurrency < 1 or args.candidates < 1:
+        parser.error("--concurrency and --candidates must be at least 1")
+    return args
+
+
 def main():
-    print_banner()
+    global STATS_PATH, RECORD_PATH, BACKEND, MODEL_URLS, model_router
+    args = parse_args()
+    BACKEND = args.backend
+    if args.model_url:
+        MODEL_URLS = args.model_url
+        model_router = ModelRouter(MODEL_URLS)
+    if args.stats_out is not None:
+        STATS_PATH = args.stats_out
+    if args.record is not None:
+        RECORD_PATH = args.record
+    if args.batch is not None:
+        sys.exit(batch_main(args))
+
+    runtime = AsyncRuntime()
+    probes = None
+    if STARTUP_PROBES:
+        print("  Checking model server and Rhino...", end="", flush=True)
+        try:
+            probes = runtime.run(run_startup_probes())
+        except CancelledError:
+            pass  # Ctrl-C skips the checks
+        print("\r\033[K", end="")
+    print_banner(probes)
 
     history: list[dict] = [{"role": "system", "content": SYSTEM_PROMPT}]
     last_user_msg: str | None = None
+    num_candidates = NUM_CANDIDATES
+    jobs: dict[int, Job] = {}   # turns retrying in the background
+    last_job: Job | None = None
+    job_ids = 0
+    sys.stdout = JobOutput(sys.stdout)
 
     while True:
+        # Report background jobs that finished since the last prompt
+        for job in [j for j in jobs.values() if j.future.done()]:
+            del jobs[job.id]
+            job.land(history)
+            show_finished_job(job)
+
         try:
             user_input = input("\033[36mrhino>\033[0m ").strip()
         except (EOFError, KeyboardInterrupt):
@@ -306,20 +1870,80 @@ def main():
             print("  History cleared.")
             continue
 
+        if user_input == "/jobs":
+            show_jobs(list(jobs.values()))
+            continue
+
+        if user_input == "/cancel" or user_input.startswith("/cancel "):
+            arg = user_input[len("/cancel"):].strip()
+            if not jobs:
+                print("  No background jobs.")
+                continue
+            if arg and (not arg.isdigit() or int(arg) not in jobs):
+                print(f"  Usage: /cancel [id]  (running: {', '.join(map(str, jobs))})")
+                continue
+            job = jobs.pop(int(arg) if arg else max(jobs))
+            runtime.cancel(job.future)
+            job.land(history)
+            print(f"\033[33m  Cancelled job {job.id}: {job.prompt[:60]}\033[0m")
+            continue
+
         if user_input == "/history":
             for msg in history[1:]:  # skip system
-                role = msg["role"]
-                content = msg["content"][:120] + ("..." if len(msg["content"]) > 120 else "")
+                role = msg["role"] + {"retry": " retry", "pending": " running"}.get(msg.get("kind"), "")
+                text = msg.get("error", msg["content"])  # retry turns: just the error
+                content = text[:120] + ("..." if len(text) > 120 else "")
                 print(f"  [{role}] {content}")
             continue
 
+        if user_input == "/pool":
+            show_pool_stats(rhino_pool.stats())
+            if BACKEND == "server":
+                show_model_servers(model_router.stats())
+            continue
+
+        if user_input == "/stats" or user_input.startswith("/stats "):
+            arg = user_input[len("/stats"):].strip()
+            if not arg:
+                show_turn_stats(list(turn_traces))
+            elif arg == "export" or arg.startswith("export "):
+                path = Path(arg[len("export"):].strip() or "rhino_coder_stats.jsonl")
+                n = export_traces(list(turn_traces), path)
+                print(f"  Wrote {n} turn trace(s) to {path}")
+            else:
+                print("  Usage: /stats [export [path]]")
+            continue
+
+        if user_input in ("/cache", "/cache clear"):
+            if user_input == "/cache clear":
+                response_cache.clear()
+                print("  Response cache cleared.")
+            else:
+                c = response_cache.stats()
+                print(f"  Entries: {c['entries']}  Hits: {c['hits']}  "
+                      f"Near hits: {c['near_hits']}  Misses: {c['misses']}  ({CACHE_PATH})")
+            continue
+
+        if user_input.startswith("/candidates"):
+            arg = user_input[len("/candidates"):].strip()
+            if not arg.isdigit() or int(arg) < 1:
+                print(f"  Usage: /candidates <n>  (currently {num_candidates})")
+                continue
+            num_candidates = int(arg)
+            print(f"  Retries will request {num_candidates} candidate(s).")
+            continue
+
         if user_input.startswith("/run "):
             code = user_input[5:].strip()
             if not code:
                 print("  Usage: /run <python code>")
                 continue
             show_code(code)
-            result = execute_in_rhino(code)
+            try:
+                result = runtime.run(execute_in_rhino(code))
+            except CancelledError:
+                print("\n\033[33m  Cancelled.\033[0m")
+                continue
             show_result(result)
             continue
 
@@ -327,18 +1951,43 @@ def main():
             if last_user_msg is None:
                 print("  Nothing to retry.")
                 continue
-            # Remove last assistant + user messages
-            if len(history) >= 2 and history[-1]["role"] == "assistant":
-                history.pop()
-            if len(history) >= 2 and history[-1]["role"] == "user":
-                history.pop()
+            if last_job is not None and last_job.id in jobs:
+                print(f"  Job {last_job.id} is still retrying that prompt; /cancel {last_job.id} first.")
+                continue
+            # Remove the last prompt's turn, including any retry exchanges
+            if last_job is not None and last_job.merged:
+                delta = {id(m) for m in last_job.delta}
+                history = [m for m in history if id(m) not in delta]
             user_input = last_user_msg
+            use_cache = False  # the user wants a fresh generation
             # Fall through to normal processing
+        else:
+            use_cache = CACHE_ENABLED
 
         # --- Generate → execute → auto-retry ---
         last_user_msg = user_input
-        history.append({"role": "user", "content": user_input})
-        generate_and_execute(history)
+        job_ids += 1
+        job = last_job = Job(job_ids, history, user_input)
+        history.append(job.placeholder)
+        job.start(runtime, num_candidates, use_cache)
+        try:
+            runtime.wait(job.future, job.settled)
+        except CancelledError:
+            # The exchange only lived in the job's fork; /retry re-sends the prompt.
+            job.land(history)
+            print("\n\033[33m  Cancelled.\033[0m")
+            continue
+        if not job.future.done():
+            jobs[job.id] = job
+            print(f"\033[90m  Retrying in the background as job {job.id} "
+                  f"(/jobs to check, /cancel {job.id} to stop).\033[0m")
+            continue
+        job.land(history)
+        job.future.result()  # re-raise anything unexpected, as before
+
+    for job in jobs.values():
+        runtime.cancel(job.future)
+    runtime.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+rhino_replay — Stand-in for the Rhino listener, so rhino_coder runs without Rhino.
+
+Speaks the listener's TCP protocol (bare JSON, or length-prefixed frames once
+negotiate_protocol has switched them on) and answers from a cassette written
+by ``rhino_coder.py --record``. A recorded command gets the recorded reply
+after the recorded latency. Anything else, or everything when no cassette is
+given, goes to a deterministic fake:
+
+  - execute_python_code unwraps the model-written code from rhino_coder's
+    incremental runner (coder.incremental.unwrap_code) and checks it like
+    the pre-flight check does: ast.parse plus the rs./rg./Rhino. name
+    lookups. Code that passes "runs" with no output; nothing is executed.
+  - other commands get the listener's unknown-command error
+
+Commands are answered one at a time, as Rhino runs scripts one at a time on
+its UI thread, so a load test (e.g. --batch against gateway.py --fake) sees
+the same queueing as with the real listener.
+
+Usage:
+    python rhino_coder.py --record cassette.jsonl   # on the Mac, with Rhino
+    python rhino_replay.py cassette.jsonl           # anywhere, on port 54321
+    python rhino_replay.py --speed 0                # fake only, no delays
+"""
+
+import argparse
+import asyncio
+import json
+import re
+import sys
+from pathlib import Path
+
+from coder.api_index import get_api_index
+from coder.incremental import INCREMENTAL_MARKER, unwrap_code
+from coder.rhino_link import FRAME_HEADER, FRAMING_VERSION, MAX_FRAME_SIZE, RHINO_PORT
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+
+REPLAY_HOST = "127.0.0.1"
+REPLAY_PORT = RHINO_PORT
+FAKE_LATENCY = 0.05     # seconds the fake takes per command, before --speed
+# The per-turn sticky key rhino_coder puts in runner and rollback scripts
+TURN_KEY = re.compile(r"rhino_coder:[0-9a-f]{16}")
+
+# ---------------------------------------------------------------------------
+# Cassette
+# ---------------------------------------------------------------------------
+
+class Cassette:
+    """Recorded replies, looked up by command.
+
+    A script is matched on its exact text with the per-turn key masked out,
+    else on the model-written code inside it, so a session recorded with
+    INCREMENTAL_RETRY off still replays with it on. A command recorded
+    several times replays its replies in order, then starts over.
+    """
+
+    def __init__(self, entries: list[dict]):
+        self.exact: dict[str, list[dict]] = {}
+        self.by_code: dict[str, list[dict]] = {}
+        self.cursor: dict[str, int] = {}
+        for entry in entries:
+            self.exact.setdefault(self.key(entry), []).append(entry)
+            code = self.code_key(entry)
+            if code is not None:
+                self.by_code.setdefault(code, []).append(entry)
+
+    @classmethod
+    def load(cls, path: Path) -> "Cassette":
+        with open(path, encoding="utf-8") as f:
+            return cls([json.loads(line) for line in f if line.strip()])
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self.exact.values())
+
+    @staticmethod
+    def key(command: dict) -> str:
+        text = json.dumps({"type": command.get("type"), "params": command.get("params") or {}},
+                          sort_keys=True)
+        return TURN_KEY.sub("rhino_coder:KEY", text)
+
+    @staticmethod
+    def code_key(command: dict) -> str | None:
+        if command.get("type") != "execute_python_code":
+            return None
+        return "code:" + unwrap_code((command.get("params") or {}).get("code", ""))
+
+    def _next(self, table: dict[str, list[dict]], key: str | None) -> dict | None:
+        entries = table.get(key) if key is not None else None
+        if not entries:
+            return None
+        i = self.cursor.get(key, 0)
+        self.cursor[key] = i + 1
+        return entries[i % len(entries)]
+
+    def lookup(self, command: dict) -> dict | None:
+        return (self._next(self.exact, self.key(command))
+                or self._next(self.by_code, self.code_key(command)))
+
+# ---------------------------------------------------------------------------
+# Fake executor
+# ---------------------------------------------------------------------------
+
+def fake_response(command: dict) -> dict:
+    """The reply a listener would give, judged from the code alone."""
+    if command.get("type") != "execute_python_code":
+        return {"status": "error", "message": f"Unknown command type: {command.get('type')}"}
+    script = (command.get("params") or {}).get("code", "")
+    code = unwrap_code(script)
+    problems = get_api_index().check(code) if code else []
+    if problems:
+        return {"status": "error", "message": "; ".join(problems[:3])}
+    # The runner reports where it started and what it removed; nothing, here.
+    output = f"{INCREMENTAL_MARKER} 0 0" if INCREMENTAL_MARKER in script else ""
+    return {"status": "success", "result": {"message": "Executed", "output": output}}
+
+# ---------------------------------------------------------------------------
+# Listener
+# ---------------------------------------------------------------------------
+
+class Replayer:
+    def __init__(self, cassette: Cassette | None, speed: float, framing: bool = True):
+        self.cassette = cassette
+        self.speed = speed
+        self.framing = framing
+        self.busy = asyncio.Lock()   # one command at a time, like Rhino
+        self.replayed = 0
+        self.faked = 0
+
+    async def answer(self, command: dict) -> dict:
+        entry = self.cassette.lookup(command) if self.cassette is not None else None
+        if entry is not None:
+            self.replayed += 1
+            delay, response = entry.get("latency_s", 0.0), entry["response"]
+        else:
+            self.faked += 1
+            delay, response = FAKE_LATENCY, fake_response(command)
+        async with self.busy:
+            if self.speed > 0:
+                await asyncio.sleep(delay / self.speed)
+        return response
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        framed = False
+        try:
+            while True:
+                command = await (read_frame(reader) if framed else read_legacy(reader))
+                if command is None:
+                    break
+                if command.get("type") == "negotiate_protocol" and self.framing:
+                    # Answered in the old format; frames from the next command on.
+                    await send(writer, {"status": "success",
+                                        "result": {"framing": FRAMING_VERSION}}, framed)
+                    framed = True
+                    continue
+                await send(writer, await self.answer(command), framed)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+async def read_legacy(reader: asyncio.StreamReader) -> dict | None:
+    """Read bare JSON until it parses, as the listener does; None at EOF."""
+    buf = bytearray()
+    while True:
+        chunk = await reader.read(65536)
+        if not chunk:
+            return None
+        buf += chunk
+        try:
+            return json.loads(buf)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            continue
+
+
+async def read_frame(reader: asyncio.StreamReader) -> dict | None:
+    try:
+        (length,) = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+        if length > MAX_FRAME_SIZE:
+            raise ValueError(f"frame too large ({length} bytes)")
+        return json.loads(await reader.readexactly(length))
+    except asyncio.IncompleteReadError:
+        return None
+
+
+async def send(writer: asyncio.StreamWriter, response: dict, framed: bool):
+    payload = json.dumps(response).encode("utf-8")
+    writer.write(FRAME_HEADER.pack(len(payload)) + payload if framed else payload)
+    await writer.drain()
+
+# ---------------------------------------------------------------------------
+# Main
+# ---------------------------------------------------------------------------
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Stand-in Rhino listener that replays a recorded session.")
+    parser.add_argument("cassette", nargs="?", type=Path,
+                        help="JSONL from rhino_coder.py --record (default: fake replies only)")
+    parser.add_argument("--host", default=REPLAY_HOST)
+    parser.add_argument("--port", type=int, default=REPLAY_PORT)
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="divide recorded latencies by this; 0 answers at once (default 1)")
+    parser.add_argument("--legacy", action="store_true",
+                        help="refuse length-prefixed framing, like an older listener")
+    args = parser.parse_args(argv)
+    if args.speed < 0:
+        parser.error("--speed can't be negative")
+    if args.cassette is not None and not args.cassette.exists():
+        parser.error(f"cassette not found: {args.cassette}")
+    return args
+
+
+async def serve(args: argparse.Namespace):
+    cassette = Cassette.load(args.cassette) if args.cassette is not None else None
+    get_api_index()  # build the name index now, not during the first command
+    replayer = Replayer(cassette, args.speed, framing=not args.legacy)
+    server = await asyncio.start_server(replayer.handle, args.host, args.port)
+    source = f"{len(cassette)} recorded command(s) from {args.cassette}" if cassette else "fake replies"
+    print(f"  Rhino stand-in on {args.host}:{args.port} with {source}", file=sys.stderr)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        print(f"\n  Replayed {replayer.replayed}, faked {replayer.faked}", file=sys.stderr)
+
+
+def main():
+    args = parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -15,12 +15,16 @@ import json
 import ast
 import re
 import os
+import sys
 from collections import Counter, defaultdict
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 SYNTHETIC_DIR = os.path.join(BASE_DIR, "data", "raw", "synthetic")
 API_INFO_PATH = os.path.join(BASE_DIR, "data", "raw", "docs", "api_info.json")
 
+sys.path.insert(0, os.path.join(BASE_DIR, "data", "scripts"))
+import jsonl_io  # noqa: E402
+
 # Known rhinoscriptsyntax functions
 KNOWN_RS_FUNCS = {
     "AddPoint", "AddPoints", "AddLine", "AddPolyline", "AddCircle", "AddArc",
@@ -129,7 +133,7 @@ def main():
     os.makedirs(SYNTHETIC_DIR, exist_ok=True)
     api_classes = build_api_lookup()
 
-    jsonl_files = sorted(f for f in os.listdir(SYNTHETIC_DIR) if f.endswith(".jsonl"))
+    jsonl_files = [p.name for p in jsonl_io.jsonl_files(SYNTHETIC_DIR)]
     all_issues = []
     stats = {
         "total": 0, "syntax_pass": 0, "syntax_fail": 0,
@@ -139,34 +143,26 @@ def main():
 
     for jf in jsonl_files:
         file_total = file_valid = 0
-        with open(os.path.join(SYNTHETIC_DIR, jf)) as f:
-            for line_num, line in enumerate(f, 1):
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    pair = json.loads(line)
-                except json.JSONDecodeError:
-                    continue
-
-                stats["total"] += 1
-                file_total += 1
-
-                syntax_ok, api_ok, issues = validate_pair(pair, api_classes)
-
-                if syntax_ok:
-                    stats["syntax_pass"] += 1
-                else:
-                    stats["syntax_fail"] += 1
-                if api_ok:
-                    stats["api_pass"] += 1
-                else:
-                    stats["api_fail"] += 1
-
-                if syntax_ok and api_ok:
-                    file_valid += 1
-                elif issues:
-                    all_issues.append({"file": jf, "line": line_num, "issues": issues})
+        path = os.path.join(SYNTHETIC_DIR, jf)
+        for line_num, pair in jsonl_io.enumerate_jsonl(path, on_error="skip"):
+            stats["total"] += 1
+            file_total += 1
+
+            syntax_ok, api_ok, issues = validate_pair(pair, api_classes)
+
+            if syntax_ok:
+                stats["syntax_pass"] += 1
+            else:
+                stats["syntax_fail"] += 1
+            if api_ok:
+                stats["api_pass"] += 1
+            else:
+                stats["api_fail"] += 1
+
+            if syntax_ok and api_ok:
+                file_valid += 1
+            elif issues:
+                all_issues.append({"file": jf, "line": line_num, "issues": issues})
 
         stats["by_file"][jf] = {"total": file_total, "valid": file_valid, "invalid": file_total - file_valid}
 
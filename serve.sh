@@ -2,9 +2,17 @@
 # Serve the fine-tuned Rhino coder model via mlx_lm.server
 # Provides an OpenAI-compatible API on localhost:8080
 #
-# Usage: ./serve.sh [--adapter]
-#   --adapter  Use base model + adapter (less RAM, same quality)
-#   (default)  Use fused model
+# Usage: ./serve.sh [--adapter] [--prompt-cache [N]] [--draft [PATH]] [--draft-tokens N]
+#   --adapter         Use base model + adapter (less RAM, same quality)
+#   (default)         Use fused model
+#   --prompt-cache N  Keep KV caches for the N most recent prompts (default 8), so
+#                     a request that extends an earlier prompt only prefills the
+#                     new suffix. Needs an mlx_lm with --prompt-cache-size.
+#   --draft PATH      Speculative decoding: a small draft model proposes tokens and
+#                     the main model verifies them in one pass. Defaults to the
+#                     draft from training/train.sh --draft, else the stock 0.5B coder.
+#                     Greedy output is unchanged; see training/bench_speculative.py.
+#   --draft-tokens N  Tokens the draft proposes per step (default 3)
 
 set -e
 cd "$(dirname "$0")"
@@ -13,22 +21,73 @@ VENV=training/venv/bin/python
 FUSED_MODEL=training/models/rhino-coder-fused
 BASE_MODEL=training/models/codeqwen-7b-4bit
 ADAPTER=training/adapters/rhino-lora
+DRAFT_FUSED=training/models/rhino-coder-draft-fused
+DRAFT_BASE=training/models/qwen-coder-0.5b-4bit
 PORT=8080
 
-if [ "$1" = "--adapter" ]; then
+USE_ADAPTER=0
+PROMPT_CACHE_SIZE=""
+DRAFT_MODEL=""
+NUM_DRAFT_TOKENS=3
+while [ $# -gt 0 ]; do
+    case "$1" in
+        --adapter)
+            USE_ADAPTER=1 ;;
+        --prompt-cache)
+            PROMPT_CACHE_SIZE=8
+            if [[ "$2" =~ ^[0-9]+$ ]]; then
+                PROMPT_CACHE_SIZE="$2"
+                shift
+            fi ;;
+        --draft)
+            DRAFT_MODEL=$DRAFT_BASE
+            [ -d "$DRAFT_FUSED" ] && DRAFT_MODEL=$DRAFT_FUSED
+            if [ -n "$2" ] && [[ "$2" != --* ]]; then
+                DRAFT_MODEL="$2"
+                shift
+            fi ;;
+        --draft-tokens)
+            NUM_DRAFT_TOKENS="$2"
+            shift ;;
+        *)
+            echo "Unknown option: $1" >&2
+            exit 1 ;;
+    esac
+    shift
+done
+
+EXTRA_ARGS=()
+if [ -n "$PROMPT_CACHE_SIZE" ]; then
+    EXTRA_ARGS+=(--prompt-cache-size "$PROMPT_CACHE_SIZE")
+fi
+if [ -n "$DRAFT_MODEL" ]; then
+    if [[ "$DRAFT_MODEL" == training/* ]] && [ ! -d "$DRAFT_MODEL" ]; then
+        echo "Draft model not found: $DRAFT_MODEL (convert it first, see README)" >&2
+        exit 1
+    fi
+    EXTRA_ARGS+=(--draft-model "$DRAFT_MODEL" --num-draft-tokens "$NUM_DRAFT_TOKENS")
+fi
+
+if [ "$USE_ADAPTER" = 1 ]; then
     echo "Serving base model + LoRA adapter on http://localhost:$PORT"
     echo "Model:   $BASE_MODEL"
     echo "Adapter: $ADAPTER"
+    [ -n "$PROMPT_CACHE_SIZE" ] && echo "Prompt cache: $PROMPT_CACHE_SIZE prompts"
+    [ -n "$DRAFT_MODEL" ] && echo "Draft:   $DRAFT_MODEL ($NUM_DRAFT_TOKENS tokens/step)"
     echo ""
     $VENV -m mlx_lm server \
         --model "$BASE_MODEL" \
         --adapter-path "$ADAPTER" \
-        --port $PORT
+        --port $PORT \
+        "${EXTRA_ARGS[@]}"
 else
     echo "Serving fused model on http://localhost:$PORT"
     echo "Model: $FUSED_MODEL"
+    [ -n "$PROMPT_CACHE_SIZE" ] && echo "Prompt cache: $PROMPT_CACHE_SIZE prompts"
+    [ -n "$DRAFT_MODEL" ] && echo "Draft: $DRAFT_MODEL ($NUM_DRAFT_TOKENS tokens/step)"
     echo ""
     $VENV -m mlx_lm server \
         --model "$FUSED_MODEL" \
-        --port $PORT
+        --port $PORT \
+        "${EXTRA_ARGS[@]}"
 fi
@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+# The tests import the scripts at the repo root and in data/scripts directly.
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "data" / "scripts"))
@@ -0,0 +1,71 @@
+from coder.api_index import ApiIndex
+
+RS = {"AddSphere": None, "AddCircle": None, "filter": ["curve", "surface"]}
+RHINO = {
+    "Rhino": ["Geometry", "RhinoDoc"],
+    "Rhino.Geometry": ["Brep", "Point3d"],
+    "Rhino.Geometry.Brep": ["CreatePipe", "Faces"],
+    "Rhino.Geometry.Point3d": ["X", "Y", "Z"],
+    "Rhino.RhinoDoc": ["ActiveDoc", "Objects"],
+}
+TYPES = ["Rhino.Geometry.Brep", "Rhino.Geometry.Point3d", "Rhino.RhinoDoc"]
+
+
+def index(rs_complete=True):
+    return ApiIndex(RS, RHINO, TYPES, rs_complete)
+
+
+def test_known_names_pass():
+    code = ("import rhinoscriptsyntax as rs\nimport Rhino\n"
+            "rs.AddSphere((0, 0, 0), 5)\nrs.filter.curve\n"
+            "Rhino.Geometry.Brep.CreatePipe\nRhino.RhinoDoc.ActiveDoc.Objects\n")
+    assert index().lint(code) == ([], [])
+
+
+def test_unknown_rs_name_with_suggestion():
+    problems = index().check("import rhinoscriptsyntax as rs\nrs.AddSpher((0, 0, 0), 5)\n")
+    assert problems == ["rs.AddSpher does not exist (line 2); did you mean rs.AddSphere?"]
+
+
+def test_unknown_rs_class_attribute():
+    problems = index().check("import rhinoscriptsyntax as rs\nrs.filter.mesh\n")
+    assert problems[0].startswith("rs.filter.mesh does not exist (line 2)")
+
+
+def test_partial_index_only_warns_about_rs_names():
+    code = ("import rhinoscriptsyntax as rs\nimport Rhino\n"
+            "rs.AddRing()\nRhino.Geometry.Bre\n")
+    problems, warnings = index(rs_complete=False).lint(code)
+    assert problems == ["Rhino.Geometry.Bre does not exist (line 4); "
+                        "did you mean Rhino.Geometry.Brep?"]
+    assert warnings == ["rs.AddRing does not exist (line 3)"]
+    assert index(rs_complete=False).check("import rhinoscriptsyntax as rs\nrs.AddRing()\n") == []
+
+
+def test_import_from_aliases():
+    idx = index()
+    assert idx.check("from Rhino.Geometry import Point3d as P\nP.X\n") == []
+    assert idx.check("from Rhino.Geometry import Point3d as P\nP.W\n") == \
+        ["P.W does not exist (line 2)"]
+    assert idx.check("from Rhino.Geometry import Sphere\n") == \
+        ["Rhino.Geometry.Sphere does not exist (line 1)"]
+    assert idx.check("from rhinoscriptsyntax import AddCircle\n") == []
+
+
+def test_inherited_members_are_accepted():
+    # Point3d has no Faces, but some type does; it may come from a base type
+    assert index().check("import Rhino\nRhino.Geometry.Point3d.Faces\n") == []
+
+
+def test_names_outside_rs_and_rhino_are_not_checked():
+    assert index().check("import math\nmath.whatever\nimport System\nSystem.Drawing.Color\n") == []
+
+
+def test_syntax_error_is_the_only_problem():
+    problems, warnings = index().lint("rs.AddSphere((0, 0, 0), 5\n")
+    assert len(problems) == 1 and problems[0].startswith("SyntaxError")
+    assert warnings == []
+
+
+def test_without_api_info_rhino_names_are_not_checked():
+    assert ApiIndex(RS, {}, []).check("import Rhino\nRhino.Nothing.Here\n") == []
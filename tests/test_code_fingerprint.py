@@ -0,0 +1,55 @@
+import pytest
+
+from code_fingerprint import fingerprint, fingerprints, structure_key
+
+CODE = '''import rhinoscriptsyntax as rs
+
+def ring(count, radius):
+    """Points on a circle."""
+    points = []
+    for i in range(count):
+        points.append(rs.AddPoint(radius * i, 0, 0))
+    return points
+
+ring(8, 5.0)
+'''
+
+
+@pytest.mark.parametrize("variant", [
+    CODE.replace("points", "pts").replace("radius", "r"),
+    CODE.replace("8, 5.0", "12, 2.5"),
+    CODE.replace('    """Points on a circle."""\n', "    # points on a circle\n"),
+    CODE.replace("count", "n").replace("range(n):", "range( n ):  # loop"),
+])
+def test_names_numbers_and_comments_do_not_matter(variant):
+    assert fingerprint(variant) == fingerprint(CODE)
+
+
+@pytest.mark.parametrize("variant", [
+    CODE.replace("rs.AddPoint", "rs.AddSphere"),
+    CODE.replace("import rhinoscriptsyntax as rs", "import scriptcontext as rs"),
+    CODE.replace("ring(8, 5.0)", "ring(8, '5')"),
+    CODE.replace("range(count)", "list(range(count))"),
+])
+def test_api_calls_and_structure_do(variant):
+    assert fingerprint(variant) != fingerprint(CODE)
+
+
+def test_unparseable_code_has_no_fingerprint():
+    assert fingerprint("def broken(:\n") is None
+    assert structure_key(None, "Make a ring") is None
+
+
+def test_structure_key_masks_numbers_in_the_instruction():
+    fp = fingerprint(CODE)
+    assert structure_key(fp, "Make a ring of 8 points") == structure_key(fp, "make a ring of 12 points")
+    assert structure_key(fp, "Make a ring of 8 points") != structure_key(fp, "Make a row of 8 points")
+
+
+def test_batch_uses_the_cache(tmp_path):
+    cache = tmp_path / "fingerprints.json"
+    codes = [CODE, "x = 1", "def broken(:\n", CODE]
+    first = fingerprints(codes, workers=1, cache_path=cache)
+    assert first == [fingerprint(c) for c in codes]
+    assert fingerprints(codes, workers=1, cache_path=cache) == first
+    assert cache.exists()
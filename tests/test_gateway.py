@@ -0,0 +1,138 @@
+import asyncio
+import json
+
+import pytest
+
+import gateway
+from gateway import FairQueue, FakeBackend, Gateway, Job
+
+
+@pytest.fixture(autouse=True)
+def fast_fake(monkeypatch):
+    monkeypatch.setattr(gateway, "FAKE_PREFILL_DELAY", 0)
+    monkeypatch.setattr(gateway, "FAKE_TOKEN_DELAY", 0)
+
+
+class CountingBackend(FakeBackend):
+    def __init__(self):
+        super().__init__()
+        self.posts = 0
+
+    async def post(self, payload):
+        self.posts += 1
+        return await super().post(payload)
+
+
+def payload(text, **extra):
+    return {"model": "m", "messages": [{"role": "user", "content": text}], **extra}
+
+
+async def http_post(port, body):
+    """POST to the gateway; returns (status, parsed JSON body)."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    data = json.dumps(body).encode("utf-8")
+    writer.write(b"POST /v1/chat/completions HTTP/1.1\r\nHost: x\r\n"
+                 + f"Content-Length: {len(data)}\r\n\r\n".encode("ascii") + data)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(body)
+
+
+def test_fair_queue_serves_users_round_robin():
+    async def scenario():
+        queue = FairQueue()
+        for user, n in (("a", 1), ("a", 2), ("a", 3), ("b", 1), ("c", 1)):
+            await queue.put(Job(f"{user}{n}", {}, user))
+        return [(await queue.get()).key for _ in range(5)]
+
+    assert asyncio.run(scenario()) == ["a1", "b1", "c1", "a2", "a3"]
+
+
+def test_fair_queue_remove_drops_an_emptied_user():
+    async def scenario():
+        queue = FairQueue()
+        a, b = Job("a", {}, "a"), Job("b", {}, "b")
+        await queue.put(a)
+        await queue.put(b)
+        assert queue.remove(a)
+        assert not queue.remove(a)
+        return list(queue.turns), len(queue), (await queue.get()).key
+
+    assert asyncio.run(scenario()) == (["b"], 1, "b")
+
+
+def test_identical_requests_share_one_generation():
+    async def scenario():
+        backend = CountingBackend()
+        gw = Gateway(backend)
+        first = await gw.submit(payload("sphere", user="a"), "a")
+        second = await gw.submit(payload("sphere", user="b"), "b")
+        other = await gw.submit(payload("box"), "a")
+        gw.start()
+        bodies = [b"".join([c async for c in job.body()]) for job in (first, second)]
+        await other.head()
+        for worker in gw.workers:
+            worker.cancel()
+        return first, second, other, bodies, backend.posts, gw.metrics.coalesced
+
+    first, second, other, bodies, posts, coalesced = asyncio.run(scenario())
+    assert first is second and other is not first
+    assert bodies[0] == bodies[1]
+    assert json.loads(bodies[0])["choices"][0]["message"]["content"].startswith("```python")
+    assert (posts, coalesced) == (2, 1)
+
+
+def test_full_user_queue_gets_429(monkeypatch):
+    monkeypatch.setattr(gateway, "MAX_QUEUED_PER_USER", 2)
+
+    async def scenario():
+        gw = Gateway(FakeBackend())  # no workers: everything stays queued
+        for i in range(2):
+            assert await gw.submit(payload(f"p{i}"), "a") is not None
+        server = await asyncio.start_server(gw.handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            rejected = await http_post(port, payload("p2", user="a"))
+            coalesced = gw.pending[next(iter(gw.pending))]
+        return rejected, gw.metrics.rejected, await gw.submit(payload("p0"), "a") is coalesced
+
+    (status, body), rejected, joined = asyncio.run(scenario())
+    assert status == 429
+    assert "already has 2 requests queued" in body["error"]["message"]
+    assert rejected == 1
+    assert joined  # an identical request still joins a queued one
+
+
+def test_abandoned_queued_job_frees_its_slot(monkeypatch):
+    monkeypatch.setattr(gateway, "MAX_QUEUED_PER_USER", 1)
+
+    async def scenario():
+        gw = Gateway(FakeBackend())
+        job = await gw.submit(payload("p0"), "a")
+        gw.unsubscribe(job)  # the client hung up while queued
+        depth = gw.queue.depth("a")
+        return depth, await gw.submit(payload("p1"), "a")
+
+    depth, accepted = asyncio.run(scenario())
+    assert depth == 0
+    assert accepted is not None
+
+
+def test_completion_is_relayed_over_http():
+    async def scenario():
+        gw = Gateway(FakeBackend())
+        gw.start()
+        server = await asyncio.start_server(gw.handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            result = await http_post(port, payload("cylinder"))
+        for worker in gw.workers:
+            worker.cancel()
+        return result, len(gw.queue)
+
+    (status, body), queued = asyncio.run(scenario())
+    assert status == 200
+    assert "rs.AddSphere" in body["choices"][0]["message"]["content"]
+    assert queued == 0
@@ -0,0 +1,97 @@
+import ast
+import asyncio
+
+import pytest
+
+import rhino_coder
+from coder.incremental import (INCREMENTAL_MARKER, INCREMENTAL_ROLLBACK, INCREMENTAL_RUNNER,
+                               resumable_statement, split_statements, take_marker, unwrap_code)
+from rhino_coder import discard_failed_attempt, execute_generated, incremental_state
+
+CODE = '''import rhinoscriptsyntax as rs
+
+# a comment between statements
+radius = 5
+sphere = rs.AddSphere((0, 0, 0), radius)
+
+@staticmethod
+def helper():
+    return rs.AddPoint(1, 2, 3)
+for i in range(3):
+    rs.AddPoint(i, 0, 0)
+'''
+
+
+def statement(source):
+    return ast.parse(source).body[0]
+
+
+def test_resumable_statements():
+    assert resumable_statement(statement("r = 5"))
+    assert resumable_statement(statement("a, b = (1, -2.5)"))
+    assert resumable_statement(statement("s = rs.AddSphere((0, 0, 0), r * 2, layer='x')"))
+    assert not resumable_statement(statement("rs.AddSphere((0, 0, 0), 5)"))
+    assert not resumable_statement(statement("s = rs.AddSphere(rs.AddPoint(0, 0, 0), 5)"))
+    assert not resumable_statement(statement("s = rs.filter.curve"))
+    assert not resumable_statement(statement("obj.x = 5"))
+    assert not resumable_statement(statement("s = brep.Faces[0].Area()"))
+    assert not resumable_statement(statement("for i in range(3): pass"))
+
+
+def test_split_statements():
+    stmts = split_statements(CODE)
+    assert [(line, resumable) for _, resumable, line, _ in stmts] == \
+        [(1, False), (4, True), (5, True), (7, False), (10, False)]
+    assert stmts[3][3].startswith("@staticmethod\ndef helper():")
+    assert split_statements("def broken(:\n") is None
+
+
+def test_statement_hash_ignores_formatting():
+    a = split_statements("r = 5\nrs.AddSphere((0,0,0), r)\n")
+    b = split_statements("r = 5  # radius\nrs.AddSphere( (0, 0, 0),r )\n")
+    assert [s[0] for s in a] == [s[0] for s in b]
+    c = split_statements("r = 5\nrs.AddSphere((0,0,0), 6)\n")
+    assert a[1][0] != c[1][0]
+
+
+def test_unwrap_code_recovers_the_statements():
+    runner = INCREMENTAL_RUNNER.replace("MARKER", repr(INCREMENTAL_MARKER))
+    script = f"{runner}\n_rc_run('rhino_coder:key', {split_statements(CODE)!r})\n"
+    unwrapped = unwrap_code(script)
+    assert unwrapped.splitlines()[3:5] == ["radius = 5", "sphere = rs.AddSphere((0, 0, 0), radius)"]
+    assert "comment" not in unwrapped
+    assert [s[0] for s in split_statements(unwrapped)] == [s[0] for s in split_statements(CODE)]
+    assert unwrap_code(INCREMENTAL_ROLLBACK.replace("KEY", "'rhino_coder:key'")) == ""
+    assert unwrap_code("r = 5\n") == "r = 5"
+
+
+def test_take_marker_strips_marker_lines():
+    result = {"ok": True, "result": {"output": f"hello\n{INCREMENTAL_MARKER} 2 1\nworld"}}
+    assert take_marker(result, INCREMENTAL_MARKER) == "2 1"
+    assert result["result"]["output"] == "hello\nworld"
+    assert take_marker({"ok": True, "result": {"output": "hello"}}, INCREMENTAL_MARKER) is None
+    assert take_marker({"ok": False, "error": "x"}, INCREMENTAL_MARKER) is None
+
+
+@pytest.mark.parametrize("incremental", [True, False])
+def test_rollback_only_follows_a_failed_runner_script(monkeypatch, incremental):
+    sent = []
+
+    async def fake_send(command_type, params=None):
+        sent.append(params["code"])
+        if "_rc_run(" in params["code"] or len(sent) == 1:
+            return {"ok": False, "error": "NameError: name 'x' is not defined"}
+        return {"ok": True, "result": {"output": f"{INCREMENTAL_MARKER} 0 2"}}
+
+    monkeypatch.setattr(rhino_coder, "send_to_rhino", fake_send)
+    monkeypatch.setattr(rhino_coder, "INCREMENTAL_RETRY", incremental)
+
+    async def attempt():
+        incremental_state.set({"key": "rhino_coder:0123456789abcdef", "pending": False})
+        result = await execute_generated("r = 5\nrs.AddSphere((0, 0, 0), x)\n")
+        return result, await discard_failed_attempt()
+
+    result, removed = asyncio.run(attempt())
+    assert not result["ok"]
+    assert removed == (2 if incremental else 0)
+    assert len(sent) == (2 if incremental else 1)
@@ -0,0 +1,68 @@
+import gzip
+import json
+
+import pytest
+
+import clean_dataset
+from jsonl_io import JsonlWriter, iter_jsonl, read_jsonl, write_jsonl
+
+RECORDS = [{"instruction": "Make a sphere", "code": "rs.AddSphere((0,0,0), 5)"},
+           {"instruction": "Résumé of ∅", "n": 12345678901234567890123, "x": 1.5}]
+
+
+def test_gzip_round_trip(tmp_path):
+    path = tmp_path / "pairs.jsonl.gz"
+    assert write_jsonl(path, iter(RECORDS)) == 2
+    assert read_jsonl(path) == RECORDS
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        assert f.readline() == json.dumps(RECORDS[0], ensure_ascii=False) + "\n"
+
+
+def test_compressed_output_is_reproducible(tmp_path):
+    write_jsonl(tmp_path / "a.jsonl.gz", RECORDS)
+    write_jsonl(tmp_path / "b.jsonl.gz", RECORDS)
+    assert (tmp_path / "a.jsonl.gz").read_bytes() == (tmp_path / "b.jsonl.gz").read_bytes()
+
+
+def test_discard_leaves_the_previous_file(tmp_path):
+    path = tmp_path / "pairs.jsonl"
+    write_jsonl(path, RECORDS)
+    before = path.read_bytes()
+    writer = JsonlWriter(path)
+    writer.write({"instruction": "partial"})
+    writer.discard()
+    assert path.read_bytes() == before
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_error_inside_with_discards(tmp_path):
+    path = tmp_path / "pairs.jsonl"
+    write_jsonl(path, RECORDS)
+    with pytest.raises(RuntimeError):
+        with JsonlWriter(path) as out:
+            out.write({"instruction": "partial"})
+            raise RuntimeError("stage failed")
+    assert read_jsonl(path) == RECORDS
+
+
+def test_bad_lines(tmp_path):
+    path = tmp_path / "pairs.jsonl"
+    path.write_text('{"a": 1}\n\nnot json\n{"a": 2}\n')
+    with pytest.raises(ValueError, match="pairs.jsonl:3"):
+        read_jsonl(path)
+    errors = []
+    records = list(iter_jsonl(path, on_error=lambda p, n, e: errors.append(n)))
+    assert records == [{"a": 1}, {"a": 2}] and errors == [3]
+
+
+def test_excluded_entries_are_kept_when_cleaning_fails(tmp_path, monkeypatch):
+    monkeypatch.setattr(clean_dataset, "EXCLUDED", tmp_path)
+    with clean_dataset.ExcludedEntries() as excluded:
+        excluded.add("duplicate_code", RECORDS[0])
+    assert excluded.counts() == {"duplicate_code": 1}
+    with pytest.raises(RuntimeError):
+        with clean_dataset.ExcludedEntries() as excluded:
+            excluded.add("duplicate_code", RECORDS[1])
+            raise RuntimeError("cleaning failed")
+    assert read_jsonl(tmp_path / "duplicate_code.jsonl") == [RECORDS[0]]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["duplicate_code.jsonl"]
@@ -0,0 +1,55 @@
+import pytest
+
+from near_dedup import (MinHasher, NearDuplicateIndex, code_shingles, instruction_shingles,
+                        jaccard, lsh_params)
+
+CODE = "\n".join(
+    f"p{i} = rs.AddPoint({i}, {i * 2}, 0)\nrs.ObjectName(p{i}, 'point {i}')" for i in range(12))
+
+
+def test_lsh_params_meet_the_recall_target():
+    bands, rows = lsh_params(0.85)
+    assert bands * rows <= 128
+    assert 1 - (1 - 0.85 ** rows) ** bands >= 0.95
+
+
+def test_signature_agreement_tracks_jaccard():
+    hasher = MinHasher()
+    a, b = code_shingles(CODE), code_shingles(CODE.replace("'point 3'", "'pt 3'"))
+    sa, sb = hasher.signature(a), hasher.signature(b)
+    agreement = sum(x == y for x, y in zip(sa, sb)) / len(sa)
+    assert abs(agreement - jaccard(a, b)) < 0.15
+    assert hasher.signature(a) == sa
+
+
+def test_code_pair_above_threshold_joins_the_cluster():
+    near = CODE.replace("'point 3'", "'pt 3'")
+    assert jaccard(code_shingles(CODE), code_shingles(near)) >= 0.85
+    index = NearDuplicateIndex(instruction_threshold=None)
+    assert index.add(CODE, "a") == (0, None)
+    cluster, (field, sim) = index.add(near, "b")
+    assert cluster == 0 and field == "code" and sim >= 0.85
+
+
+def test_code_pair_below_threshold_starts_a_new_cluster():
+    far = "\n".join(CODE.splitlines()[:8])
+    assert jaccard(code_shingles(CODE), code_shingles(far)) < 0.85
+    index = NearDuplicateIndex(instruction_threshold=None)
+    index.add(CODE, "a")
+    assert index.add(far, "b") == (1, None)
+    assert index.sizes == [1, 1]
+
+
+@pytest.mark.parametrize("other, same", [
+    ("Create a sphere of radius 5 centered at the origin of the world", True),
+    ("Create a box of width 5 centered at the origin of the world", False),
+])
+def test_instruction_threshold(other, same):
+    instruction = "Create a sphere of radius 5 centered at the origin of the world."
+    index = NearDuplicateIndex(code_threshold=None)
+    index.add("", instruction)
+    cluster, match = index.add("", other)
+    assert (cluster == 0) == same
+    assert (match is not None) == same
+    if same:
+        assert jaccard(instruction_shingles(instruction), instruction_shingles(other)) >= 0.9
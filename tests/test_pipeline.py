@@ -0,0 +1,81 @@
+import sys
+
+import pytest
+
+import pipeline
+from pipeline import HashCache, Stage
+
+# Each stage script appends its name to runs.log, so a test can see what ran.
+UPPER = '''from pathlib import Path
+Path("runs.log").open("a").write("upper\\n")
+Path("mid.txt").write_text(Path("in.txt").read_text().upper())
+'''
+COUNT = '''from pathlib import Path
+Path("runs.log").open("a").write("count\\n")
+Path("out.txt").write_text(str(len(Path("mid.txt").read_text())))
+'''
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    (tmp_path / "upper.py").write_text(UPPER)
+    (tmp_path / "count.py").write_text(COUNT)
+    (tmp_path / "in.txt").write_text("hello")
+    cache = tmp_path / "cache"
+    stages = [Stage("upper", [["upper.py"]], ["upper.py", "in.txt"], ["mid.txt"]),
+              Stage("count", [["count.py"]], ["count.py", "mid.txt"], ["out.txt"])]
+    monkeypatch.setattr(pipeline, "ROOT", tmp_path)
+    monkeypatch.setattr(pipeline, "OBJECTS", cache / "objects")
+    monkeypatch.setattr(pipeline, "MANIFESTS", cache / "manifests")
+    monkeypatch.setattr(pipeline, "HashCache", lambda: HashCache(cache / "hashes.json"))
+    monkeypatch.setattr(pipeline, "STAGES", stages)
+    monkeypatch.setattr(pipeline, "STAGE_NAMES", [s.name for s in stages])
+    return tmp_path
+
+
+@pytest.fixture
+def run(tree, monkeypatch):
+    def run(*args):
+        """Run the pipeline; returns the stages that executed."""
+        log = tree / "runs.log"
+        log.write_text("")
+        monkeypatch.setattr(sys, "argv", ["pipeline.py", *args])
+        pipeline.main()
+        return log.read_text().split()
+    return run
+
+
+def test_unchanged_inputs_are_skipped(tree, run):
+    assert run() == ["upper", "count"]
+    assert (tree / "out.txt").read_text() == "5"
+    assert run() == []
+
+
+def test_changed_input_reruns_the_stage_and_what_it_feeds(tree, run):
+    run()
+    (tree / "in.txt").write_text("hello world")
+    assert run() == ["upper", "count"]
+    assert (tree / "out.txt").read_text() == "11"
+
+
+def test_identical_output_skips_the_next_stage(tree, run):
+    run()
+    (tree / "in.txt").write_text("HELLO")
+    assert run() == ["upper"]
+
+
+def test_reverted_input_restores_instead_of_running(tree, run):
+    run()
+    (tree / "in.txt").write_text("hello world")
+    run()
+    (tree / "in.txt").write_text("hello")
+    assert run() == []
+    assert (tree / "mid.txt").read_text() == "HELLO"
+    assert (tree / "out.txt").read_text() == "5"
+
+
+def test_since_reruns_from_a_stage_and_leaves_earlier_ones_alone(tree, run):
+    run()
+    (tree / "in.txt").write_text("hello world")
+    assert run("--since", "count") == ["count"]
+    assert (tree / "mid.txt").read_text() == "HELLO"
@@ -0,0 +1,93 @@
+import pytest
+
+from coder.prompt_budget import TokenCounter, collapse_turn, fit_history, split_turns
+
+
+@pytest.fixture
+def counter(tmp_path):
+    """A counter with no tokenizer file, so tokens are len(text) // 4."""
+    return TokenCounter(tmp_path / "missing-tokenizer.json")
+
+
+def turn(prompt, reply, failures=0):
+    messages = [{"role": "user", "content": prompt}]
+    for i in range(failures):
+        messages += [{"role": "assistant", "content": f"attempt {i} " + "x" * 200},
+                     {"role": "user", "content": "it failed", "kind": "retry",
+                      "error": f"NameError: bad name {i}\nTraceback..."}]
+    return messages + [{"role": "assistant", "content": reply}]
+
+
+def test_counter_estimates_without_tokenizer(counter):
+    assert not counter.exact
+    assert counter.count("x" * 40) == 10
+    assert counter.count_messages([{"role": "user", "content": "x" * 40}]) == 10 + 4 + 3
+
+
+def test_split_turns_keeps_retries_in_their_turn():
+    history = [{"role": "system", "content": "s"}] + turn("a", "b", failures=2) + turn("c", "d")
+    turns = split_turns(history)
+    assert [len(t) for t in turns] == [6, 2]
+
+
+def test_collapse_turn_summarizes_failed_attempts():
+    collapsed = collapse_turn(turn("make a cube", "done", failures=2))
+    assert len(collapsed) == 2
+    assert collapsed[0]["content"] == ("make a cube\n\n(Earlier attempts failed: "
+                                       "NameError: bad name 0; NameError: bad name 1)")
+    assert collapsed[1]["content"] == "done"
+    plain = turn("make a cube", "done")
+    assert collapse_turn(plain) is plain
+
+
+def test_collapse_keeps_latest_attempt_of_unfinished_turn():
+    unfinished = turn("make a cube", "unused", failures=2)[:-1]
+    collapsed = collapse_turn(unfinished)
+    assert [m.get("kind") for m in collapsed] == [None, None, "retry"]
+    assert "bad name 0" in collapsed[0]["content"]
+    assert "bad name 1" not in collapsed[0]["content"]
+
+
+def test_under_budget_is_sent_as_is(counter):
+    history = [{"role": "system", "content": "s"}] + turn("a", "b")
+    messages, info = fit_history(history, counter, budget=1000)
+    assert messages == [{"role": m["role"], "content": m["content"]} for m in history]
+    assert info["collapsed"] == info["dropped"] == 0 and not info["exact"]
+
+
+def test_context_is_appended_to_its_message(counter):
+    history = [{"role": "system", "content": "s"},
+               {"role": "user", "content": "a", "context": "3 objects"}]
+    messages, _ = fit_history(history, counter)
+    assert messages[1]["content"] == "a\n\n3 objects"
+
+
+def test_trims_old_failures_before_dropping_turns(counter):
+    history = ([{"role": "system", "content": "s"}] + turn("old", "r", failures=3)
+               + turn("mid", "r") + turn("new", "r"))
+    full = counter.count_messages(history)
+    messages, info = fit_history(history, counter, budget=full - 1)
+    assert info["collapsed"] == 1 and info["dropped"] == 0
+    assert "(Earlier attempts failed" in messages[1]["content"]
+    assert history[1]["trim"] == "collapsed"
+
+
+def test_drops_oldest_turns_but_keeps_the_current_one(counter):
+    long = "y" * 400
+    history = ([{"role": "system", "content": "s"}] + turn("one", long) + turn("two", long)
+               + turn("three", long) + turn("current " + long, long))
+    messages, info = fit_history(history, counter, budget=150)
+    assert info["dropped"] == 3 and info["tokens"] > 150
+    assert [m["content"] for m in messages] == ["s", "current " + long, long]
+
+
+def test_trim_marks_are_replayed_so_the_prefix_is_stable(counter):
+    long = "y" * 400
+    history = ([{"role": "system", "content": "s"}] + turn("one", long)
+               + turn("two", long) + turn("three", long))
+    first, info = fit_history(history, counter, budget=300)
+    assert info["dropped"] == 1 and history[1]["trim"] == "dropped"
+    history += turn("four", "short")
+    second, info = fit_history(history, counter, budget=10_000)
+    assert info["dropped"] == 1
+    assert second[:len(first)] == first
@@ -0,0 +1,88 @@
+import time
+
+import pytest
+
+from coder.response_cache import ResponseCache, normalize_prompt
+
+SYSTEM = "You write rhinoscriptsyntax."
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(tmp_path / "cache.json")
+
+
+def test_exact_hit_survives_reload(cache, tmp_path):
+    cache.store(SYSTEM, "Make a sphere of radius 5", "reply", "rs.AddSphere((0,0,0), 5)")
+    reloaded = ResponseCache(tmp_path / "cache.json")
+    entry = reloaded.lookup(SYSTEM, "make a sphere of radius 5")
+    assert entry["code"] == "rs.AddSphere((0,0,0), 5)"
+    assert "similar_to" not in entry
+    assert reloaded.stats()["hits"] == 1
+
+
+def test_system_prompt_is_part_of_the_key(cache):
+    cache.store(SYSTEM, "Make a sphere of radius 5", "reply", "code")
+    assert cache.lookup("another system prompt", "Make a sphere of radius 5") is None
+
+
+def test_punctuation_and_case_still_hit_exactly(cache):
+    cache.store(SYSTEM, "Make a sphere of radius 5", "reply", "code")
+    assert cache.lookup(SYSTEM, "MAKE a sphere, of radius 5!") is not None
+    assert cache.stats()["hits"] == 1
+
+
+@pytest.mark.parametrize("prompt", [
+    "make the sphere of radius 5 at the origin",
+    "Make a sphere at the origin of radius 5",
+])
+def test_near_hit_allows_filler_and_word_order(cache, prompt):
+    cache.store(SYSTEM, "Make a sphere of radius 5 at the origin", "reply", "code")
+    entry = cache.lookup(SYSTEM, prompt)
+    assert entry["similar_to"] == normalize_prompt("Make a sphere of radius 5 at the origin")
+    assert cache.stats()["near_hits"] == 1
+
+
+@pytest.mark.parametrize("prompt", [
+    "Make a sphere of radius 10",               # different number
+    "Move the box to 0,10,0",                   # same numbers, other order
+    "Rotate the box 90 degrees around the z axis",
+])
+def test_near_miss_on_what_matters(cache, prompt):
+    cache.store(SYSTEM, "Make a sphere of radius 5", "reply", "code")
+    cache.store(SYSTEM, "Move the box to 10,0,0", "reply", "code")
+    cache.store(SYSTEM, "Rotate the box 90 degrees around the x axis", "reply", "code")
+    assert cache.lookup(SYSTEM, prompt) is None
+
+
+def test_context_dependent_prompts_bypass_the_cache(cache):
+    cache.store(SYSTEM, "Make it bigger", "reply", "code")
+    assert cache.entries == {}
+    cache.store(SYSTEM, "Make a cube", "reply", "code")
+    assert cache.lookup(SYSTEM, "Make a cube again") is None
+
+
+def test_expired_entries_are_dropped(cache, monkeypatch):
+    cache.store(SYSTEM, "Make a cube", "reply", "code")
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + cache.ttl + 1)
+    assert cache.lookup(SYSTEM, "Make a cube") is None
+    assert cache.entries == {}
+
+
+def test_least_recently_used_is_evicted(tmp_path, monkeypatch):
+    cache = ResponseCache(tmp_path / "cache.json", max_entries=2)
+    clock = iter(range(1000, 2000))
+    monkeypatch.setattr(time, "time", lambda: next(clock))
+    cache.store(SYSTEM, "Make a cube", "reply", "cube")
+    cache.store(SYSTEM, "Make a cone", "reply", "cone")
+    cache.lookup(SYSTEM, "Make a cube")
+    cache.store(SYSTEM, "Make a torus", "reply", "torus")
+    assert sorted(e["code"] for e in cache.entries.values()) == ["cube", "torus"]
+
+
+def test_invalidate_drops_entries_for_failed_code(cache):
+    cache.store(SYSTEM, "Make a cube", "reply", "bad")
+    cache.store(SYSTEM, "Make a cone", "reply", "good")
+    cache.invalidate("bad")
+    assert [e["code"] for e in cache.entries.values()] == ["good"]
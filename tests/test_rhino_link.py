@@ -0,0 +1,162 @@
+import asyncio
+import json
+import socketserver
+import threading
+
+import pytest
+
+from coder.rhino_link import FRAME_HEADER, FRAMING_VERSION, RhinoConnectionPool
+
+
+class FakeListener(socketserver.ThreadingTCPServer):
+    """Speaks the listener protocol; framed only if ``framing`` is set.
+
+    A command whose type is in ``hang_up_on`` makes it close the connection
+    without replying, once per type.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, framing=True, hang_up_on=()):
+        super().__init__(("127.0.0.1", 0), ListenerHandler)
+        self.framing = framing
+        self.hang_up_on = set(hang_up_on)
+        self.commands = []
+        self.connections = 0
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def reply(self, command):
+        self.commands.append(command["type"])
+        if command["type"] in self.hang_up_on:
+            self.hang_up_on.discard(command["type"])
+            return None
+        if command["type"] == "negotiate_protocol" and self.framing:
+            return {"status": "success", "result": {"framing": FRAMING_VERSION}}
+        if command["type"] == "negotiate_protocol":
+            return {"status": "error", "message": "Unknown command type"}
+        return {"status": "success", "result": {"echo": command.get("params")}}
+
+
+class ListenerHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.server.connections += 1
+        framed = False
+        while (command := self.read_framed() if framed else self.read_legacy()) is not None:
+            reply = self.server.reply(command)
+            if reply is None:
+                break
+            payload = json.dumps(reply).encode("utf-8")
+            self.request.sendall(FRAME_HEADER.pack(len(payload)) + payload if framed else payload)
+            framed = framed or (command["type"] == "negotiate_protocol" and self.server.framing)
+
+    def read_exactly(self, n):
+        buf = b""
+        while len(buf) < n:
+            chunk = self.request.recv(n - len(buf))
+            if not chunk:
+                return None
+            buf += chunk
+        return buf
+
+    def read_framed(self):
+        header = self.read_exactly(FRAME_HEADER.size)
+        if header is None:
+            return None
+        payload = self.read_exactly(FRAME_HEADER.unpack(header)[0])
+        return None if payload is None else json.loads(payload)
+
+    def read_legacy(self):
+        buf = b""
+        while chunk := self.request.recv(4096):
+            buf += chunk
+            try:
+                return json.loads(buf)
+            except ValueError:
+                continue
+        return None
+
+
+@pytest.fixture
+def listen():
+    servers = []
+
+    def start(**kwargs):
+        servers.append(FakeListener(**kwargs))
+        return servers[-1]
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def run(port, scenario):
+    """Run ``scenario(pool)`` on one event loop and return its result."""
+    async def main():
+        pool = RhinoConnectionPool("127.0.0.1", port, timeout=5)
+        try:
+            return await scenario(pool)
+        finally:
+            pool.close()
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize("framing", [True, False])
+def test_requests_reuse_one_connection(listen, framing):
+    listener = listen(framing=framing)
+
+    async def scenario(pool):
+        first = await pool.request({"type": "ping", "params": {"n": 1}})
+        second = await pool.request({"type": "ping", "params": {"n": "é" * 10_000}})
+        return pool, first, second
+
+    pool, first, second = run(listener.port, scenario)
+    assert first["result"]["echo"] == {"n": 1}
+    assert second["result"]["echo"] == {"n": "é" * 10_000}
+    assert pool.framing is framing
+    assert listener.commands == ["negotiate_protocol", "ping", "ping"]
+    assert listener.connections == 1
+
+
+def test_listener_hanging_up_on_negotiation_falls_back_to_legacy(listen):
+    listener = listen(framing=False, hang_up_on={"negotiate_protocol"})
+
+    async def scenario(pool):
+        response = await pool.request({"type": "ping"})
+        await pool.request({"type": "ping"})
+        return pool, response
+
+    pool, response = run(listener.port, scenario)
+    assert response["status"] == "success"
+    assert pool.framing is False
+    assert listener.commands == ["negotiate_protocol", "ping", "ping"]
+
+
+def test_idempotent_command_is_retried_on_a_fresh_connection(listen):
+    listener = listen(hang_up_on={"ping"})
+
+    async def scenario(pool):
+        await pool.request({"type": "get_document_info"})
+        return pool, await pool.request({"type": "ping"})
+
+    pool, response = run(listener.port, scenario)
+    assert response["status"] == "success"
+    assert pool.reconnects == 1
+    assert listener.commands.count("ping") == 2
+
+
+def test_sent_script_is_not_resent(listen):
+    listener = listen(hang_up_on={"execute_python_code"})
+
+    async def scenario(pool):
+        await pool.request({"type": "get_document_info"})
+        with pytest.raises(ConnectionError):
+            await pool.request({"type": "execute_python_code", "params": {"code": "x = 1"}})
+        return pool
+
+    pool = run(listener.port, scenario)
+    assert pool.reconnects == 0
+    assert listener.commands.count("execute_python_code") == 1
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Measure how much prefill the server's prompt cache saves for rhino_coder.
+
+Replays a simulated rhino_coder session (eval prompts from valid.jsonl, every
+other one with a failed attempt and a retry turn) against a running server,
+building each prompt exactly as rhino_coder does. Every request asks for a
+single token, so its latency is almost all prefill.
+
+Two passes over the same prompts:
+  warm  in session order, so each prompt extends the previous one
+  cold  with a unique tag at the start of the system prompt, so nothing matches
+
+Start the server with ./serve.sh --prompt-cache, then:
+    python training/bench_prefill.py [--url URL] [--samples N]
+Saves per-request timings to training/results/prefill_bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent
+sys.path.insert(0, str(ROOT.parent))
+import rhino_coder  # noqa: E402
+
+EVAL_PATH = ROOT / "data" / "valid.jsonl"
+OUTPUT_DIR = ROOT / "results"
+OUTPUT_PATH = OUTPUT_DIR / "prefill_bench.json"
+
+N_SAMPLES = 8
+SEED = 42
+FAKE_ERROR = "AttributeError: 'module' object has no attribute 'AddRing'"
+
+
+def build_session(samples: list[dict]) -> list[list[dict]]:
+    """Return the prompt rhino_coder would send before each model reply."""
+    history = [{"role": "system", "content": rhino_coder.SYSTEM_PROMPT}]
+    prompts = []
+    for i, sample in enumerate(samples):
+        instruction = sample["messages"][1]["content"]
+        reference = f"```python\n{sample['messages'][2]['content']}\n```"
+        history.append({"role": "user", "content": instruction})
+        if i % 2:
+            prompts.append(rhino_coder.fit_history(history, rhino_coder.token_counter)[0])
+            history.append({"role": "assistant", "content": "```python\nimport rhinoscriptsyntax as rs\nrs.AddRing()\n```"})
+            history.append({"role": "user", "content": rhino_coder.retry_message(FAKE_ERROR),
+                            "kind": "retry", "error": FAKE_ERROR})
+        prompts.append(rhino_coder.fit_history(history, rhino_coder.token_counter)[0])
+        history.append({"role": "assistant", "content": reference})
+    return prompts
+
+
+async def time_prefill(messages: list[dict]) -> tuple[float, int | None]:
+    """Seconds to get one token back, and the server's prompt token count."""
+    payload = rhino_coder._completion_payload(messages, 0.0, stream=False)
+    payload["max_tokens"] = 1
+    start = time.perf_counter()
+    resp = await rhino_coder._post_completion(payload)
+    try:
+        body = json.loads(await resp.read())
+    finally:
+        resp.close()
+    return time.perf_counter() - start, body.get("usage", {}).get("prompt_tokens")
+
+
+def with_tag(messages: list[dict]) -> list[dict]:
+    tagged = [dict(m) for m in messages]
+    tagged[0]["content"] = f"[bench {uuid.uuid4().hex}] {tagged[0]['content']}"
+    return tagged
+
+
+async def run(prompts: list[list[dict]]) -> list[dict]:
+    rows = [{"request": i + 1} for i in range(len(prompts))]
+    await time_prefill(with_tag(prompts[0]))  # load weights / compile kernels
+
+    for row, messages in zip(rows, prompts):
+        row["warm_s"], tokens = await time_prefill(messages)
+        row["prompt_tokens"] = tokens or rhino_coder.token_counter.count_messages(messages)
+    for row, messages in zip(rows, prompts):
+        row["cold_s"], _ = await time_prefill(with_tag(messages))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--url", default=rhino_coder.MODEL_URL)
+    parser.add_argument("--samples", type=int, default=N_SAMPLES)
+    args = parser.parse_args()
+    rhino_coder.model_router = rhino_coder.ModelRouter([args.url])
+
+    random.seed(SEED)
+    with open(EVAL_PATH) as f:
+        eval_data = [json.loads(line) for line in f if line.strip()]
+    samples = random.sample(eval_data, min(args.samples, len(eval_data)))
+    prompts = build_session(samples)
+
+    print(f"Replaying {len(prompts)} requests against {args.url}")
+    try:
+        rows = asyncio.run(run(prompts))
+    except ConnectionError as e:
+        sys.exit(str(e))
+
+    print(f"\n{'req':>4} {'tokens':>7} {'cold ms':>9} {'warm ms':>9} {'saved':>7}")
+    for r in rows:
+        saved = 1 - r["warm_s"] / r["cold_s"] if r["cold_s"] else 0.0
+        print(f"{r['request']:>4} {r['prompt_tokens']:>7,} {r['cold_s'] * 1000:>9.0f} "
+              f"{r['warm_s'] * 1000:>9.0f} {saved:>7.0%}")
+    cold = sum(r["cold_s"] for r in rows)
+    warm = sum(r["warm_s"] for r in rows)
+    print("=" * 40)
+    print(f"Total cold: {cold:.2f}s  warm: {warm:.2f}s  saved: {1 - warm / cold:.0%}")
+
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
+        json.dump({"url": args.url, "requests": rows,
+                   "cold_s": round(cold, 3), "warm_s": round(warm, 3)}, f, indent=2)
+    print(f"Saved timings to {OUTPUT_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""Compare plain vs. speculative decoding on the validation set.
+
+Runs the same eval prompts (same seed as evaluate.py) through the target model
+alone and with a draft model proposing tokens, greedy in both cases, and
+reports decode tokens/sec and the draft acceptance rate per draft length.
+Greedy speculative decoding should reproduce the plain output exactly; the
+"same output" column checks that.
+
+    python training/bench_speculative.py [--draft PATH] [--num-draft-tokens 2,3,4]
+Saves per-sample numbers to training/results/speculative_bench.json
+"""
+
+import argparse
+import json
+import random
+from pathlib import Path
+from mlx_lm import load, stream_generate
+
+ROOT = Path(__file__).resolve().parent
+MODEL_PATH = str(ROOT / "models" / "rhino-coder-fused")
+# The LoRA-tuned draft from `training/train.sh --draft` if present, else the stock one
+DRAFT_PATH = str(ROOT / "models" / "rhino-coder-draft-fused")
+if not Path(DRAFT_PATH).exists():
+    DRAFT_PATH = str(ROOT / "models" / "qwen-coder-0.5b-4bit")
+EVAL_PATH = ROOT / "data" / "valid.jsonl"
+OUTPUT_DIR = ROOT / "results"
+OUTPUT_PATH = OUTPUT_DIR / "speculative_bench.json"
+
+SYSTEM_PROMPT = (
+    "You are an expert Rhino3D Python programmer. "
+    "Write clean, working scripts using rhinoscriptsyntax and RhinoCommon. "
+    "Include all necessary imports. Only output code, no explanations unless asked."
+)
+
+N_SAMPLES = 10
+SEED = 42
+MAX_TOKENS = 512
+
+
+def run(model, tokenizer, prompt: str, draft_model=None, num_draft_tokens: int = 0) -> dict:
+    """Generate once; returns the text, decode speed and draft token counts."""
+    kwargs = {}
+    if draft_model is not None:
+        kwargs = {"draft_model": draft_model, "num_draft_tokens": num_draft_tokens}
+    text, accepted, tokens, last = [], 0, 0, None
+    for last in stream_generate(model, tokenizer, prompt, max_tokens=MAX_TOKENS, **kwargs):
+        text.append(last.text)
+        tokens += 1
+        accepted += bool(getattr(last, "from_draft", False))
+    # Every verification round ends with exactly one token from the target
+    # model, after proposing num_draft_tokens.
+    rounds = tokens - accepted
+    proposed = rounds * num_draft_tokens
+    return {
+        "text": "".join(text),
+        "tokens": tokens,
+        "tok_s": round(last.generation_tps, 1) if last else 0.0,
+        "accepted": accepted,
+        "acceptance": round(accepted / proposed, 3) if proposed else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--draft", default=DRAFT_PATH)
+    parser.add_argument("--num-draft-tokens", default="3",
+                        help="comma-separated draft lengths to try (default 3)")
+    parser.add_argument("--samples", type=int, default=N_SAMPLES)
+    args = parser.parse_args()
+    draft_lengths = [int(n) for n in args.num_draft_tokens.split(",")]
+
+    random.seed(SEED)
+    with open(EVAL_PATH) as f:
+        eval_data = [json.loads(line) for line in f if line.strip()]
+    samples = random.sample(eval_data, min(args.samples, len(eval_data)))
+
+    print(f"Loading model from {args.model}")
+    model, tokenizer = load(args.model)
+    print(f"Loading draft model from {args.draft}")
+    draft_model, _ = load(args.draft)
+
+    prompts = [
+        tokenizer.apply_chat_template(
+            [{"role": "system", "content": SYSTEM_PROMPT},
+             {"role": "user", "content": s["messages"][1]["content"]}],
+            tokenize=False, add_generation_prompt=True)
+        for s in samples
+    ]
+    run(model, tokenizer, prompts[0])  # compile kernels before timing
+    run(model, tokenizer, prompts[0], draft_model, draft_lengths[0])
+
+    rows = []
+    for i, prompt in enumerate(prompts):
+        print(f"\n[{i+1}/{len(prompts)}] {samples[i]['messages'][1]['content'][:70]}...")
+        base = run(model, tokenizer, prompt)
+        row = {"instruction": samples[i]["messages"][1]["content"],
+               "tokens": base["tokens"], "base_tok_s": base["tok_s"], "draft": {}}
+        print(f"  plain       {base['tok_s']:6.1f} tok/s  ({base['tokens']} tokens)")
+        for k in draft_lengths:
+            spec = run(model, tokenizer, prompt, draft_model, k)
+            row["draft"][k] = {"tok_s": spec["tok_s"], "acceptance": spec["acceptance"],
+                               "same_output": spec["text"] == base["text"]}
+            print(f"  draft k={k}   {spec['tok_s']:6.1f} tok/s  "
+                  f"acceptance {spec['acceptance'] or 0:.0%}  "
+                  f"{'same output' if spec['text'] == base['text'] else 'OUTPUT DIFFERS'}")
+        rows.append(row)
+
+    print("\n" + "=" * 60)
+    base_avg = sum(r["base_tok_s"] for r in rows) / len(rows)
+    print(f"{'':12} {'tok/s':>8} {'speedup':>8} {'accept':>8} {'same':>6}")
+    print(f"{'plain':12} {base_avg:8.1f} {'1.00x':>8}")
+    summary = {"model": args.model, "draft": args.draft, "base_tok_s": round(base_avg, 1)}
+    for k in draft_lengths:
+        tok_s = sum(r["draft"][k]["tok_s"] for r in rows) / len(rows)
+        rates = [r["draft"][k]["acceptance"] for r in rows if r["draft"][k]["acceptance"] is not None]
+        accept = sum(rates) / len(rates) if rates else 0.0
+        same = sum(r["draft"][k]["same_output"] for r in rows)
+        print(f"{'draft k=' + str(k):12} {tok_s:8.1f} {tok_s / base_avg:7.2f}x "
+              f"{accept:8.0%} {same:>3}/{len(rows)}")
+        summary[f"k{k}"] = {"tok_s": round(tok_s, 1), "speedup": round(tok_s / base_avg, 2),
+                            "acceptance": round(accept, 3), "same_output": same}
+    print("=" * 60)
+
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
+        json.dump({"summary": summary, "samples": rows}, f, indent=2)
+    print(f"Saved results to {OUTPUT_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
 """Phase 4.1: Run eval prompts through the fine-tuned model (with LoRA adapter).
 Uses the same 10 samples as baseline for direct comparison.
+Pass --draft-model PATH to decode speculatively (greedy, so outputs match).
 Saves outputs to training/results/finetuned_outputs.jsonl
 """
 
+import argparse
 import json
 import random
 from pathlib import Path
@@ -25,6 +27,7 @@ SYSTEM_PROMPT = (
 N_SAMPLES = 10
 SEED = 42
 MAX_TOKENS = 1024
+NUM_DRAFT_TOKENS = 3
 
 
 def clean_output(text: str) -> str:
@@ -39,6 +42,11 @@ def clean_output(text: str) -> str:
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--draft-model", help="small model for speculative decoding")
+    parser.add_argument("--num-draft-tokens", type=int, default=NUM_DRAFT_TOKENS)
+    args = parser.parse_args()
+
     # Same seed & sampling as baseline for direct comparison
     random.seed(SEED)
     with open(EVAL_PATH) as f:
@@ -49,6 +57,11 @@ def main():
     print(f"Loading model from {MODEL_PATH}")
     print(f"Loading adapter from {ADAPTER_PATH}")
     model, tokenizer = load(MODEL_PATH, adapter_path=ADAPTER_PATH)
+    draft = {}
+    if args.draft_model:
+        print(f"Loading draft model from {args.draft_model}")
+        draft_model, _ = load(args.draft_model)
+        draft = {"draft_model": draft_model, "num_draft_tokens": args.num_draft_tokens}
 
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
     results = []
@@ -67,7 +80,8 @@ def main():
 
         print(f"\n[{i+1}/{N_SAMPLES}] {instruction[:80]}...")
         output = generate(
-            model, tokenizer, prompt=prompt, max_tokens=MAX_TOKENS, verbose=False
+            model, tokenizer, prompt=prompt, max_tokens=MAX_TOKENS, verbose=False,
+            **draft,
         )
 
         output = clean_output(output)
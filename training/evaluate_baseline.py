@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 """Phase 2.3: Run 10 eval prompts through the base model (no fine-tuning).
+Pass --draft-model PATH to decode speculatively (greedy, so outputs match).
 Saves outputs to training/results/baseline_outputs.jsonl
 """
 
+import argparse
 import json
 import random
 from pathlib import Path
@@ -23,9 +25,15 @@ SYSTEM_PROMPT = (
 N_SAMPLES = 10
 SEED = 42
 MAX_TOKENS = 1024
+NUM_DRAFT_TOKENS = 3
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--draft-model", help="small model for speculative decoding")
+    parser.add_argument("--num-draft-tokens", type=int, default=NUM_DRAFT_TOKENS)
+    args = parser.parse_args()
+
     # Pick 10 diverse examples from eval set
     random.seed(SEED)
     with open(EVAL_PATH) as f:
@@ -35,6 +43,11 @@ def main():
 
     print(f"Loading model from {MODEL_PATH} ...")
     model, tokenizer = load(MODEL_PATH)
+    draft = {}
+    if args.draft_model:
+        print(f"Loading draft model from {args.draft_model}")
+        draft_model, _ = load(args.draft_model)
+        draft = {"draft_model": draft_model, "num_draft_tokens": args.num_draft_tokens}
 
     OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
     results = []
@@ -54,7 +67,8 @@ def main():
 
         print(f"\n[{i+1}/{N_SAMPLES}] {instruction[:80]}...")
         output = generate(
-            model, tokenizer, prompt=prompt, max_tokens=MAX_TOKENS, verbose=False
+            model, tokenizer, prompt=prompt, max_tokens=MAX_TOKENS, verbose=False,
+            **draft,
         )
 
         result = {
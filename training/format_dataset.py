@@ -1,9 +1,9 @@
 #!/usr/bin/env python3
 """Phase 1 of TODO5: Format pairs.jsonl → chat format, split train/eval, sanity check."""
 
-import json
 import random
 import ast
+import sys
 from pathlib import Path
 from collections import Counter
 
@@ -11,6 +11,9 @@ ROOT = Path(__file__).resolve().parent          # training/
 DATA_DIR = ROOT / "data"
 PAIRS = ROOT.parent / "data" / "processed" / "pairs.jsonl"
 
+sys.path.insert(0, str(ROOT.parent / "data" / "scripts"))
+import jsonl_io  # noqa: E402
+
 SYSTEM_PROMPT = (
     "You are an expert Rhino3D Python programmer. "
     "Write clean, working scripts using rhinoscriptsyntax and RhinoCommon. "
@@ -47,12 +50,7 @@ def estimate_tokens(text: str) -> int:
 
 def main():
     # --- Load ---
-    entries = []
-    with open(PAIRS, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                entries.append(json.loads(line))
+    entries = jsonl_io.read_jsonl(PAIRS)
     print(f"Loaded {len(entries)} pairs from {PAIRS.name}")
 
     # --- Convert to chat format ---
@@ -61,9 +59,7 @@ def main():
     # --- Save full chat-formatted file ---
     DATA_DIR.mkdir(parents=True, exist_ok=True)
     chat_path = DATA_DIR / "chat_formatted.jsonl"
-    with open(chat_path, "w", encoding="utf-8") as f:
-        for ce in chat_entries:
-            f.write(json.dumps(ce, ensure_ascii=False) + "\n")
+    jsonl_io.write_jsonl(chat_path, chat_entries)
     print(f"Wrote {len(chat_entries)} → {chat_path.name}")
 
     # --- Shuffle & split ---
@@ -83,9 +79,7 @@ def main():
     valid_path = DATA_DIR / "valid.jsonl"
 
     for path, data in [(train_path, train_entries), (valid_path, eval_entries)]:
-        with open(path, "w", encoding="utf-8") as f:
-            for ce in data:
-                f.write(json.dumps(ce, ensure_ascii=False) + "\n")
+        jsonl_io.write_jsonl(path, data)
     print(f"Train: {len(train_entries)} → {train_path.name}")
     print(f"Eval:  {len(eval_entries)} → {valid_path.name}")
 